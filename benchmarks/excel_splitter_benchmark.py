@@ -0,0 +1,166 @@
+# benchmarks/excel_splitter_benchmark.py - División del libro de inventarios diarios por hoja
+#
+# Uso:
+#   python benchmarks/excel_splitter_benchmark.py              # 250 hojas de 400 filas
+#   python benchmarks/excel_splitter_benchmark.py 250 1000 5   # hojas, filas por hoja, hojas para la referencia
+#
+# La referencia es el divisor anterior: ws.cell(row, column) sobre el libro read_only
+# (cada acceso vuelve a recorrer el XML de la hoja) y Workbook() normal de salida.
+# Solo se mide con unas pocas hojas y se extrapola: con el libro completo tarda horas.
+# Se comprueba que ambos generan exactamente las mismas celdas.
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import Workbook, load_workbook  # noqa: E402
+
+from utils.excel_splitter import _parse_sheet_date, dividir_excel_por_dias  # noqa: E402
+
+SHEETS = 250
+ROWS = 400
+LEGACY_SHEETS = 2
+
+HEADER = ['Item', 'Código del Material', 'Texto breve de material', 'Unidad Medida', 'Ubicación', 'Físico',
+          'Stock sistema', 'Diferencia', 'Observaciones', 'Responsable']
+
+
+def build_workbook(path: str, sheets: int, rows: int, rng: random.Random):
+    """Libro como los del conteo diario: título, fila vacía, encabezado y filas con ruido.
+    Workbook normal y no write_only: como Excel, guarda las dimensiones de cada hoja
+    (el divisor anterior las necesita para ws.max_row / ws.max_column)."""
+    wb = Workbook()
+    wb.remove(wb.active)
+    first = date(2025, 4, 1)
+    for day in range(sheets):
+        ws = wb.create_sheet(f'{first + timedelta(days=day):%d-%m-%Y}')
+        ws.append([f'INVENTARIO DIARIO {first + timedelta(days=day):%d/%m/%Y}'])
+        ws.append([])
+        ws.append(HEADER)
+        for item in range(1, rows + 1):
+            fisico = rng.randint(0, 500)
+            stock = fisico + rng.choice([0, 0, 0, -3, 5])
+            code = '' if rng.random() < 0.03 else f'MAT-{rng.randint(1, 5000):05d}'
+            ws.append([item, code, f'Material  "{item}"\n{rng.choice(["CAL", "ARENA", "CEMENTO"])}', 'UN',
+                       f'{rng.choice("ABCDE")} - {rng.randint(1, 20):02d} - {rng.randint(1, 20):02d}'.lower(),
+                       fisico, stock, fisico - stock, rng.choice([None, 'OK', ' revisar  ']), 'JPEREZ'])
+    wb.save(path)
+
+
+# ================= REFERENCIA (divisor anterior) =================
+
+def _legacy_find_header_row_and_map(ws):
+    required = {
+        "Item": ["Item"],
+        "Código del Material": ["Código del Material", "Codigo del Material", "Codigo", "COD", "Material"],
+        "Texto breve de material": ["Texto breve de material", "Texto breve", "Descripcion", "Descripción", "Texto"],
+        "Unidad Medida": ["Unidad Medida", "Unidad", "Unidad de medida", "Unidad de medida base", "U.M.", "UM"],
+        "Ubicación": ["Ubicación", "Ubicacion", "Location", "UBI"],
+        "Fisico": ["Fisico", "Físico", "Libre utilización", "Libre utilizacion", "Cantidad", "Stock contado"],
+        "STOCK": ["STOCK", "Stock", "Stock sistema", "SISTEMA"],
+        "Difere": ["Difere", "Difer", "Diferencia"],
+        "Observac.": ["Observac.", "Observacion", "Observación", "Obs", "Observaciones"],
+    }
+    required_norm = {k: [_legacy_norm(x).lower() for x in v] for k, v in required.items()}
+    best_row, best_map = None, {}
+    for r in range(1, 31):
+        headers = [_legacy_norm(ws.cell(row=r, column=c).value).lower() for c in range(1, ws.max_column + 1)]
+        mapping = {}
+        for std_name, aliases in required_norm.items():
+            for idx, h in enumerate(headers):
+                if h in aliases:
+                    mapping[std_name] = idx
+                    break
+        min_core = ["Código del Material", "Texto breve de material", "Unidad Medida", "Ubicación", "Fisico"]
+        if sum(1 for x in min_core if x in mapping) >= 4:
+            if best_row is None or len(mapping) > len(best_map):
+                best_row, best_map = r, mapping
+            if len(mapping) >= 7:
+                break
+    return best_row, best_map
+
+
+def _legacy_norm(s):
+    if s is None:
+        return ""
+    s = str(s).replace("\n", " ").replace("\r", " ").replace("\u00a0", " ")
+    s = re.sub(r"\s+", " ", s).strip()
+    return s.replace('"', "").replace("“", "").replace("”", "")
+
+
+def legacy_split(archivo_excel: str, salida_base: str, limit: int):
+    wb = load_workbook(filename=archivo_excel, read_only=True, data_only=True)
+    headers_out = ["Item", "Código del Material", "Texto breve de material", "Unidad Medida", "Ubicación", "Fisico",
+                   "STOCK", "Difere", "Observac."]
+    generados = []
+    for sheet_name in wb.sheetnames[:limit]:
+        fecha = _parse_sheet_date(sheet_name)
+        ws = wb[sheet_name]
+        header_row, colmap = _legacy_find_header_row_and_map(ws)
+        out_dir = Path(salida_base) / f"{fecha.year}" / f"{fecha.month:02d}"
+        out_dir.mkdir(parents=True, exist_ok=True)
+        out_path = out_dir / f"inventario_{fecha:%Y_%m_%d}.xlsx"
+        out_wb = Workbook()
+        out_ws = out_wb.active
+        out_ws.title = f"{fecha:%d-%m-%Y}"
+        out_ws.append(headers_out)
+        for r in range(header_row + 1, ws.max_row + 1):
+            row = []
+            for h in headers_out:
+                val = ws.cell(row=r, column=colmap[h] + 1).value
+                val = _legacy_norm(val).replace(" ", "").upper() if h == "Ubicación" else _legacy_norm(val)
+                row.append(val)
+            if not row[1]:
+                continue
+            out_ws.append(row)
+        out_wb.save(str(out_path))
+        generados.append(out_path)
+    wb.close()
+    return generados
+
+
+def _cells(path: Path):
+    wb = load_workbook(path, read_only=True)
+    ws = wb.worksheets[0]
+    data = (ws.title, [tuple(row) for row in ws.iter_rows(values_only=True)])
+    wb.close()
+    return data
+
+
+def main():
+    sheets = int(sys.argv[1]) if len(sys.argv) > 1 else SHEETS
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else ROWS
+    legacy_sheets = min(int(sys.argv[3]) if len(sys.argv) > 3 else LEGACY_SHEETS, sheets)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, 'inventario_anual.xlsx')
+        build_workbook(source, sheets, rows, random.Random(7))
+        print(f'{sheets} hojas x {rows} filas ({os.path.getsize(source) / 1024 / 1024:.1f} MB)')
+
+        started = time.perf_counter()
+        legacy = legacy_split(source, os.path.join(tmp, 'anterior'), legacy_sheets)
+        legacy_seconds = (time.perf_counter() - started) / legacy_sheets
+
+        timings = {}
+        for workers in (1, None):
+            started = time.perf_counter()
+            current = dividir_excel_por_dias(source, os.path.join(tmp, f'actual_{workers}'), anio=2025, mes_inicio=1,
+                                             mes_fin=12, max_workers=workers)
+            timings[workers] = time.perf_counter() - started
+
+        mismatches = sum(_cells(old) != _cells(new) for old, new in zip(legacy, current))
+        print(f'{len(current)} archivos, {mismatches} distintos de la referencia (en {legacy_sheets} hojas)')
+        print(f'  anterior: {legacy_seconds:8.2f} s/hoja  (~{legacy_seconds * len(current) / 60:.1f} min el libro)')
+        print(f'  en serie: {timings[1] / len(current):8.3f} s/hoja  ({timings[1]:.1f} s el libro)')
+        print(f'  pool ({os.cpu_count()}): {timings[None] / len(current):8.3f} s/hoja  ({timings[None]:.1f} s el libro)')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# benchmarks/ocr_batch_benchmark.py - OCR por página vs. OCR por lotes de Tesseract
+#
+# Uso (requiere tesseract-ocr y tesseract-ocr-spa instalados):
+#   python benchmarks/ocr_batch_benchmark.py                 # corpus sintético de 50 páginas escaneadas
+#   python benchmarks/ocr_batch_benchmark.py documento.pdf   # páginas de un PDF real
+#
+# Compara el camino anterior (pytesseract.image_to_string por página: un proceso
+# de Tesseract y una carga de spa.traineddata por página) contra ocr_pdf_pages,
+# que pasa OCR_BATCH_PAGES páginas por invocación.
+import io
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402
+import pytesseract  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from utils.ocr_reader import OCR_BATCH_PAGES, OCR_CONFIG, get_ocr_reader, ocr_pdf_pages, render_pdf_page  # noqa: E402
+
+CORPUS_PAGES = 50
+
+TICKET_LINES = [
+    'TICKET DE BASCULA',
+    'PROCESO : {proceso} NRO. PESAJE : {pesaje}',
+    'FECHA: {dia:02d}/01/2026',
+    'CONDUCTOR: MEDINA PEREZ JHON',
+    'PLACA : CDL{placa}',
+    'TARA 16910 BRUTO 48590 NETO {neto}',
+    'MATERIAL: OXIDO DE CALCIO',
+    'RUC 20402885541 DNI 46695131',
+]
+
+
+def build_corpus(path: str, pages: int = CORPUS_PAGES):
+    """PDF de páginas escaneadas (solo imagen, sin capa de texto)"""
+    font = ImageFont.load_default(size=28)
+    doc = fitz.open()
+    for i in range(pages):
+        image = Image.new('L', (1240, 1754), 255)
+        draw = ImageDraw.Draw(image)
+        for line_num, line in enumerate(TICKET_LINES):
+            text = line.format(proceso=852000 + i, pesaje=1677000 + i, dia=i % 28 + 1, placa=700 + i, neto=31000 + i)
+            draw.text((100, 120 + line_num * 60), text, fill=0, font=font)
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=_png_bytes(image))
+    doc.save(path)
+    doc.close()
+
+
+def _png_bytes(image: Image.Image) -> bytes:
+    output = io.BytesIO()
+    image.save(output, format='PNG')
+    return output.getvalue()
+
+
+def per_page(pdf_path: str, page_nums):
+    doc = fitz.open(pdf_path)
+    try:
+        return [pytesseract.image_to_string(render_pdf_page(doc.load_page(n)), config=OCR_CONFIG, lang='spa')
+                for n in page_nums]
+    finally:
+        doc.close()
+
+
+def batched(pdf_path: str, page_nums):
+    return [text for _, text, _, _ in ocr_pdf_pages(pdf_path, page_nums)]
+
+
+def _normalize(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def main():
+    if not get_ocr_reader().tesseract_available:
+        print('Tesseract no está instalado')
+        return 1
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if len(sys.argv) > 1:
+            pdf_path = sys.argv[1]
+        else:
+            pdf_path = os.path.join(tmp_dir, 'corpus.pdf')
+            build_corpus(pdf_path)
+
+        with fitz.open(pdf_path) as doc:
+            page_nums = list(range(len(doc)))
+        print(f'{len(page_nums)} páginas, {OCR_BATCH_PAGES} páginas por lote')
+
+        timings = {}
+        outputs = {}
+        for name, function in (('por página', per_page), ('por lotes', batched)):
+            started = time.perf_counter()
+            outputs[name] = function(pdf_path, page_nums)
+            timings[name] = time.perf_counter() - started
+            print(f'{name:>11}: {timings[name]:7.2f} s  ({len(page_nums) / timings[name]:.2f} páginas/s)')
+
+        same = sum(_normalize(a) == _normalize(b) for a, b in zip(outputs['por página'], outputs['por lotes']))
+        print(f'   speedup: {timings["por página"] / timings["por lotes"]:.2f}x')
+        print(f' idénticas: {same}/{len(page_nums)} páginas')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,92 @@
+# benchmarks/ocr_preprocess_benchmark.py - Perfiles de preprocesado: tiempo de OCR y campos extraídos
+#
+# Uso (requiere tesseract-ocr y tesseract-ocr-spa instalados):
+#   python benchmarks/ocr_preprocess_benchmark.py              # 20 fotos sintéticas de tickets
+#   python benchmarks/ocr_preprocess_benchmark.py 50           # otra cantidad
+#
+# Cada foto simula una cámara de celular: giro de hasta ±4°, iluminación despareja,
+# ruido y marco oscuro. Para cada perfil de utils/ocr_preprocess.py se mide el tiempo
+# de preprocesado, el de OCR y cuántos de los campos del parser coinciden con los
+# que se extraen del texto original del ticket.
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+import pytesseract  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from ocr_batch_benchmark import TICKET_LINES  # noqa: E402
+from utils.document_parser import parse_warehouse_document  # noqa: E402
+from utils.ocr_preprocess import PREPROCESS_PROFILES  # noqa: E402
+from utils.ocr_reader import OCR_CONFIG, get_ocr_reader, prepare_image  # noqa: E402
+
+CORPUS_SIZE = 20
+
+
+def build_photo(index: int, rng: random.Random):
+    """(imagen, texto original) de un ticket fotografiado"""
+    lines = [line.format(proceso=852000 + index, pesaje=1677000 + index, dia=index % 28 + 1,
+                         placa=700 + index, neto=31000 + index) for line in TICKET_LINES]
+    font = ImageFont.load_default(size=48)
+    image = Image.new('L', (2480, 3508), 255)
+    draw = ImageDraw.Draw(image)
+    for line_num, line in enumerate(lines):
+        draw.text((200, 300 + line_num * 110), line, fill=0, font=font)
+    image = image.rotate(rng.uniform(-4, 4), resample=Image.Resampling.BICUBIC, expand=True, fillcolor=255)
+
+    pixels = np.asarray(image, dtype=np.float32)
+    light = np.linspace(rng.uniform(0.55, 0.75), 1.0, pixels.shape[1], dtype=np.float32)
+    pixels = pixels * light[None, :] + np.random.default_rng(index).normal(0, 12, pixels.shape)
+    frame = rng.randint(40, 120)
+    pixels[:frame, :] = pixels[-frame:, :] = 25
+    pixels[:, :frame] = pixels[:, -frame:] = 25
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)), '\n'.join(lines)
+
+
+def field_hits(text: str, expected: dict) -> int:
+    found = parse_warehouse_document(text).get('campos_extraidos', {})
+    return sum(1 for field, value in expected.items() if found.get(field) == value)
+
+
+def main():
+    if not get_ocr_reader().tesseract_available:
+        print('Tesseract no está instalado')
+        return 1
+
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else CORPUS_SIZE
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus = []
+        for index in range(size):
+            image, text = build_photo(index, rng)
+            path = os.path.join(tmp_dir, f'{index:03d}.png')
+            image.save(path)
+            corpus.append((path, parse_warehouse_document(text)['campos_extraidos']))
+        total_fields = sum(len(expected) for _, expected in corpus)
+        print(f'{size} fotos, {total_fields} campos esperados')
+        print(f'{"perfil":>8} {"preproc s":>10} {"OCR s":>8} {"campos":>12}')
+
+        for profile in PREPROCESS_PROFILES:
+            prep_seconds = ocr_seconds = 0.0
+            hits = 0
+            for path, expected in corpus:
+                started = time.perf_counter()
+                image = prepare_image(Image.open(path), profile)
+                prep_seconds += time.perf_counter() - started
+
+                started = time.perf_counter()
+                text = pytesseract.image_to_string(image, config=OCR_CONFIG, lang='spa')
+                ocr_seconds += time.perf_counter() - started
+                hits += field_hits(text, expected)
+            print(f'{profile:>8} {prep_seconds:10.2f} {ocr_seconds:8.2f} {hits:5d}/{total_fields} '
+                  f'({hits / total_fields:.0%})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,135 @@
+# benchmarks/ocr_template_benchmark.py - OCR de página completa vs. OCR por regiones de plantilla
+#
+# Uso (requiere tesseract-ocr y tesseract-ocr-spa instalados):
+#   python benchmarks/ocr_template_benchmark.py        # 30 páginas escaneadas (ticket, guía y mercancía)
+#   python benchmarks/ocr_template_benchmark.py 90     # otra cantidad
+#
+# Las páginas se dibujan con el formato de las plantillas de utils/ocr_templates.py
+# (etiqueta a la izquierda, valor en la caja del campo). Para cada modo se mide el
+# tiempo total y cuántos campos del parser coinciden con los del texto original.
+# Antes se comprueba, sin Tesseract, que el texto armado por cada plantilla devuelve
+# en el parser el campo de cada región (utils.ocr_templates.unparsed_regions).
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import fitz  # noqa: E402
+from PIL import Image, ImageDraw, ImageFont  # noqa: E402
+
+from ocr_batch_benchmark import _png_bytes  # noqa: E402
+from utils.document_parser import parse_warehouse_document  # noqa: E402
+from utils.ocr_reader import get_ocr_reader, ocr_pdf_pages  # noqa: E402
+from utils.ocr_templates import DOCUMENT_TEMPLATES, unparsed_regions  # noqa: E402
+
+CORPUS_PAGES = 30
+PAGE_SIZE = (1240, 1754)  # A4 a 150 dpi
+
+SAMPLE_VALUES = {
+    'PROCESO': '{proceso}',
+    'PESAJE': '{pesaje}',
+    'N° GUIA': '{pesaje}',
+    'FECHA': '{dia:02d}/01/2026',
+    'PLACA': 'CDL-{placa}',
+    'CONDUCTOR': 'MEDINA PEREZ JHON',
+    'TARA': '16910',
+    'BRUTO': '48590',
+    'NETO': '{neto}',
+    'MATERIAL': 'OXIDO DE CALCIO 71.52%',
+    'PRODUCTO': 'OXIDO DE CALCIO 71.52%',
+    'RUC': '20402885541',
+    'RUC PROVEEDOR': '20402885541',
+    'RUC TRANSPORTISTA': '20{transportista}',
+    'DNI': '46695131',
+    'LICENCIA': 'Q46695131',
+    'CANTIDAD': '{neto}',
+    'UNIDAD': 'KILOGRAMOS',
+    'PESO NETO': '{neto}',
+    'PESO BRUTO': '48590',
+}
+
+
+def sample_values(index: int) -> dict:
+    """Valor impreso de cada etiqueta en la página index"""
+    values = dict(proceso=852000 + index, pesaje=1677000 + index, dia=index % 28 + 1, placa=700 + index,
+                  neto=31000 + index, transportista=f'{index:09d}')
+    return {label: value.format(**values) for label, value in SAMPLE_VALUES.items()}
+
+
+def check_templates() -> bool:
+    """Cada región con campo del parser lo devuelve en el texto armado por su plantilla"""
+    ok = True
+    for template in DOCUMENT_TEMPLATES.values():
+        missing = unparsed_regions(template, sample_values(0))
+        if missing:
+            print(f'Plantilla {template.name}: el parser no lee {", ".join(missing)}')
+            ok = False
+    return ok
+
+
+def build_page(index: int, template):
+    """(imagen, texto original) de una página con el formato de la plantilla"""
+    values = sample_values(index)
+    font = ImageFont.load_default(size=26)
+    image = Image.new('L', PAGE_SIZE, 255)
+    draw = ImageDraw.Draw(image)
+    width, height = PAGE_SIZE
+    draw.text((int(0.08 * width), int(0.02 * height)), template.title, fill=0, font=font)
+    lines = [template.title]
+    for region in template.fields:
+        value = values[region.label]
+        top = int((region.box[1] + 0.01) * height)
+        draw.text((int(0.08 * width), top), f'{region.label}:', fill=0, font=font)
+        draw.text((int(region.box[0] * width) + 10, top), value, fill=0, font=font)
+        lines.append(f'{region.label}: {value}')
+    return image, '\n'.join(lines)
+
+
+def build_corpus(path: str, pages: int):
+    """PDF escaneado (solo imagen) con los tres formatos alternados; devuelve el texto de cada página"""
+    templates = list(DOCUMENT_TEMPLATES.values())
+    texts = []
+    doc = fitz.open()
+    for i in range(pages):
+        image, text = build_page(i, templates[i % len(templates)])
+        page = doc.new_page(width=595, height=842)
+        page.insert_image(page.rect, stream=_png_bytes(image))
+        texts.append(text)
+    doc.save(path)
+    doc.close()
+    return texts
+
+
+def field_hits(text: str, expected: dict) -> int:
+    found = parse_warehouse_document(text).get('campos_extraidos', {})
+    return sum(1 for field, value in expected.items() if found.get(field) == value)
+
+
+def main():
+    if not check_templates():
+        return 1
+    if not get_ocr_reader().tesseract_available:
+        print('Tesseract no está instalado')
+        return 1
+
+    pages = int(sys.argv[1]) if len(sys.argv) > 1 else CORPUS_PAGES
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        pdf_path = os.path.join(tmp_dir, 'corpus.pdf')
+        expected = [parse_warehouse_document(text)['campos_extraidos'] for text in build_corpus(pdf_path, pages)]
+        total_fields = sum(len(fields) for fields in expected)
+        print(f'{pages} páginas, {total_fields} campos esperados')
+
+        for name, templates in (('página completa', False), ('plantillas', True)):
+            started = time.perf_counter()
+            results = ocr_pdf_pages(pdf_path, templates=templates)
+            seconds = time.perf_counter() - started
+            hits = sum(field_hits(text, fields) for (_, text, _, _), fields in zip(results, expected))
+            print(f'{name:>16}: {seconds:7.2f} s  ({seconds / pages * 1000:6.0f} ms/página)  '
+                  f'campos {hits}/{total_fields} ({hits / total_fields:.0%})')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
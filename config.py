@@ -9,3 +9,33 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SECRET_KEY = os.getenv("SECRET_KEY", "super-secret-key")
+    WAREHOUSE2D_JANITOR_INTERVAL = int(os.getenv("WAREHOUSE2D_JANITOR_INTERVAL", "300"))
+    # "sqlite" = archivo local warehouse_data.db; "database" = base principal (multi-nodo)
+    WAREHOUSE2D_STORAGE = os.getenv("WAREHOUSE2D_STORAGE", "sqlite")
+    # Layouts con rejilla NumPy en memoria (LRU) para el mapa 2D
+    WAREHOUSE2D_GRID_CACHE_SIZE = int(os.getenv("WAREHOUSE2D_GRID_CACHE_SIZE", "16"))
+    # Memoria máxima (MB) de cada cache de rejillas: layouts subidos y mapa en vivo
+    WAREHOUSE2D_GRID_CACHE_MB = int(os.getenv("WAREHOUSE2D_GRID_CACHE_MB", "512"))
+    # Mapa en vivo (?source=live): segundos máximos antes de releer si el cambio vino de otro proceso
+    WAREHOUSE2D_LIVE_TTL = int(os.getenv("WAREHOUSE2D_LIVE_TTL", "60"))
+    WAREHOUSE2D_LIVE_CACHE_SIZE = int(os.getenv("WAREHOUSE2D_LIVE_CACHE_SIZE", "8"))
+    # Procesos del pool de OCR de documentos (0 = uno por núcleo)
+    OCR_POOL_WORKERS = int(os.getenv("OCR_POOL_WORKERS", "0"))
+    # Preprocesado de OCR por defecto si la subida no indica el tipo (basico, ticket, guia, foto)
+    OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "basico")
+    # OCR solo de las regiones de los campos en los formatos conocidos (ticket, guia, mercancia)
+    OCR_TEMPLATES = os.getenv("OCR_TEMPLATES", "0").lower() in ("1", "true", "si")
+    # Cortar el OCR de un PDF en cuanto aparecen los campos requeridos (la subida puede pedir full=1)
+    DOCUMENT_EARLY_EXIT = os.getenv("DOCUMENT_EARLY_EXIT", "1").lower() in ("1", "true", "si")
+    # Campos que cortan el OCR, separados por coma (numero_guia, fecha, cantidad, ...); vacío = los 9
+    DOCUMENT_REQUIRED_FIELDS = os.getenv("DOCUMENT_REQUIRED_FIELDS", "")
+    # Guardar los documentos extraídos en document_records (la subida puede pedir persist=0/1)
+    DOCUMENT_PERSIST = os.getenv("DOCUMENT_PERSIST", "0").lower() in ("1", "true", "si")
+    # Cache en disco de OCR + parseo por contenido del archivo (vacío = directorio temporal)
+    DOCUMENT_CACHE_DIR = os.getenv("DOCUMENT_CACHE_DIR", "")
+    DOCUMENT_CACHE_MAX_MB = int(os.getenv("DOCUMENT_CACHE_MAX_MB", "200"))
+    # Subidas de documentos: hasta este tamaño se procesan en memoria, sin archivo temporal
+    DOCUMENT_SPILL_MB = int(os.getenv("DOCUMENT_SPILL_MB", "4"))
+    # Trabajos asíncronos de documentos: hilos por proceso y directorio compartido entre workers
+    DOCUMENT_JOB_WORKERS = int(os.getenv("DOCUMENT_JOB_WORKERS", "2"))
+    DOCUMENT_JOBS_DIR = os.getenv("DOCUMENT_JOBS_DIR", "")
@@ -19,7 +19,13 @@ from .technician_error import TechnicianError
 from .equipos import Equipo
 from .auditoria import Auditoria
 from .inventory_history import InventoryHistory
-from .warehouse2d import WarehouseLocation
+from .warehouse2d import (
+    WarehouseLocation,
+    Warehouse2DLayout,
+    Warehouse2DSession,
+    Warehouse2DLocation,
+    Warehouse2DLayoutStats,
+)
 from .inventory_count import InventoryCount
 from .task import Task
 from .score import Score
@@ -9,8 +9,9 @@ class DocumentRecord(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     
     # Página 1 - Ticket de Pesaje
+    # Búsqueda por número de proceso: índice único (process_number, weigh_number)
     process_number = db.Column(db.String(100))
-    weigh_number = db.Column(db.String(50))
+    weigh_number = db.Column(db.String(50), index=True)
     card = db.Column(db.String(50))
     operation = db.Column(db.String(100))
     tare_weight = db.Column(db.Float)
@@ -19,7 +20,7 @@ class DocumentRecord(db.Model):
     tare_date = db.Column(db.DateTime)
     bruto_date = db.Column(db.DateTime)
     net_date = db.Column(db.DateTime)
-    weigh_date = db.Column(db.DateTime)
+    weigh_date = db.Column(db.DateTime, index=True)
     
     # Página 2 - Traslado
     issue_date = db.Column(db.Date)
@@ -28,7 +29,7 @@ class DocumentRecord(db.Model):
     transport_mode = db.Column(db.String(50))
     transfer_start = db.Column(db.DateTime)
     vehicle_brand = db.Column(db.String(50))
-    plate_tractor = db.Column(db.String(50))
+    plate_tractor = db.Column(db.String(50), index=True)
     driver_document_type = db.Column(db.String(20))
     driver = db.Column(db.String(150))
     driver_id = db.Column(db.String(50))
@@ -57,9 +58,33 @@ class DocumentRecord(db.Model):
     uploaded_by = db.Column(db.Integer)
     status = db.Column(db.String(50), default='PROCESADO')
     
+    # Un documento por (proceso, pesaje): al volver a subirlo se actualiza (utils/document_records.py)
+    __table_args__ = (
+        db.Index('uq_document_records_process_weigh', 'process_number', 'weigh_number', unique=True),
+    )
+    
     def __repr__(self):
         return f'<DocumentRecord {self.process_number}>'
     
+    def to_dict(self):
+        """Convierte a diccionario para la API (búsqueda de registros)"""
+        return {
+            'id': self.id,
+            'process_number': self.process_number,
+            'weigh_number': self.weigh_number or None,
+            'weigh_date': self.weigh_date.isoformat() if self.weigh_date else None,
+            'plate_tractor': self.plate_tractor,
+            'product': self.product,
+            'guide_net_weight': self.guide_net_weight,
+            'unit': self.unit,
+            'provider_nit': self.provider_nit,
+            'driver_id': self.driver_id,
+            'observations': self.observations,
+            'original_file': self.original_file,
+            'status': self.status,
+            'created_at': self.created_at.isoformat() if self.created_at else None
+        }
+    
     def to_excel_dict(self):
         """Convierte a diccionario para Excel"""
         return {
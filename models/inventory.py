@@ -1,5 +1,8 @@
 from models import db
 from datetime import datetime
+from sqlalchemy.orm import validates
+
+from utils.warehouse2d_grid import parse_location_code
 
 class InventoryItem(db.Model):
     __tablename__ = "inventory"
@@ -15,8 +18,22 @@ class InventoryItem(db.Model):
     location = db.Column(db.String(50), nullable=False, index=True)
     libre_utilizacion = db.Column(db.Float, default=0)
 
+    # Ubicación parseada una sola vez al guardar (mapa 2D en vivo)
+    zone = db.Column(db.String(50), nullable=True)
+    row_num = db.Column(db.Integer, nullable=True)
+    col_num = db.Column(db.Integer, nullable=True)
+
     creado_en = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_inventory_user_zone_row_col", "user_id", "zone", "row_num", "col_num"),
+    )
+
+    @validates("location")
+    def _parse_location(self, key, value):
+        self.zone, self.row_num, self.col_num = parse_location_code(value)
+        return value
+
     @property
     def status(self):
         if self.libre_utilizacion <= 0:
@@ -1,5 +1,8 @@
 from datetime import datetime
+from sqlalchemy.orm import validates
+
 from models import db
+from utils.warehouse2d_grid import parse_location_code
 
 class WarehouseLocation(db.Model):
     __tablename__ = "warehouse_locations"
@@ -18,8 +21,22 @@ class WarehouseLocation(db.Model):
     ubicacion = db.Column(db.String(32), nullable=False, index=True)
     libre_utilizacion = db.Column(db.Float, nullable=False, default=0.0)
 
+    # Ubicación parseada una sola vez al guardar (mapa 2D en vivo)
+    zone = db.Column(db.String(32), nullable=True)
+    row_num = db.Column(db.Integer, nullable=True)
+    col_num = db.Column(db.Integer, nullable=True)
+
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_warehouse_locations_zone_row_col", "zone", "row_num", "col_num"),
+    )
+
+    @validates("ubicacion")
+    def _parse_ubicacion(self, key, value):
+        self.zone, self.row_num, self.col_num = parse_location_code(value)
+        return value
+
     @property
     def status(self) -> str:
 
@@ -37,3 +54,73 @@ class WarehouseLocation(db.Model):
         return "normal"
 
 
+# ======================================================
+# ALMACENAMIENTO DEL MAPA 2D EN LA BASE PRINCIPAL
+# (WAREHOUSE2D_STORAGE = "database", ver utils/warehouse2d_storage.py)
+# ======================================================
+
+class Warehouse2DLayout(db.Model):
+    __tablename__ = "warehouse2d_layouts"
+
+    layout_id = db.Column(db.String(32), primary_key=True)
+    content_hash = db.Column(db.String(64), nullable=True, unique=True)
+    total_records = db.Column(db.Integer, nullable=False, default=0)
+    ref_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    last_used_at = db.Column(db.DateTime, default=datetime.now)
+
+
+class Warehouse2DSession(db.Model):
+    __tablename__ = "warehouse2d_sessions"
+
+    session_id = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.String(64), nullable=True)
+    layout_id = db.Column(db.String(32), nullable=True, index=True)
+    file_name = db.Column(db.String(255), nullable=True)
+    file_hash = db.Column(db.String(64), nullable=True)
+    total_records = db.Column(db.Integer, nullable=False, default=0)
+
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+
+class Warehouse2DLocation(db.Model):
+    __tablename__ = "warehouse2d_locations"
+    # Las cargas incrementales buscan por (layout, ubicación)
+    __table_args__ = (
+        db.Index("ix_warehouse2d_locations_layout_location", "layout_id", "location_code"),
+    )
+
+    id = db.Column(db.BigInteger().with_variant(db.Integer, "sqlite"), primary_key=True)
+    layout_id = db.Column(db.String(32), nullable=True, index=True)
+
+    location_code = db.Column(db.Text, nullable=True)
+    zone = db.Column(db.Text, nullable=True)
+    row_num = db.Column(db.Integer, nullable=True)
+    col_num = db.Column(db.Integer, nullable=True)
+
+    material_code = db.Column(db.Text, nullable=True)
+    material_desc = db.Column(db.Text, nullable=True)
+    quantity = db.Column(db.Float, nullable=True)
+    capacity = db.Column(db.Float, nullable=True)
+    unit = db.Column(db.Text, nullable=True)
+    ocupation_percent = db.Column(db.Float, nullable=True)
+    status = db.Column(db.String(16), nullable=True)
+
+
+class Warehouse2DLayoutStats(db.Model):
+    __tablename__ = "warehouse2d_layout_stats"
+
+    layout_id = db.Column(db.String(32), primary_key=True)
+    zone = db.Column(db.String(255), primary_key=True)  # "*" = totales del layout
+
+    total_records = db.Column(db.Integer, nullable=False, default=0)
+    total_locations = db.Column(db.Integer, nullable=False, default=0)
+    total_materials = db.Column(db.Integer, nullable=False, default=0)
+    total_quantity = db.Column(db.Float, nullable=False, default=0.0)
+    total_capacity = db.Column(db.Float, nullable=False, default=0.0)
+    max_row = db.Column(db.Integer, nullable=False, default=0)
+    max_col = db.Column(db.Integer, nullable=False, default=0)
+    zones = db.Column(db.Text, nullable=True)          # JSON
+    status_stats = db.Column(db.Text, nullable=True)   # JSON
@@ -1,80 +1,126 @@
 # routes/warehouse2d_routes.py - VERSIÓN COMPLETA Y CORREGIDA
 
-from flask import Blueprint, render_template, request, flash, redirect, url_for, session, jsonify, send_file
+from flask import Blueprint, render_template, request, flash, redirect, url_for, session, jsonify, send_file, current_app
 from flask_login import login_required, current_user
 import pandas as pd
+import numpy as np
 import json
 from io import BytesIO
-from datetime import datetime, timedelta
+from datetime import datetime
 import xlsxwriter
 import hashlib
 import os
 import tempfile
-import sqlite3
+import time
 import uuid
 from functools import wraps
+from itertools import chain, islice
+
+from utils.file_response import temp_file_response
+from utils.warehouse2d_grid import STATUS_NAMES, GridCache, LayoutGrid, classify_status, parse_location_code
+from utils.warehouse2d_heatmap import MAX_SCALE, MIN_SCALE, HeatmapDiskCache, render_heatmap
+from utils.warehouse2d_janitor import WarehouseJanitor
+from utils.warehouse2d_live import (LiveMap, ensure_coordinate_columns, live_cache_key, load_live_locations,
+                                    register_live_invalidation, search_live_locations)
+from utils.warehouse2d_route import MAX_ROUTE_STOPS, describe_route
+from utils.warehouse2d_storage import LOCATION_COLUMNS, STATS_ALL_ZONES, create_storage
 
 warehouse2d_bp = Blueprint('warehouse2d', __name__, template_folder='templates')
 
 # ================= CONFIGURACIÓN =================
 WAREHOUSE_DB = 'warehouse_data.db'
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+MAX_DELTA_RECORDS = 5000  # Cargas incrementales: correcciones puntuales, no archivos completos
+MAX_ROUTE_LISTS = 100  # Listas de picking por petición a /route
+EXPORT_WIDTH_SAMPLE = 1000  # Filas usadas para estimar el ancho de columnas al exportar
+EXPORT_NUMERIC_COLUMNS = {'row_num', 'col_num', 'quantity', 'capacity', 'ocupation_percent'}
+EXPORT_CHUNK_SIZE = 256 * 1024
 TEMP_DIR = tempfile.gettempdir() + '/warehouse_app/'
+LIVE_SOURCE = 'live'  # ?source=live: mapa armado desde inventory/warehouse_locations
+# Rutas que saben servir el mapa en vivo; el resto rechaza source=live
+LIVE_ENDPOINTS = {
+    'warehouse2d.index', 'warehouse2d.map_data', 'warehouse2d.get_stats', 'warehouse2d.zone_grid',
+    'warehouse2d.neighbors', 'warehouse2d.suggest_slot', 'warehouse2d.heatmap_png', 'warehouse2d.pick_route',
+    'warehouse2d.search_locations', 'warehouse2d.export_excel',
+}
+MAX_OMITTED_REPORT = 50  # Códigos fuera de la rejilla (fila/columna fuera de serie) listados en /zone-grid
 
 # Crear directorio temporal si no existe
 if not os.path.exists(TEMP_DIR):
     os.makedirs(TEMP_DIR)
 
-# ================= BASE DE DATOS TEMPORAL =================
-def init_warehouse_db():
-    """Inicializar base de datos para almacenamiento temporal"""
-    conn = sqlite3.connect(WAREHOUSE_DB)
-    cursor = conn.cursor()
-    
-    # Tabla para datos de usuario
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS warehouse_sessions (
-        session_id TEXT PRIMARY KEY,
-        user_id TEXT,
-        file_name TEXT,
-        file_hash TEXT,
-        total_records INTEGER,
-        created_at TIMESTAMP,
-        expires_at TIMESTAMP,
-        metadata TEXT
-    )
-    ''')
-    
-    # Tabla para datos procesados (optimizado para el mapa)
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS warehouse_locations (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        session_id TEXT,
-        location_code TEXT,
-        zone TEXT,
-        row_num INTEGER,
-        col_num INTEGER,
-        material_code TEXT,
-        material_desc TEXT,
-        quantity REAL,
-        capacity REAL,
-        unit TEXT,
-        ocupation_percent REAL,
-        status TEXT,
-        FOREIGN KEY (session_id) REFERENCES warehouse_sessions(session_id)
+# ================= ALMACENAMIENTO =================
+@warehouse2d_bp.record_once
+def setup_storage(state):
+    """Crear el almacenamiento (SQLite local o base principal) y el janitor al registrar el blueprint"""
+    app = state.app
+    storage = create_storage(app, WAREHOUSE_DB)
+    janitor = WarehouseJanitor(storage, interval=app.config.get('WAREHOUSE2D_JANITOR_INTERVAL', 300))
+    
+    app.extensions['warehouse2d_storage'] = storage
+    app.extensions['warehouse2d_janitor'] = janitor
+    grid_bytes = app.config.get('WAREHOUSE2D_GRID_CACHE_MB', 512) * 1024 * 1024
+    app.extensions['warehouse2d_grids'] = GridCache(app.config.get('WAREHOUSE2D_GRID_CACHE_SIZE', 16), grid_bytes)
+    app.extensions['warehouse2d_heatmaps'] = HeatmapDiskCache(os.path.join(TEMP_DIR, 'heatmaps'))
+    app.extensions['warehouse2d_live'] = GridCache(app.config.get('WAREHOUSE2D_LIVE_CACHE_SIZE', 8), grid_bytes)
+    
+    # Mapa en vivo: coordenadas en las tablas de inventario e invalidación al confirmar cambios
+    from models import db
+    with app.app_context():
+        try:
+            ensure_coordinate_columns(db.engine)
+        except Exception as e:
+            app.logger.warning(f"No se pudieron preparar las coordenadas del mapa en vivo: {e}")
+    register_live_invalidation()
+    
+    # Limpieza en segundo plano (0 en la configuración la desactiva)
+    if janitor.interval > 0:
+        janitor.start()
+
+def get_storage():
+    """Almacenamiento del mapa 2D de la app actual"""
+    return current_app.extensions['warehouse2d_storage']
+
+def get_janitor():
+    return current_app.extensions['warehouse2d_janitor']
+
+def get_layout_grid(session_data):
+    """Rejilla NumPy del layout de la sesión (se construye una vez y queda en el cache LRU).
+
+    La clave incluye el hash del archivo: las cargas incrementales lo cambian, así
+    ningún nodo sirve una rejilla anterior a la última modificación.
+    """
+    layout_id = session_data['layout_id']
+    return current_app.extensions['warehouse2d_grids'].get(
+        (layout_id, session_data['file_hash']),
+        lambda: LayoutGrid.from_locations(get_storage().iter_locations(layout_id, ordered=False))
     )
-    ''')
+
+def invalidate_layout_grid(session_data):
+    if session_data:
+        current_app.extensions['warehouse2d_grids'].invalidate((session_data['layout_id'], session_data['file_hash']))
+
+def is_live_request():
+    return request.args.get('source') == LIVE_SOURCE
+
+def get_live_map():
+    """Mapa en vivo del usuario (una consulta agregada, cacheada hasta el próximo cambio o el TTL)"""
+    from models import db
     
-    # Índices para mejor rendimiento
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_session ON warehouse_locations(session_id)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_zone ON warehouse_locations(zone)')
-    cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON warehouse_locations(status)')
+    key = live_cache_key(current_user.id, current_app.config.get('WAREHOUSE2D_LIVE_TTL', 60))
     
-    conn.commit()
-    conn.close()
+    def build():
+        locations = load_live_locations(db.engine, current_user.id)
+        stats = compute_layout_stats(pd.DataFrame(locations, columns=LOCATION_COLUMNS)) if locations else []
+        return LiveMap(key, locations, stats)
+    
+    return current_app.extensions['warehouse2d_live'].get(key, build)
 
-# Inicializar DB al importar
-init_warehouse_db()
+def get_request_grid():
+    """Rejilla del mapa en vivo o del layout subido en la sesión, según ?source="""
+    if is_live_request():
+        return get_live_map().grid
+    return get_layout_grid(get_storage().get_session(get_user_session_id()))
 
 # ================= DECORADORES Y UTILIDADES =================
 def get_user_session_id():
@@ -83,30 +129,21 @@ def get_user_session_id():
         session['warehouse_session_id'] = str(uuid.uuid4())
     return session['warehouse_session_id']
 
-def cleanup_old_sessions():
-    """Limpiar sesiones antiguas (más de 24 horas)"""
-    conn = sqlite3.connect(WAREHOUSE_DB)
-    cursor = conn.cursor()
-    
-    cutoff_time = datetime.now() - timedelta(hours=24)
-    cursor.execute('DELETE FROM warehouse_sessions WHERE expires_at < ?', (cutoff_time,))
-    cursor.execute('DELETE FROM warehouse_locations WHERE session_id IN (SELECT session_id FROM warehouse_sessions WHERE expires_at < ?)', (cutoff_time,))
-    
-    conn.commit()
-    conn.close()
-
 def require_warehouse_session(f):
     """Decorador para requerir sesión de almacén"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        session_id = get_user_session_id()
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        cursor = conn.cursor()
-        
-        cursor.execute('SELECT session_id FROM warehouse_sessions WHERE session_id = ?', (session_id,))
-        has_data = cursor.fetchone() is not None
+        # El mapa en vivo no depende de un archivo subido, pero solo algunas rutas lo sirven
+        if is_live_request():
+            if request.endpoint in LIVE_ENDPOINTS:
+                return f(*args, **kwargs)
+            return jsonify({
+                'success': False,
+                'message': 'Esta operación no está disponible para el mapa en vivo (source=live)'
+            }), 400
         
-        conn.close()
+        session_id = get_user_session_id()
+        has_data = get_storage().get_session(session_id) is not None
         
         if not has_data and request.endpoint not in ['warehouse2d.upload_view', 'warehouse2d.upload_file', 'warehouse2d.upload_warehouse2d']:
             return redirect(url_for('warehouse2d.upload_view'))
@@ -123,36 +160,32 @@ def require_warehouse_session(f):
 @require_warehouse_session
 def index():
     """Página principal del mapa 2D"""
-    session_id = get_user_session_id()
-    
-    conn = sqlite3.connect(WAREHOUSE_DB)
-    cursor = conn.cursor()
+    storage = get_storage()
     
     # Obtener metadata de la sesión
-    cursor.execute('''
-        SELECT file_name, created_at, total_records 
-        FROM warehouse_sessions 
-        WHERE session_id = ?
-    ''', (session_id,))
+    result = storage.get_session(get_user_session_id())
     
-    result = cursor.fetchone()
+    if is_live_request():
+        live_map = get_live_map()
+        stats = live_map.stats_row(STATS_ALL_ZONES)
+        return render_template('warehouse2d/map.html',
+                             has_data=True,
+                             map_source=LIVE_SOURCE,
+                             file_name='Inventario en vivo',
+                             last_update=datetime.fromtimestamp(live_map.built_at).strftime('%Y-%m-%d %H:%M:%S'),
+                             total_locations=stats['total_locations'] if stats else 0,
+                             total_materials=stats['total_materials'] if stats else 0,
+                             total_records=stats['total_records'] if stats else 0)
     
     if result:
-        file_name, created_at, total_records = result
-        last_update = datetime.strptime(created_at, '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
-        
-        # Obtener estadísticas rápidas
-        cursor.execute('''
-            SELECT 
-                COUNT(DISTINCT location_code) as total_locations,
-                COUNT(DISTINCT material_code) as total_materials
-            FROM warehouse_locations 
-            WHERE session_id = ?
-        ''', (session_id,))
-        
-        stats = cursor.fetchone()
-        total_locations = stats[0] if stats else 0
-        total_materials = stats[1] if stats else 0
+        file_name = result['file_name']
+        total_records = result['total_records']
+        last_update = datetime.strptime(result['created_at'], '%Y-%m-%d %H:%M:%S').strftime('%Y-%m-%d %H:%M:%S')
+        
+        # Obtener estadísticas precalculadas
+        stats = storage.get_layout_stats(result['layout_id'])
+        total_locations = stats['total_locations'] if stats else 0
+        total_materials = stats['total_materials'] if stats else 0
         
         has_data = True
     else:
@@ -163,10 +196,9 @@ def index():
         total_records = 0
         has_data = False
     
-    conn.close()
-    
     return render_template('warehouse2d/map.html',
                          has_data=has_data,
+                         map_source=None,
                          file_name=file_name,
                          last_update=last_update,
                          total_locations=total_locations,
@@ -187,7 +219,6 @@ def map_view():
 @login_required
 def upload_view():
     """Página para subir archivo Excel"""
-    cleanup_old_sessions()  # Limpiar sesiones antiguas
     return render_template('warehouse2d/upload.html')
 
 @warehouse2d_bp.route('/upload-warehouse2d')
@@ -200,54 +231,223 @@ def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'xlsx', 'xls', 'csv'}
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def parse_location_code(location_code):
-    """Parsear código de ubicación en zona, fila y columna"""
-    if not location_code:
-        return 'A', 1, 1
+def read_layout_file(file_like, filename):
+    """Leer el archivo del layout y normalizar los nombres de columnas"""
+    if filename.endswith('.csv'):
+        df = pd.read_csv(file_like, encoding='utf-8', dtype=str, low_memory=False)
+    else:
+        df = pd.read_excel(file_like, dtype=str)
     
-    try:
-        location_str = str(location_code).strip()
-        
-        # Diferentes formatos soportados
-        if '-' in location_str:
-            parts = location_str.split('-')
-            zone = parts[0] if len(parts) > 0 else 'A'
-            
-            # Extraer números de fila
-            row_num = 1
-            if len(parts) > 1:
-                row_part = parts[1]
-                numbers = ''.join(filter(str.isdigit, row_part))
-                row_num = int(numbers) if numbers else 1
-            
-            # Extraer números de columna
-            col_num = 1
-            if len(parts) > 2:
-                col_part = parts[2]
-                numbers = ''.join(filter(str.isdigit, col_part))
-                col_num = int(numbers) if numbers else 1
-            
-            return zone, row_num, col_num
-        
-        elif location_str.isalnum():
-            # Formato A0101
-            zone = location_str[0] if location_str[0].isalpha() else 'A'
-            numbers = ''.join(filter(str.isdigit, location_str))
-            
-            if len(numbers) >= 2:
-                row_num = int(numbers[:2])
-                col_num = int(numbers[2:4]) if len(numbers) >= 4 else 1
-            else:
-                row_num = 1
-                col_num = 1
-            
-            return zone, row_num, col_num
-        
-        else:
-            return 'A', 1, 1
-            
-    except Exception:
-        return 'A', 1, 1
+    return normalize_layout_columns(df)
+
+def normalize_layout_columns(df):
+    """Normalizar los nombres de columnas del layout a los nombres internos"""
+    # Normalizar nombres de columnas
+    df.columns = df.columns.str.strip().str.lower()
+    
+    # Mapear nombres de columnas posibles
+    column_mapping = {
+        'ubicación': 'ubicacion',
+        'location': 'ubicacion',
+        'location_code': 'ubicacion',
+        'código del material': 'material',
+        'codigo_material': 'material',
+        'material_code': 'material',
+        'stock máximo': 'capacidad',
+        'stock_maximo': 'capacidad',
+        'capacidad': 'capacidad',
+        'capacity': 'capacidad',
+        'libre utilización': 'cantidad',
+        'libre_utilizacion': 'cantidad',
+        'cantidad': 'cantidad',
+        'stock': 'cantidad',
+        'quantity': 'cantidad',
+        'texto breve de material': 'descripcion',
+        'descripcion': 'descripcion',
+        'description': 'descripcion',
+        'unidad de medida base': 'unidad',
+        'unidad': 'unidad',
+        'unit': 'unidad'
+    }
+    
+    df = df.rename(columns=column_mapping)
+    
+    # Si varias columnas significan lo mismo (ej. 'location' y 'ubicación'), combinarlas
+    if df.columns.duplicated().any():
+        df = df.T.groupby(level=0, sort=False).first().T
+    
+    return df
+
+def build_locations_frame(df):
+    """Convertir el archivo leído en filas de warehouse_locations (operaciones por columna)"""
+    ubicacion = df['ubicacion'].fillna('').astype(str).str.strip()
+    df = df[ubicacion != '']
+    ubicacion = ubicacion[ubicacion != '']
+    
+    # Parsear cada ubicación distinta una sola vez
+    parsed = {code: parse_location_code(code) for code in ubicacion.unique()}
+    
+    material = df['material'].fillna('').astype(str).str.strip()
+    
+    if 'descripcion' in df.columns:
+        descripcion = df['descripcion'].fillna(material).astype(str).str.strip().str[:200]
+    else:
+        descripcion = material.str[:200]
+    
+    if 'unidad' in df.columns:
+        unidad = df['unidad'].fillna('UN').astype(str).str.strip()
+    else:
+        unidad = pd.Series('UN', index=df.index)
+    
+    def to_number(column, default):
+        if column not in df.columns:
+            return pd.Series(default, index=df.index, dtype=float)
+        values = df[column].astype(str).str.replace(',', '.', regex=False)
+        return pd.to_numeric(values, errors='coerce').fillna(default)
+    
+    cantidad = to_number('cantidad', 0.0)
+    capacidad = to_number('capacidad', 100.0)
+    capacidad = capacidad.where(capacidad > 0, 100.0)
+    
+    # Calcular ocupación y estado
+    ocupacion = cantidad / capacidad * 100
+    status = np.array(STATUS_NAMES)[classify_status(cantidad, ocupacion)]
+    
+    return pd.DataFrame({
+        'location_code': ubicacion,
+        'zone': ubicacion.map(lambda code: parsed[code][0]),
+        'row_num': ubicacion.map(lambda code: parsed[code][1]).astype(int),
+        'col_num': ubicacion.map(lambda code: parsed[code][2]).astype(int),
+        'material_code': material,
+        'material_desc': descripcion,
+        'quantity': cantidad,
+        'capacity': capacidad,
+        'unit': unidad,
+        'ocupation_percent': ocupacion.round(2),
+        'status': status,
+    }, columns=LOCATION_COLUMNS).astype(object)
+
+def _status_breakdown(locations):
+    """Conteo, ocupación media y totales por estado"""
+    breakdown = {}
+    for status, group in locations.groupby('status'):
+        breakdown[status] = {
+            'count': int(len(group)),
+            'avg_ocupation': round(float(group['ocupation_percent'].astype(float).mean()), 2),
+            'total_quantity': float(group['quantity'].astype(float).sum()),
+            'total_capacity': float(group['capacity'].astype(float).sum())
+        }
+    return breakdown
+
+def _stats_row(zone, locations, zones):
+    return {
+        'zone': zone,
+        'total_records': int(len(locations)),
+        'total_locations': int(locations['location_code'].nunique()),
+        'total_materials': int(locations['material_code'].nunique()),
+        'total_quantity': float(locations['quantity'].astype(float).sum()),
+        'total_capacity': float(locations['capacity'].astype(float).sum()),
+        'max_row': int(locations['row_num'].max()) if len(locations) else 0,
+        'max_col': int(locations['col_num'].max()) if len(locations) else 0,
+        'zones': json.dumps(zones),
+        'status_stats': json.dumps(_status_breakdown(locations))
+    }
+
+def compute_layout_stats(locations):
+    """Calcular los agregados del layout (totales y por zona) a partir de las filas procesadas"""
+    zones = sorted(locations['zone'].unique().tolist())
+    rows = [_stats_row(STATS_ALL_ZONES, locations, zones)]
+    for zone, group in locations.groupby('zone', sort=True):
+        rows.append(_stats_row(zone, group, [zone]))
+    return rows
+
+def combine_zone_stats(zone_rows, total_materials):
+    """Fila de totales ('*') a partir de las filas por zona, sin releer las ubicaciones"""
+    status_totals = {}
+    for row in zone_rows:
+        for status, values in json.loads(row['status_stats'] or '{}').items():
+            totals = status_totals.setdefault(status, {
+                'count': 0, 'ocupation_sum': 0.0, 'total_quantity': 0.0, 'total_capacity': 0.0
+            })
+            totals['count'] += values['count']
+            totals['ocupation_sum'] += values['avg_ocupation'] * values['count']
+            totals['total_quantity'] += values['total_quantity']
+            totals['total_capacity'] += values['total_capacity']
+    
+    status_stats = {
+        status: {
+            'count': totals['count'],
+            'avg_ocupation': round(totals['ocupation_sum'] / totals['count'], 2) if totals['count'] else 0.0,
+            'total_quantity': totals['total_quantity'],
+            'total_capacity': totals['total_capacity']
+        }
+        for status, totals in sorted(status_totals.items())
+    }
+    
+    return {
+        'zone': STATS_ALL_ZONES,
+        'total_records': sum(row['total_records'] for row in zone_rows),
+        'total_locations': sum(row['total_locations'] for row in zone_rows),
+        'total_materials': total_materials,
+        'total_quantity': sum(row['total_quantity'] for row in zone_rows),
+        'total_capacity': sum(row['total_capacity'] for row in zone_rows),
+        'max_row': max((row['max_row'] for row in zone_rows), default=0),
+        'max_col': max((row['max_col'] for row in zone_rows), default=0),
+        'zones': json.dumps([row['zone'] for row in zone_rows]),
+        'status_stats': json.dumps(status_stats)
+    }
+
+def refresh_layout_stats(storage, layout_id, zones):
+    """Recalcular solo las zonas tocadas por una carga incremental y la fila de totales"""
+    rows = pd.DataFrame(
+        list(storage.iter_locations(layout_id, ordered=False, zones=zones)), columns=LOCATION_COLUMNS
+    )
+    updated = {zone: _stats_row(zone, group, [zone]) for zone, group in rows.groupby('zone', sort=True)}
+    
+    zone_rows = {row['zone']: row for row in storage.list_layout_stats(layout_id) if row['zone'] != STATS_ALL_ZONES}
+    zone_rows.update(updated)
+    zone_rows = [zone_rows[zone] for zone in sorted(zone_rows)]
+    
+    total = combine_zone_stats(zone_rows, storage.count_materials(layout_id))
+    storage.save_layout_stats(layout_id, list(updated.values()) + [total])
+
+# Columna del archivo -> columna de la ubicación que se conserva si el delta no la trae
+DELTA_KEEP_COLUMNS = {
+    'descripcion': 'material_desc',
+    'unidad': 'unit',
+    'cantidad': 'quantity',
+    'capacidad': 'capacity'
+}
+
+def merge_delta_locations(delta, existing, provided_columns):
+    """Completar las filas del delta con los valores actuales de las columnas que no trae.
+
+    Devuelve el delta listo para guardar y cuántas filas ya existían.
+    """
+    if not existing:
+        return delta, 0
+    
+    key_columns = ['location_code', 'material_code']
+    keys = pd.MultiIndex.from_frame(delta[key_columns])
+    current = pd.DataFrame(existing, columns=LOCATION_COLUMNS).drop_duplicates(key_columns, keep='last')
+    current = current.set_index(key_columns)
+    found = keys.isin(current.index)
+    
+    keep = [column for source, column in DELTA_KEEP_COLUMNS.items() if source not in provided_columns]
+    if keep and found.any():
+        delta = delta.copy()
+        for column in keep:
+            delta.loc[found, column] = current[column].reindex(keys[found]).to_numpy()
+        
+        # Recalcular ocupación y estado con los valores combinados
+        cantidad = delta['quantity'].astype(float)
+        capacidad = delta['capacity'].astype(float)
+        ocupacion = cantidad / capacidad * 100
+        delta['ocupation_percent'] = ocupacion.round(2)
+        delta['status'] = np.array(STATUS_NAMES)[classify_status(cantidad, ocupacion)]
+        delta = delta.astype(object)
+    
+    return delta, int(found.sum())
 
 @warehouse2d_bp.route('/upload', methods=['POST'])
 @login_required
@@ -288,141 +488,46 @@ def upload_file():
                 file_content = file.read()
                 file_like = BytesIO(file_content)
             
-            # Leer el archivo con pandas
-            if file.filename.endswith('.csv'):
-                df = pd.read_csv(file_like, encoding='utf-8', dtype=str, low_memory=False)
-            else:
-                df = pd.read_excel(file_like, dtype=str)
-            
-            # Normalizar nombres de columnas
-            df.columns = df.columns.str.strip().str.lower()
-            
-            # Mapear nombres de columnas posibles
-            column_mapping = {
-                'ubicación': 'ubicacion',
-                'location': 'ubicacion',
-                'código del material': 'material',
-                'codigo_material': 'material',
-                'material_code': 'material',
-                'stock máximo': 'capacidad',
-                'stock_maximo': 'capacidad',
-                'capacidad': 'capacidad',
-                'libre utilización': 'cantidad',
-                'libre_utilizacion': 'cantidad',
-                'cantidad': 'cantidad',
-                'stock': 'cantidad',
-                'texto breve de material': 'descripcion',
-                'descripcion': 'descripcion',
-                'description': 'descripcion',
-                'unidad de medida base': 'unidad',
-                'unidad': 'unidad',
-                'unit': 'unidad'
-            }
-            
-            df = df.rename(columns=column_mapping)
-            
-            # Verificar columnas requeridas
-            required_columns = ['ubicacion', 'material']
-            missing_columns = [col for col in required_columns if col not in df.columns]
-            
-            if missing_columns:
-                flash(f'El archivo debe contener las columnas: {", ".join(missing_columns)}', 'error')
-                return redirect(url_for('warehouse2d.upload_view'))
-            
-            # Limitar número de registros si es muy grande
-            MAX_RECORDS = 100000
-            if len(df) > MAX_RECORDS:
-                df = df.head(MAX_RECORDS)
-                flash(f'El archivo contiene muchos registros. Se procesarán solo los primeros {MAX_RECORDS}', 'warning')
-            
             # Generar hash único del archivo
             file_hash = hashlib.md5(file_content).hexdigest()
             session_id = get_user_session_id()
             
-            # Conectar a la base de datos
-            conn = sqlite3.connect(WAREHOUSE_DB)
-            cursor = conn.cursor()
+            storage = get_storage()
+            user_id = str(current_user.id) if current_user.is_authenticated else 'anonymous'
             
-            # Eliminar datos anteriores del usuario
-            cursor.execute('DELETE FROM warehouse_sessions WHERE session_id = ?', (session_id,))
-            cursor.execute('DELETE FROM warehouse_locations WHERE session_id = ?', (session_id,))
+            # La rejilla en memoria del layout anterior deja de servir a esta sesión
+            previous = storage.get_session(session_id)
             
-            # Procesar datos en lotes para mejor rendimiento
-            batch_size = 1000
-            total_inserted = 0
+            # Si el mismo archivo ya fue procesado, reutilizar su layout sin volver a leerlo
+            total_inserted = storage.attach_layout_by_hash(session_id, user_id, file.filename, file_hash)
             
-            for i in range(0, len(df), batch_size):
-                batch = df.iloc[i:i + batch_size]
-                locations_data = []
+            if total_inserted is None:
+                df = read_layout_file(file_like, file.filename)
                 
-                for _, row in batch.iterrows():
-                    ubicacion = str(row.get('ubicacion', '')).strip()
-                    if not ubicacion:
-                        continue
-                    
-                    # Parsear ubicación
-                    zone, row_num, col_num = parse_location_code(ubicacion)
-                    
-                    # Obtener datos del material
-                    material = str(row.get('material', '')).strip()
-                    descripcion = str(row.get('descripcion', material)).strip()[:200]
-                    unidad = str(row.get('unidad', 'UN')).strip()
-                    
-                    # Convertir cantidades
-                    try:
-                        cantidad = float(str(row.get('cantidad', '0')).replace(',', '.'))
-                    except:
-                        cantidad = 0.0
-                    
-                    try:
-                        capacidad = float(str(row.get('capacidad', '100')).replace(',', '.'))
-                    except:
-                        capacidad = 100.0
-                    
-                    if capacidad <= 0:
-                        capacidad = 100.0
-                    
-                    # Calcular ocupación y estado
-                    ocupacion_percent = (cantidad / capacidad * 100) if capacidad > 0 else 0
-                    
-                    if cantidad <= 0:
-                        status = 'vacio'
-                    elif ocupacion_percent < 20:
-                        status = 'critico'
-                    elif ocupacion_percent < 50:
-                        status = 'bajo'
-                    else:
-                        status = 'normal'
-                    
-                    locations_data.append((
-                        session_id, ubicacion, zone, row_num, col_num,
-                        material, descripcion, cantidad, capacidad, unidad,
-                        round(ocupacion_percent, 2), status
-                    ))
+                # Verificar columnas requeridas
+                required_columns = ['ubicacion', 'material']
+                missing_columns = [col for col in required_columns if col not in df.columns]
                 
-                # Insertar lote en la base de datos
-                cursor.executemany('''
-                    INSERT INTO warehouse_locations 
-                    (session_id, location_code, zone, row_num, col_num, material_code, 
-                     material_desc, quantity, capacity, unit, ocupation_percent, status)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', locations_data)
+                if missing_columns:
+                    flash(f'El archivo debe contener las columnas: {", ".join(missing_columns)}', 'error')
+                    return redirect(url_for('warehouse2d.upload_view'))
                 
-                total_inserted += len(locations_data)
-            
-            # Guardar metadata de la sesión
-            created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            expires_at = (datetime.now() + timedelta(hours=24)).strftime('%Y-%m-%d %H:%M:%S')
-            
-            cursor.execute('''
-                INSERT INTO warehouse_sessions 
-                (session_id, user_id, file_name, file_hash, total_records, created_at, expires_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-            ''', (session_id, str(current_user.id) if current_user.is_authenticated else 'anonymous',
-                  file.filename, file_hash, total_inserted, created_at, expires_at))
+                # Limitar número de registros si es muy grande
+                MAX_RECORDS = 100000
+                if len(df) > MAX_RECORDS:
+                    df = df.head(MAX_RECORDS)
+                    flash(f'El archivo contiene muchos registros. Se procesarán solo los primeros {MAX_RECORDS}', 'warning')
+                
+                # Procesar todas las columnas de una sola pasada y precalcular estadísticas
+                locations = build_locations_frame(df)
+                stats_rows = compute_layout_stats(locations)
+                
+                total_inserted = storage.save_layout(
+                    session_id, user_id, file.filename, file_hash,
+                    list(locations.itertuples(index=False, name=None)), stats_rows
+                )
             
-            conn.commit()
-            conn.close()
+            invalidate_layout_grid(previous)
             
             flash(f'Archivo "{file.filename}" cargado exitosamente. {total_inserted} ubicaciones procesadas.', 'success')
             return redirect(url_for('warehouse2d.index'))
@@ -434,6 +539,97 @@ def upload_file():
     flash('Tipo de archivo no permitido. Use .xlsx, .xls o .csv', 'error')
     return redirect(url_for('warehouse2d.upload_view'))
 
+@warehouse2d_bp.route('/upload-delta', methods=['POST'])
+@login_required
+@require_warehouse_session
+def upload_delta():
+    """Aplicar cambios parciales (archivo o JSON) sobre el layout de la sesión.
+
+    Cada fila reemplaza a la que tenga la misma ubicación y material, o se agrega si
+    no existe; las columnas que el delta no trae conservan su valor actual.
+    """
+    try:
+        started = time.monotonic()
+        
+        file = request.files.get('file')
+        if file and file.filename:
+            if not allowed_file(file.filename):
+                return jsonify({
+                    'success': False,
+                    'message': 'Tipo de archivo no permitido. Use .xlsx, .xls o .csv'
+                }), 400
+            content = file.read()
+            df = read_layout_file(BytesIO(content), file.filename)
+        else:
+            payload = request.get_json(silent=True)
+            changes = payload.get('changes') if isinstance(payload, dict) else payload
+            if not isinstance(changes, list) or not changes:
+                return jsonify({
+                    'success': False,
+                    'message': 'Debe enviar un archivo o una lista "changes" con las ubicaciones modificadas'
+                }), 400
+            content = request.get_data()
+            df = normalize_layout_columns(pd.DataFrame(changes, dtype=object))
+        
+        missing_columns = [col for col in ['ubicacion', 'material'] if col not in df.columns]
+        if missing_columns:
+            return jsonify({
+                'success': False,
+                'message': f'El delta debe contener las columnas: {", ".join(missing_columns)}'
+            }), 400
+        
+        if len(df) > MAX_DELTA_RECORDS:
+            return jsonify({
+                'success': False,
+                'message': f'El delta supera {MAX_DELTA_RECORDS} filas; use la carga completa'
+            }), 400
+        
+        # La última fila gana si el delta repite una ubicación y material
+        delta = build_locations_frame(df).drop_duplicates(['location_code', 'material_code'], keep='last')
+        if delta.empty:
+            return jsonify({'success': False, 'message': 'El delta no contiene ubicaciones'}), 400
+        
+        storage = get_storage()
+        session_id = get_user_session_id()
+        previous = storage.get_session(session_id)
+        if previous is None:
+            return jsonify({
+                'success': False,
+                'message': 'No hay layout cargado; suba primero el archivo completo'
+            }), 400
+        
+        # Layout propio de la sesión (se copia si otras sesiones lo comparten)
+        layout_id = storage.detach_layout_for_update(session_id)
+        if layout_id is None:
+            return jsonify({
+                'success': False,
+                'message': 'No hay layout cargado; suba primero el archivo completo'
+            }), 400
+        existing = storage.find_locations(layout_id, delta['location_code'].unique().tolist())
+        delta, updated = merge_delta_locations(delta, existing, set(df.columns))
+        
+        # Nuevo hash = hash anterior + contenido del delta (invalida rejillas y mapas de calor)
+        file_hash = hashlib.md5((previous['file_hash'] or '').encode() + content).hexdigest()
+        total_records = storage.upsert_locations(
+            session_id, layout_id, file_hash, list(delta.itertuples(index=False, name=None))
+        )
+        refresh_layout_stats(storage, layout_id, sorted(delta['zone'].unique().tolist()))
+        invalidate_layout_grid(previous)
+        
+        return jsonify({
+            'success': True,
+            'message': f'{len(delta)} ubicaciones actualizadas',
+            'inserted': len(delta) - updated,
+            'updated': updated,
+            'total_records': total_records,
+            'seconds': round(time.monotonic() - started, 3)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
 # ================= RUTAS DE API Y DATOS =================
 
 @warehouse2d_bp.route('/get-data')
@@ -442,15 +638,10 @@ def upload_file():
 def get_warehouse_data():
     """Obtener datos del almacén (limitado para vista previa)"""
     try:
-        session_id = get_user_session_id()
-        
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        storage = get_storage()
         
         # Obtener metadata
-        cursor.execute('SELECT file_name, created_at, total_records FROM warehouse_sessions WHERE session_id = ?', (session_id,))
-        session_data = cursor.fetchone()
+        session_data = storage.get_session(get_user_session_id())
         
         if not session_data:
             return jsonify({
@@ -459,18 +650,7 @@ def get_warehouse_data():
             }), 404
         
         # Obtener muestra de datos (máximo 100 registros para vista previa)
-        cursor.execute('''
-            SELECT location_code, zone, row_num, col_num, material_code, 
-                   material_desc, quantity, capacity, unit, ocupation_percent, status
-            FROM warehouse_locations 
-            WHERE session_id = ? 
-            LIMIT 100
-        ''', (session_id,))
-        
-        rows = cursor.fetchall()
-        data = [dict(row) for row in rows]
-        
-        conn.close()
+        data = list(storage.iter_locations(session_data['layout_id'], limit=100, ordered=False))
         
         return jsonify({
             'success': True,
@@ -490,67 +670,60 @@ def get_warehouse_data():
 @login_required
 @require_warehouse_session
 def map_data():
-    """Datos optimizados para el mapa"""
+    """Datos optimizados para el mapa (?zone= solo las ubicaciones de esa zona)"""
     try:
-        session_id = get_user_session_id()
+        zone = request.args.get('zone', '').strip()
+        
+        if is_live_request():
+            live_map = get_live_map()
+            stats = live_map.stats_row(STATS_ALL_ZONES)
+            zone_stats = live_map.stats_row(zone) if zone else stats
+            rows = [row for row in live_map.locations if row['zone'] == zone] if zone else live_map.locations
+        else:
+            storage = get_storage()
+            layout_id = storage.get_session(get_user_session_id())['layout_id']
+            
+            # Obtener estadísticas generales (precalculadas en la carga)
+            stats = storage.get_layout_stats(layout_id)
+            zone_stats = storage.get_layout_stats(layout_id, zone) if zone else stats
+            rows = storage.iter_locations(layout_id, zones=[zone] if zone else None)
         
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        # Obtener estadísticas generales
-        cursor.execute('''
-            SELECT 
-                COUNT(*) as total_locations,
-                COUNT(DISTINCT material_code) as total_materials,
-                MAX(row_num) as max_row,
-                MAX(col_num) as max_col,
-                GROUP_CONCAT(DISTINCT zone) as zones
-            FROM warehouse_locations 
-            WHERE session_id = ?
-        ''', (session_id,))
-        
-        stats = cursor.fetchone()
-        
-        if not stats or stats['total_locations'] == 0:
+        if not stats or stats['total_records'] == 0:
             return jsonify({'success': True, 'locations': [], 'stats': {}})
         
+        if not zone_stats:
+            return jsonify({
+                'success': False,
+                'message': f'Zona no encontrada: {zone}'
+            }), 404
+        
         # Obtener datos para el mapa (solo campos necesarios)
-        cursor.execute('''
-            SELECT 
-                location_code as code,
-                zone,
-                row_num as row,
-                col_num as col,
-                material_code as material,
-                material_desc as description,
-                quantity,
-                capacity,
-                unit,
-                ocupation_percent,
-                status
-            FROM warehouse_locations 
-            WHERE session_id = ?
-            ORDER BY zone, row_num, col_num
-        ''', (session_id,))
-        
-        rows = cursor.fetchall()
-        locations = [dict(row) for row in rows]
-        
-        conn.close()
-        
-        # Convertir string de zonas a lista
-        zones_list = stats['zones'].split(',') if stats['zones'] else []
+        locations = [{
+            'code': row['location_code'],
+            'zone': row['zone'],
+            'row': row['row_num'],
+            'col': row['col_num'],
+            'material': row['material_code'],
+            'description': row['material_desc'],
+            'quantity': row['quantity'],
+            'capacity': row['capacity'],
+            'unit': row['unit'],
+            'ocupation_percent': row['ocupation_percent'],
+            'status': row['status']
+        } for row in rows]
+        
+        zones_list = json.loads(stats['zones']) if stats['zones'] else []
         
         return jsonify({
             'success': True,
             'locations': locations,
             'stats': {
-                'total': stats['total_locations'],
+                'total': stats['total_records'],
                 'materials': stats['total_materials'],
-                'max_row': stats['max_row'] or 0,
-                'max_col': stats['max_col'] or 0,
-                'zones': zones_list
+                'max_row': zone_stats['max_row'] or 0,
+                'max_col': zone_stats['max_col'] or 0,
+                'zones': zones_list,
+                'zone': zone or None
             }
         })
     except Exception as e:
@@ -565,60 +738,41 @@ def map_data():
 def get_stats():
     """Obtener estadísticas detalladas"""
     try:
-        session_id = get_user_session_id()
-        
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        cursor = conn.cursor()
-        
-        # Estadísticas por estado
-        cursor.execute('''
-            SELECT 
-                status,
-                COUNT(*) as count,
-                ROUND(AVG(ocupation_percent), 2) as avg_ocupation,
-                SUM(quantity) as total_quantity,
-                SUM(capacity) as total_capacity
-            FROM warehouse_locations 
-            WHERE session_id = ?
-            GROUP BY status
-        ''', (session_id,))
+        if is_live_request():
+            stats_rows = get_live_map().stats
+        else:
+            storage = get_storage()
+            stats_rows = storage.list_layout_stats(storage.get_session(get_user_session_id())['layout_id'])
         
+        # Estadísticas precalculadas: fila '*' con los totales y una fila por zona
         status_stats = {}
-        for row in cursor.fetchall():
-            status_stats[row[0]] = {
-                'count': row[1],
-                'avg_ocupation': row[2],
-                'total_quantity': row[3],
-                'total_capacity': row[4]
-            }
-        
-        # Estadísticas por zona
-        cursor.execute('''
-            SELECT 
-                zone,
-                COUNT(*) as count,
-                SUM(quantity) as total_quantity,
-                SUM(capacity) as total_capacity
-            FROM warehouse_locations 
-            WHERE session_id = ?
-            GROUP BY zone
-            ORDER BY zone
-        ''', (session_id,))
-        
+        totals = {}
         zone_stats = []
-        for row in cursor.fetchall():
+        for row in stats_rows:
+            if row['zone'] == STATS_ALL_ZONES:
+                status_stats = json.loads(row['status_stats']) if row['status_stats'] else {}
+                totals = {
+                    'total': row['total_records'],
+                    'materials': row['total_materials'],
+                    'total_quantity': row['total_quantity'],
+                    'total_capacity': row['total_capacity'],
+                    'max_row': row['max_row'] or 0,
+                    'max_col': row['max_col'] or 0
+                }
+                continue
             zone_stats.append({
-                'zone': row[0],
-                'count': row[1],
-                'total_quantity': row[2],
-                'total_capacity': row[3]
+                'zone': row['zone'],
+                'count': row['total_records'],
+                'total_quantity': row['total_quantity'],
+                'total_capacity': row['total_capacity'],
+                'max_row': row['max_row'] or 0,
+                'max_col': row['max_col'] or 0
             })
         
-        conn.close()
-        
         return jsonify({
             'success': True,
             'status_stats': status_stats,
+            'totals': totals,
             'zone_stats': zone_stats
         })
     except Exception as e:
@@ -627,6 +781,269 @@ def get_stats():
             'message': f'Error: {str(e)}'
         }), 500
 
+@warehouse2d_bp.route('/zone-grid')
+@login_required
+@require_warehouse_session
+def zone_grid():
+    """Mapa de calor y resumen de una zona, servidos desde la rejilla en memoria"""
+    try:
+        grid = get_request_grid()
+        
+        zone = request.args.get('zone', '').strip()
+        if not zone:
+            return jsonify({
+                'success': True,
+                'zones': grid.zones,
+                'summary': grid.zone_summary(),
+                'omitted_total': len(grid.omitted),
+                'omitted_locations': grid.omitted[:MAX_OMITTED_REPORT]
+            })
+        
+        if zone not in grid.zone_index:
+            return jsonify({
+                'success': False,
+                'message': f'Zona no encontrada: {zone}'
+            }), 404
+        
+        return jsonify({
+            'success': True,
+            'heatmap': grid.zone_heatmap(zone),
+            'summary': grid.zone_summary(zone)[0]
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
+@warehouse2d_bp.route('/neighbors')
+@login_required
+@require_warehouse_session
+def neighbors():
+    """Ubicaciones alrededor de un código (radio en filas/columnas)"""
+    try:
+        code = request.args.get('code', '').strip()
+        radius = min(max(request.args.get('radius', 1, type=int), 0), 10)
+        
+        if not code:
+            return jsonify({
+                'success': False,
+                'message': 'Debe indicar el código de ubicación'
+            }), 400
+        
+        grid = get_request_grid()
+        
+        zone, row_num, col_num = parse_location_code(code)
+        if zone not in grid.zone_index:
+            return jsonify({
+                'success': False,
+                'message': f'Zona no encontrada: {zone}'
+            }), 404
+        
+        results = grid.neighborhood(zone, row_num, col_num, radius)
+        
+        return jsonify({
+            'success': True,
+            'center': {'zone': zone, 'row': row_num, 'col': col_num},
+            'radius': radius,
+            'results': results,
+            'count': len(results)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
+@warehouse2d_bp.route('/suggest-slot')
+@login_required
+@require_warehouse_session
+def suggest_slot():
+    """Sugerir las ubicaciones vacías o con ocupación baja más cercanas para guardar material"""
+    try:
+        location = request.args.get('location', '').strip()
+        zone = request.args.get('zone', '').strip()
+        required = request.args.get('capacity', 0.0, type=float)
+        k = min(max(request.args.get('k', 5, type=int), 1), 50)
+        same_zone = request.args.get('same_zone', '').lower() in ('1', 'true', 'si', 'sí')
+        
+        if not location and not zone:
+            return jsonify({
+                'success': False,
+                'message': 'Debe indicar una ubicación o una zona de referencia'
+            }), 400
+        
+        # Sin ubicación exacta se toma el inicio de la zona como referencia
+        if location:
+            zone, row_num, col_num = parse_location_code(location)
+        else:
+            row_num, col_num = 1, 1
+        
+        grid = get_request_grid()
+        
+        if zone not in grid.zone_index:
+            return jsonify({
+                'success': False,
+                'message': f'Zona no encontrada: {zone}'
+            }), 404
+        
+        results = grid.slot_index.nearest(zone, row_num, col_num, required, k, same_zone)
+        
+        return jsonify({
+            'success': True,
+            'reference': {'zone': zone, 'row': row_num, 'col': col_num},
+            'required_capacity': required,
+            'results': results,
+            'count': len(results)
+        })
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
+@warehouse2d_bp.route('/heatmap.png')
+@login_required
+@require_warehouse_session
+def heatmap_png():
+    """Mapa de calor del layout como imagen PNG (cacheado en disco y validado por ETag)"""
+    try:
+        zone = request.args.get('zone', '').strip()
+        if zone == STATS_ALL_ZONES:
+            zone = ''
+        scale = min(max(request.args.get('scale', 8, type=int), MIN_SCALE), MAX_SCALE)
+        
+        # El PNG depende solo del contenido del archivo (o de la revisión del mapa en vivo), la zona y la escala
+        heatmaps = current_app.extensions['warehouse2d_heatmaps']
+        if is_live_request():
+            live_map = get_live_map()
+            revision = live_map.revision
+            load_grid = lambda: live_map.grid
+        else:
+            session_data = get_storage().get_session(get_user_session_id())
+            revision = session_data['file_hash'] or session_data['layout_id']
+            load_grid = lambda: get_layout_grid(session_data)
+        key = heatmaps.make_key(revision, zone, scale)
+        
+        def render():
+            grid = load_grid()
+            if zone and zone not in grid.zone_index:
+                raise KeyError(zone)
+            return render_heatmap(grid, zone, scale)
+        
+        try:
+            path = heatmaps.get_or_render(key, render)
+        except KeyError:
+            return jsonify({
+                'success': False,
+                'message': f'Zona no encontrada: {zone}'
+            }), 404
+        
+        response = send_file(path, mimetype='image/png', etag=key, conditional=True)
+        # La URL es la misma para cada carga del usuario: revalidar siempre con el ETag
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        response.cache_control.public = False
+        response.cache_control.max_age = None
+        return response
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
+def plan_pick_route(grid, pick_list):
+    """Ruta de una lista de picking: {'materials': [...], 'locations': [...], 'start', 'return_to_start'}"""
+    if not isinstance(pick_list, dict):
+        raise ValueError('Cada lista debe ser un objeto con "materials" y/o "locations"')
+    
+    materials = [str(code).strip() for code in pick_list.get('materials') or [] if str(code).strip()]
+    locations = [str(code).strip() for code in pick_list.get('locations') or [] if str(code).strip()]
+    if len(materials) + len(locations) > MAX_ROUTE_STOPS:
+        raise ValueError(f'Máximo {MAX_ROUTE_STOPS} paradas por ruta')
+    
+    model = grid.route_model
+    candidates, picks, missing = [], [], {'materials': [], 'locations': []}
+    
+    for code in dict.fromkeys(materials):
+        cells, quantity = grid.material_stock(code)
+        # Preferir ubicaciones con stock del material (no de otro material de la misma celda)
+        with_stock = cells[quantity > 0]
+        cells = with_stock if len(with_stock) else cells
+        if not len(cells):
+            missing['materials'].append(code)
+            continue
+        candidates.append(cells)
+        picks.append({'material': code})
+    
+    for code in dict.fromkeys(locations):
+        cell = model.cell_for(*parse_location_code(code))
+        if cell is None:
+            missing['locations'].append(code)
+            continue
+        candidates.append(np.array([cell], dtype=np.int64))
+        picks.append({'location': code})
+    
+    start = -1
+    if pick_list.get('start'):
+        start = model.cell_for(*parse_location_code(str(pick_list['start']).strip()))
+        if start is None:
+            raise ValueError(f'Ubicación de inicio no encontrada: {pick_list["start"]}')
+    
+    result = model.solve(candidates, start=start, return_to_start=bool(pick_list.get('return_to_start', True)))
+    
+    picks_by_cell = {}
+    for cell, pick in zip(result['assigned'], picks):
+        picks_by_cell.setdefault(cell, []).append(pick)
+    
+    stops = describe_route(grid, result['cells'], picks_by_cell)
+    return {
+        'stops': stops,
+        'count': sum(1 for stop in stops if not stop.get('depot')),
+        'distance': result['distance'],
+        'nn_distance': result['nn_distance'],
+        'missing': missing
+    }
+
+@warehouse2d_bp.route('/route', methods=['POST'])
+@login_required
+@require_warehouse_session
+def pick_route():
+    """Ordenar una o varias listas de picking (vecino más cercano + 2-opt sobre el layout)"""
+    try:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify({
+                'success': False,
+                'message': 'Debe enviar un JSON con "materials"/"locations" o una lista "lists"'
+            }), 400
+        
+        pick_lists = payload.get('lists')
+        single = pick_lists is None
+        if single:
+            pick_lists = [payload]
+        if not isinstance(pick_lists, list) or not pick_lists or len(pick_lists) > MAX_ROUTE_LISTS:
+            return jsonify({
+                'success': False,
+                'message': f'"lists" debe tener entre 1 y {MAX_ROUTE_LISTS} listas'
+            }), 400
+        
+        grid = get_request_grid()
+        
+        try:
+            routes = [plan_pick_route(grid, pick_list) for pick_list in pick_lists]
+        except ValueError as e:
+            return jsonify({'success': False, 'message': str(e)}), 400
+        
+        if single:
+            return jsonify(dict(routes[0], success=True))
+        return jsonify({'success': True, 'routes': routes})
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Error: {str(e)}'
+        }), 500
+
 @warehouse2d_bp.route('/download-template')
 @login_required
 def download_template():
@@ -708,64 +1125,49 @@ def download_template():
 @login_required
 @require_warehouse_session
 def export_excel():
-    """Exportar datos a Excel"""
+    """Exportar datos a Excel (fila a fila, con memoria constante)"""
     try:
-        session_id = get_user_session_id()
-        
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        cursor = conn.cursor()
-        
-        # Obtener metadata
-        cursor.execute('SELECT file_name FROM warehouse_sessions WHERE session_id = ?', (session_id,))
-        session_data = cursor.fetchone()
+        if is_live_request():
+            # Las filas del mapa en vivo ya están en memoria (mismas columnas que el layout)
+            rows = iter(get_live_map().locations)
+        else:
+            storage = get_storage()
+            
+            # Obtener metadata
+            session_data = storage.get_session(get_user_session_id())
+            
+            if not session_data:
+                flash('No hay datos para exportar', 'warning')
+                return redirect(url_for('warehouse2d.index'))
+            
+            rows = storage.iter_locations(session_data['layout_id'])
         
-        if not session_data:
-            flash('No hay datos para exportar', 'warning')
-            return redirect(url_for('warehouse2d.index'))
+        # Los anchos de columna se estiman con las primeras filas
+        sample = list(islice(rows, EXPORT_WIDTH_SAMPLE))
         
-        # Obtener todos los datos
-        cursor.execute('''
-            SELECT 
-                location_code,
-                zone,
-                row_num,
-                col_num,
-                material_code,
-                material_desc,
-                quantity,
-                capacity,
-                unit,
-                ocupation_percent,
-                status
-            FROM warehouse_locations 
-            WHERE session_id = ?
-            ORDER BY zone, row_num, col_num
-        ''', (session_id,))
-        
-        rows = cursor.fetchall()
-        
-        if not rows:
+        if not sample:
             flash('No hay datos para exportar', 'warning')
-            return redirect(url_for('warehouse2d.index'))
-        
-        conn.close()
+            return redirect(url_for('warehouse2d.index', source=request.args.get('source')))
         
-        # Crear DataFrame
-        df = pd.DataFrame(rows, columns=[
+        headers = [
             'Ubicación', 'Zona', 'Fila', 'Columna', 'Material',
             'Descripción', 'Cantidad', 'Capacidad', 'Unidad',
             'Ocupación %', 'Estado'
-        ])
+        ]
         
-        # Crear archivo Excel en memoria
-        output = BytesIO()
+        # constant_memory escribe cada fila a disco al pasar a la siguiente
+        fd, path = tempfile.mkstemp(suffix='.xlsx', dir=TEMP_DIR)
+        os.close(fd)
         
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Datos Almacén', index=False)
-            
-            # Formato
-            workbook = writer.book
-            worksheet = writer.sheets['Datos Almacén']
+        try:
+            # Sin detección de URLs/fórmulas: los textos del layout se escriben tal cual
+            workbook = xlsxwriter.Workbook(path, {
+                'constant_memory': True,
+                'tmpdir': TEMP_DIR,
+                'strings_to_urls': False,
+                'strings_to_formulas': False
+            })
+            worksheet = workbook.add_worksheet('Datos Almacén')
             
             # Formato para encabezados
             header_format = workbook.add_format({
@@ -775,31 +1177,34 @@ def export_excel():
                 'border': 1
             })
             
-            # Formato para porcentajes
-            percent_format = workbook.add_format({'num_format': '0.00%'})
+            # Ajustar ancho de columnas (antes de escribir filas)
+            for i, (header, column) in enumerate(zip(headers, LOCATION_COLUMNS)):
+                column_width = max(max(len(str(row[column])) for row in sample), len(header)) + 2
+                worksheet.set_column(i, i, min(column_width, 50))
             
-            # Aplicar formatos
-            for col_num, value in enumerate(df.columns.values):
-                worksheet.write(0, col_num, value, header_format)
+            worksheet.write_row(0, 0, headers, header_format)
             
-            # Ajustar ancho de columnas
-            for i, column in enumerate(df.columns):
-                column_width = max(df[column].astype(str).map(len).max(), len(column)) + 2
-                worksheet.set_column(i, i, min(column_width, 50))
-        
-        output.seek(0)
+            # Escritores por tipo de columna (evita la detección de tipo celda por celda)
+            writers = [
+                (i, column, worksheet.write_number if column in EXPORT_NUMERIC_COLUMNS else worksheet.write_string)
+                for i, column in enumerate(LOCATION_COLUMNS)
+            ]
+            for row_num, row in enumerate(chain(sample, rows), start=1):
+                for i, column, write in writers:
+                    value = row[column]
+                    if value is not None:
+                        write(row_num, i, value)
+            
+            workbook.close()
+        except Exception:
+            os.remove(path)
+            raise
         
         filename = f'almacen_export_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-        
-        return send_file(
-            output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-            as_attachment=True,
-            download_name=filename
-        )
+        return temp_file_response(path, filename, chunk_size=EXPORT_CHUNK_SIZE)
     except Exception as e:
         flash(f'Error al exportar: {str(e)}', 'error')
-        return redirect(url_for('warehouse2d.index'))
+        return redirect(url_for('warehouse2d.index', source=request.args.get('source')))
 
 @warehouse2d_bp.route('/clear-data', methods=['POST'])
 @login_required
@@ -808,15 +1213,12 @@ def clear_data():
     try:
         session_id = get_user_session_id()
         
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        cursor = conn.cursor()
-        
-        # Eliminar datos del usuario
-        cursor.execute('DELETE FROM warehouse_sessions WHERE session_id = ?', (session_id,))
-        cursor.execute('DELETE FROM warehouse_locations WHERE session_id = ?', (session_id,))
+        storage = get_storage()
+        previous = storage.get_session(session_id)
         
-        conn.commit()
-        conn.close()
+        # Eliminar la sesión; el layout se borra cuando ninguna otra sesión lo usa
+        storage.release_session(session_id)
+        invalidate_layout_grid(previous)
         
         # Limpiar sesión
         session.pop('warehouse_session_id', None)
@@ -838,36 +1240,16 @@ def search_locations():
     """Buscar ubicaciones"""
     try:
         query = request.args.get('q', '').strip()
-        session_id = get_user_session_id()
         
         if not query or len(query) < 2:
             return jsonify({'success': True, 'results': []})
         
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        search_term = f'%{query}%'
-        
-        cursor.execute('''
-            SELECT 
-                location_code, zone, row_num, col_num, material_code,
-                material_desc, quantity, capacity, ocupation_percent, status
-            FROM warehouse_locations 
-            WHERE session_id = ? AND (
-                location_code LIKE ? OR
-                zone LIKE ? OR
-                material_code LIKE ? OR
-                material_desc LIKE ?
-            )
-            ORDER BY location_code
-            LIMIT 50
-        ''', (session_id, search_term, search_term, search_term, search_term))
-        
-        rows = cursor.fetchall()
-        results = [dict(row) for row in rows]
-        
-        conn.close()
+        if is_live_request():
+            results = search_live_locations(get_live_map().locations, query, limit=50)
+        else:
+            storage = get_storage()
+            layout_id = storage.get_session(get_user_session_id())['layout_id']
+            results = storage.search_locations(layout_id, query, limit=50)
         
         return jsonify({
             'success': True,
@@ -885,32 +1267,27 @@ def search_locations():
 @warehouse2d_bp.route('/cleanup', methods=['POST'])
 @login_required
 def cleanup_all():
-    """Limpiar todos los datos temporales (solo admin)"""
+    """Pedir al janitor una limpieza inmediata (sin janitor, un ciclo acotado en la petición)"""
     try:
-        # Esta función debería estar protegida para solo administradores
-        # En producción, añade verificación de rol
-        
-        conn = sqlite3.connect(WAREHOUSE_DB)
-        cursor = conn.cursor()
+        janitor = get_janitor()
         
-        # Eliminar todas las sesiones expiradas
-        cutoff_time = datetime.now() - timedelta(hours=24)
-        cursor.execute('DELETE FROM warehouse_sessions WHERE expires_at < ?', (cutoff_time.strftime('%Y-%m-%d %H:%M:%S'),))
-        cursor.execute('DELETE FROM warehouse_locations WHERE session_id IN (SELECT session_id FROM warehouse_sessions WHERE expires_at < ?)', (cutoff_time.strftime('%Y-%m-%d %H:%M:%S'),))
-        
-        # Vaciar tablas si están muy grandes (más de 1M registros)
-        cursor.execute('SELECT COUNT(*) FROM warehouse_locations')
-        count = cursor.fetchone()[0]
-        
-        if count > 1000000:
-            cursor.execute('DELETE FROM warehouse_locations WHERE id IN (SELECT id FROM warehouse_locations ORDER BY id DESC LIMIT 500000 OFFSET 500000)')
+        # Janitor desactivado (WAREHOUSE2D_JANITOR_INTERVAL=0): un solo ciclo acotado por
+        # su presupuesto de tiempo, en esta petición
+        if not janitor.running:
+            return jsonify({
+                'success': True,
+                'message': 'Limpieza ejecutada (janitor desactivado)',
+                'janitor_running': False,
+                'last_run': janitor.run_once()
+            })
         
-        conn.commit()
-        conn.close()
+        janitor.wake()
         
         return jsonify({
             'success': True,
-            'message': f'Limpieza completada. Registros eliminados: {count}'
+            'message': 'Limpieza programada',
+            'janitor_running': True,
+            'last_run': janitor.last_run
         })
     except Exception as e:
         return jsonify({
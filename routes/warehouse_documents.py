@@ -1,15 +1,27 @@
 # routes/warehouse_documents.py - Versión simplificada para copiar/pegar
-from flask import Blueprint, request, jsonify, render_template
+from flask import Blueprint, request, jsonify, render_template, current_app, Response, url_for
 import os
+import json
+import time
 import tempfile
-import uuid
-from werkzeug.utils import secure_filename
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
 import traceback
+from collections import Counter
 
-from utils.ocr_reader import AdvancedOCRReader
-from utils.document_parser import parse_warehouse_document
+from flask_login import current_user, login_required
+from openpyxl import Workbook
+
+from utils.ocr_pool import get_ocr_pool
+from utils.document_cache import get_document_cache
+from utils.document_intake import receive_upload
+from utils.document_jobs import FILE_STATUS_PENDING, JOB_STATUS_DONE, get_job_runner
+from utils.document_metrics import SLOWEST_DOCUMENTS, get_document_metrics
+from utils.document_parser import has_required_fields, parse_warehouse_document, required_fields
+from utils.document_records import (MAX_PAGE_SIZE, ensure_document_record_indexes, excel_headers, iter_excel_rows,
+                                    record_filters, record_values, save_document_records, search_document_records)
+from utils.file_response import temp_file_response
+from utils.ocr_preprocess import PREPROCESS_PROFILES, is_valid_profile
 
 logger = logging.getLogger(__name__)
 
@@ -18,10 +30,159 @@ warehouse_documents_bp = Blueprint('warehouse_documents', __name__, url_prefix='
 # Configuración
 ALLOWED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'bmp', 'tiff', 'tif'}
 MAX_FILE_SIZE = 16 * 1024 * 1024  # 16MB
+SPILL_FILE_MB = 4  # Por encima se guarda en disco en lugar de quedar en memoria
+DOCUMENT_CACHE_DIR = os.path.join(tempfile.gettempdir(), 'warehouse_app', 'document_cache')
+DOCUMENT_JOBS_DIR = os.path.join(tempfile.gettempdir(), 'warehouse_app', 'document_jobs')
+JOB_STREAM_INTERVAL = 0.5  # Segundos entre lecturas del estado en el stream SSE
+JOB_STREAM_TIMEOUT = 15 * 60
+JOB_STREAM_HEARTBEAT = 15
+RECORDS_PER_PAGE = 50
+EXPORT_CHUNK_SIZE = 1024 * 1024
+
+@warehouse_documents_bp.record_once
+def setup_document_records(state):
+    """Índices de document_records en bases creadas antes de que existieran"""
+    from models import db
+    with state.app.app_context():
+        try:
+            ensure_document_record_indexes(db.engine)
+        except Exception as e:
+            state.app.logger.warning(f"No se pudieron crear los índices de document_records: {e}")
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def _get_document_cache():
+    """Cache en disco de OCR + parseo por SHA-256 del archivo"""
+    return get_document_cache(
+        current_app.config.get('DOCUMENT_CACHE_DIR') or DOCUMENT_CACHE_DIR,
+        current_app.config.get('DOCUMENT_CACHE_MAX_MB', 200) * 1024 * 1024
+    )
+
+def _get_job_runner():
+    """Trabajos asíncronos: estado en disco compartido entre workers, hilos locales"""
+    return get_job_runner(
+        current_app.config.get('DOCUMENT_JOBS_DIR') or DOCUMENT_JOBS_DIR,
+        current_app.config.get('DOCUMENT_JOB_WORKERS', 2)
+    )
+
+def _aplicar_resultado(file_result, parsed_data):
+    """Copiar los campos parseados al resultado del archivo"""
+    if parsed_data.get('parse_success'):
+        file_result['success'] = True
+        file_result['campos_extraidos'] = parsed_data.get('campos_extraidos', {})
+        file_result['campos_faltantes'] = parsed_data.get('campos_faltantes', [])
+        file_result['porcentaje_exito'] = parsed_data.get('porcentaje_exito', '0%')
+        
+        # Generar texto copiable para Excel
+        file_result['texto_copiable'] = _generar_texto_copiable(file_result['campos_extraidos'])
+        
+    else:
+        file_result['error'] = parsed_data.get('parse_error', 'Error desconocido al parsear')
+
+def _opcion(nombre, config_key):
+    """Opción sí/no de la subida (query o formulario); sin valor, la de la configuración"""
+    valor = request.args.get(nombre, request.form.get(nombre))
+    if valor in (None, ''):
+        return bool(current_app.config.get(config_key, False))
+    return str(valor).lower() in ('1', 'true', 'si', 'sí')
+
+def _usuario_actual():
+    return current_user.id if current_user and current_user.is_authenticated else None
+
+def _campos_requeridos():
+    """Campos que cortan el OCR en modo incremental; None si se pidió la extracción completa"""
+    completo = str(request.args.get('full', request.form.get('full', ''))).lower() in ('1', 'true', 'si', 'sí')
+    if completo or not current_app.config.get('DOCUMENT_EARLY_EXIT', True):
+        return None
+    campos = current_app.config.get('DOCUMENT_REQUIRED_FIELDS') or ''
+    return required_fields(campos.split(',') if isinstance(campos, str) else campos)
+
+def _procesar_archivos(pendientes, cache, ocr_pool, preprocess=None, templates=False, required=None):
+    """Cache → OCR (pool de procesos) → parseo; completa el file_result de cada documento recibido.
+    Con required, el OCR de cada PDF se corta cuando el texto ya tiene esos campos.
+    Devuelve el texto leído de cada documento por id(file_result) (para guardar el registro)."""
+    metrics = get_document_metrics()
+    textos = {}
+    
+    # Documentos ya procesados (mismo contenido y preprocesado) salen del cache sin OCR
+    por_procesar = []  # (file_result, documento, cache_key)
+    for file_result, document in pendientes:
+        cache_key = cache.key_for_document(document, preprocess, templates, required)
+        cached = cache.get(cache_key)
+        if cached:
+            file_result['cache'] = 'hit'
+            metrics.record_cache_hit()
+            textos[id(file_result)] = cached['ocr'].get('text', '')
+            _aplicar_resultado(file_result, cached['parsed'])
+        else:
+            file_result['cache'] = 'miss'
+            por_procesar.append((file_result, document, cache_key))
+    
+    logger.info(f"Procesando {len(por_procesar)} archivos ({len(pendientes) - len(por_procesar)} desde cache)")
+    
+    # Extraer texto con OCR (páginas y archivos repartidos en el pool de procesos)
+    stop_when = (lambda text: has_required_fields(text, required)) if required else None
+    ocr_results = ocr_pool.extract_many([document for _, document, _ in por_procesar], preprocess, templates,
+                                        stop_when)
+    
+    for (file_result, _, cache_key), ocr_result in zip(por_procesar, ocr_results):
+        file_result['timings'] = ocr_result.get('timings')
+        
+        if not ocr_result['success']:
+            file_result['error'] = f"Error OCR: {ocr_result.get('error')}"
+            metrics.record_document(file_result['filename'], ocr_result, 0.0, False)
+            continue
+        
+        textos[id(file_result)] = ocr_result['text']
+        try:
+            # Parsear documento - extraer los 9 campos
+            started = time.perf_counter()
+            parsed_data = parse_warehouse_document(ocr_result['text'])
+            metrics.record_document(file_result['filename'], ocr_result, time.perf_counter() - started,
+                                    bool(parsed_data.get('parse_success')))
+            
+            # Solo se cachea con OCR exitoso (los errores pueden ser transitorios)
+            cache.set(cache_key, {
+                'ocr': {
+                    'text': ocr_result['text'],
+                    'pages': ocr_result.get('pages', 0),
+                    'file_type': ocr_result.get('file_type', '')
+                },
+                'parsed': parsed_data
+            })
+            
+            _aplicar_resultado(file_result, parsed_data)
+                
+        except Exception as e:
+            logger.error(f"Error procesando {file_result['filename']}: {e}\n{traceback.format_exc()}")
+            file_result['error'] = str(e)
+    
+    return textos
+
+def _guardar_registros(pendientes, textos, uploaded_by=None):
+    """Guardar en document_records, en un lote, los documentos con campos extraídos.
+    Cada file_result queda con 'registro' (creado / actualizado / duplicado / omitido / error)."""
+    guardables = [(file_result, document) for file_result, document in pendientes if file_result['success']]
+    if not guardables:
+        return {}
+    
+    filas = [
+        record_values(file_result['campos_extraidos'], textos.get(id(file_result), ''),
+                      file_result['filename'], document.size, uploaded_by)
+        for file_result, document in guardables
+    ]
+    try:
+        acciones = save_document_records(filas)
+    except Exception as e:
+        # El OCR ya se hizo: la respuesta sale igual, sin el registro guardado
+        logger.error(f"Error guardando registros de documentos: {e}\n{traceback.format_exc()}")
+        acciones = ['error'] * len(guardables)
+    
+    for (file_result, _), accion in zip(guardables, acciones):
+        file_result['registro'] = accion
+    return dict(Counter(acciones))
+
 @warehouse_documents_bp.route('/list')
 def list_documents():
     """Página principal"""
@@ -46,10 +207,51 @@ def upload_documents():
             'error': 'No se seleccionaron archivos'
         }), 400
     
-    temp_dir = tempfile.mkdtemp()
+    # Tipo de documento: elige el preprocesado de las imágenes antes del OCR
+    document_type = request.args.get('document_type') or request.form.get('document_type') \
+        or current_app.config.get('OCR_PREPROCESS')
+    if not is_valid_profile(document_type):
+        return jsonify({
+            'success': False,
+            'error': f"Tipo de documento no válido: {document_type} (opciones: {', '.join(PREPROCESS_PROFILES)})"
+        }), 400
+    
+    # OCR por regiones de los formatos conocidos (utils/ocr_templates.py)
+    templates = _opcion('templates', 'OCR_TEMPLATES')
+    required = _campos_requeridos()
+    # Guardar lo extraído en document_records (deduplicado por proceso + pesaje)
+    # Solo con sesión: la subida no tiene login_required y el guardado puede pisar registros
+    persist = _opcion('persist', 'DOCUMENT_PERSIST')
+    if persist and not current_user.is_authenticated:
+        if request.args.get('persist', request.form.get('persist')) not in (None, ''):
+            return jsonify({
+                'success': False,
+                'error': 'Inicie sesión para guardar los documentos (persist)'
+            }), 401
+        # DOCUMENT_PERSIST no aplica a subidas anónimas: solo se devuelve lo extraído
+        persist = False
+    uploaded_by = _usuario_actual() if persist else None
+    
+    # Modo asíncrono: responder con el id del trabajo y procesar en segundo plano
+    modo_async = str(request.args.get('async', request.form.get('async', ''))).lower() in ('1', 'true', 'si', 'sí')
+    # Los archivos quedan en memoria; solo los que superan el umbral van a disco
+    temp_dirs = []
+    if modo_async:
+        runner = _get_job_runner()
+        job_id = runner.store.new_job_id()
+        
+        def spill_dir():
+            return runner.store.files_dir(job_id)
+    else:
+        def spill_dir():
+            if not temp_dirs:
+                temp_dirs.append(tempfile.mkdtemp())
+            return temp_dirs[0]
+    spill_size = current_app.config.get('DOCUMENT_SPILL_MB', SPILL_FILE_MB) * 1024 * 1024
     resultados = []
     
-    ocr_reader = AdvancedOCRReader()
+    # 1. Validar y recibir todos los archivos; 2. OCR de todas las páginas en paralelo; 3. Parsear
+    pendientes = []  # (file_result, UploadedDocument)
     
     for file in files:
         file_result = {
@@ -60,12 +262,12 @@ def upload_documents():
             'campos_faltantes': [],
             'texto_copiable': ''
         }
+        resultados.append(file_result)
         
         try:
             # Validaciones
             if not allowed_file(file.filename):
                 file_result['error'] = f'Tipo de archivo no permitido'
-                resultados.append(file_result)
                 continue
             
             file.seek(0, 2)
@@ -74,54 +276,35 @@ def upload_documents():
             
             if file_size > MAX_FILE_SIZE:
                 file_result['error'] = f'Archivo demasiado grande ({file_size/1024/1024:.1f}MB)'
-                resultados.append(file_result)
-                continue
-            
-            # Guardar temporalmente
-            temp_filename = f"{uuid.uuid4()}_{secure_filename(file.filename)}"
-            temp_path = os.path.join(temp_dir, temp_filename)
-            file.save(temp_path)
-            
-            logger.info(f"Procesando: {file.filename}")
-            
-            # Extraer texto con OCR
-            ocr_result = ocr_reader.extract_text_from_file(temp_path)
-            
-            if not ocr_result['success']:
-                file_result['error'] = f"Error OCR: {ocr_result.get('error')}"
-                resultados.append(file_result)
                 continue
             
-            # Parsear documento - extraer los 9 campos
-            parsed_data = parse_warehouse_document(ocr_result['text'])
-            
-            if parsed_data.get('parse_success'):
-                file_result['success'] = True
-                file_result['campos_extraidos'] = parsed_data.get('campos_extraidos', {})
-                file_result['campos_faltantes'] = parsed_data.get('campos_faltantes', [])
-                file_result['porcentaje_exito'] = parsed_data.get('porcentaje_exito', '0%')
-                
-                # Generar texto copiable para Excel
-                file_result['texto_copiable'] = _generar_texto_copiable(file_result['campos_extraidos'])
-                
-            else:
-                file_result['error'] = parsed_data.get('parse_error', 'Error desconocido al parsear')
-            
-            resultados.append(file_result)
-            
-            # Limpiar
-            os.remove(temp_path)
+            # Leer a memoria (o a disco si es grande)
+            pendientes.append((file_result, receive_upload(file, file_size, spill_size, spill_dir)))
             
         except Exception as e:
-            logger.error(f"Error procesando {file.filename}: {e}\n{traceback.format_exc()}")
+            logger.error(f"Error recibiendo {file.filename}: {e}\n{traceback.format_exc()}")
             file_result['error'] = str(e)
-            resultados.append(file_result)
     
-    # Limpiar directorio
+    if modo_async:
+        return _encolar_trabajo(runner, job_id, resultados, pendientes, document_type, templates, required,
+                                persist, uploaded_by)
+    
+    registros = None
     try:
-        os.rmdir(temp_dir)
-    except:
-        pass
+        textos = _procesar_archivos(pendientes, _get_document_cache(),
+                                    get_ocr_pool(current_app.config.get('OCR_POOL_WORKERS')),
+                                    document_type, templates, required)
+        if persist:
+            registros = _guardar_registros(pendientes, textos, uploaded_by)
+    finally:
+        # Limpiar
+        for _, document in pendientes:
+            document.discard()
+        for temp_dir in temp_dirs:
+            try:
+                os.rmdir(temp_dir)
+            except OSError:
+                pass
     
     # Preparar respuesta
     successful = len([r for r in resultados if r['success']])
@@ -132,9 +315,114 @@ def upload_documents():
         'successful': successful,
         'failed': len(files) - successful,
         'resultados': resultados,
+        'document_type': document_type,
+        'templates': templates,
+        'required_fields': required,
+        'persist': persist,
+        'registros': registros,
         'timestamp': datetime.now().isoformat()
     })
 
+def _encolar_trabajo(runner, job_id, resultados, pendientes, document_type=None, templates=False, required=None,
+                     persist=False, uploaded_by=None):
+    """Registrar el trabajo y encolar un archivo por tarea"""
+    for file_result, _ in pendientes:
+        file_result['status'] = FILE_STATUS_PENDING
+    job = runner.store.create(job_id, resultados)
+    
+    # Los hilos no tienen contexto de Flask: cache y pool se resuelven aquí
+    cache = _get_document_cache()
+    ocr_pool = get_ocr_pool(current_app.config.get('OCR_POOL_WORKERS'))
+    app = current_app._get_current_object()
+    
+    def procesar(file_result, document):
+        textos = _procesar_archivos([(file_result, document)], cache, ocr_pool, document_type, templates, required)
+        if persist:
+            # La sesión de la base necesita el contexto de la app en el hilo
+            with app.app_context():
+                _guardar_registros([(file_result, document)], textos, uploaded_by)
+    
+    indices = {id(file_result): index for index, file_result in enumerate(resultados)}
+    for file_result, document in pendientes:
+        runner.submit(job_id, indices[id(file_result)], file_result, document, procesar)
+    
+    return jsonify({
+        'success': True,
+        'job_id': job_id,
+        'status': job['status'],
+        'total_files': job['total_files'],
+        'document_type': document_type,
+        'templates': templates,
+        'required_fields': required,
+        'persist': persist,
+        'status_url': url_for('warehouse_documents.job_status', job_id=job_id),
+        'stream_url': url_for('warehouse_documents.job_stream', job_id=job_id),
+        'timestamp': datetime.now().isoformat()
+    }), 202
+
+@warehouse_documents_bp.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Estado de un trabajo asíncrono con los resultados de los archivos ya procesados"""
+    job = _get_job_runner().store.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'error': 'Trabajo no encontrado'
+        }), 404
+    
+    job.pop('completed_order', None)
+    job['success'] = True
+    return jsonify(job)
+
+@warehouse_documents_bp.route('/jobs/<job_id>/stream', methods=['GET'])
+def job_stream(job_id):
+    """Server-Sent Events: un evento 'file' por archivo terminado y 'done' al final"""
+    store = _get_job_runner().store
+    if store.get(job_id) is None:
+        return jsonify({
+            'success': False,
+            'error': 'Trabajo no encontrado'
+        }), 404
+    
+    def sse(event, data):
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        sent = 0
+        started = last_event = time.monotonic()
+        while time.monotonic() - started < JOB_STREAM_TIMEOUT:
+            job = store.get(job_id)
+            if job is None:
+                yield sse('error', {'error': 'Trabajo no encontrado'})
+                return
+            
+            # Resultados en el orden en que terminaron
+            for index in job['completed_order'][sent:]:
+                yield sse('file', dict(job['resultados'][index], index=index))
+                last_event = time.monotonic()
+            sent = len(job['completed_order'])
+            
+            if job['status'] == JOB_STATUS_DONE:
+                yield sse('done', {
+                    'job_id': job_id,
+                    'total_files': job['total_files'],
+                    'successful': job['successful'],
+                    'failed': job['total_files'] - job['successful']
+                })
+                return
+            
+            if time.monotonic() - last_event > JOB_STREAM_HEARTBEAT:
+                yield ": ping\n\n"
+                last_event = time.monotonic()
+            time.sleep(JOB_STREAM_INTERVAL)
+        
+        yield sse('timeout', {'job_id': job_id})
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+
 def _generar_texto_copiable(campos: dict) -> str:
     """Genera texto formateado para copiar y pegar en Excel"""
     
@@ -291,8 +579,87 @@ def diagnostic():
     for file_path in common_files:
         info['system_files'][file_path] = os.path.exists(file_path)
     
+    # Aciertos y fallos del cache de documentos de este proceso
+    info['document_cache'] = _get_document_cache().info()
+    
     return jsonify(info)
 
+@warehouse_documents_bp.route('/metrics', methods=['GET'])
+def document_metrics():
+    """Tiempos por etapa, páginas y confianza de OCR de este proceso: histogramas y documentos más lentos"""
+    try:
+        slowest = max(0, int(request.args.get('slowest', SLOWEST_DOCUMENTS)))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'slowest debe ser un número'}), 400
+    
+    data = get_document_metrics().snapshot(slowest)
+    data['document_cache'] = _get_document_cache().info()
+    data['success'] = True
+    return jsonify(data)
+
+def _filtros_registros():
+    """Condiciones de búsqueda de la query (fechas YYYY-MM-DD, date_to inclusive); ValueError si no son válidas"""
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    return record_filters(
+        process_number=request.args.get('process_number', '').strip(),
+        weigh_number=request.args.get('weigh_number', '').strip(),
+        plate=request.args.get('plate', '').strip(),
+        date_from=datetime.strptime(date_from, '%Y-%m-%d') if date_from else None,
+        date_to=datetime.strptime(date_to, '%Y-%m-%d') + timedelta(days=1) if date_to else None
+    )
+
+@warehouse_documents_bp.route('/records', methods=['GET'])
+@login_required
+def search_records():
+    """Documentos guardados, paginados: process_number, weigh_number, plate, date_from, date_to"""
+    try:
+        conditions = _filtros_registros()
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = max(1, min(int(request.args.get('per_page', RECORDS_PER_PAGE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Filtros no válidos (page y per_page numéricos, fechas YYYY-MM-DD)'
+        }), 400
+    
+    records, total = search_document_records(conditions, page, per_page)
+    return jsonify({
+        'success': True,
+        'records': [record.to_dict() for record in records],
+        'total': total,
+        'page': page,
+        'per_page': per_page,
+        'pages': max(1, (total + per_page - 1) // per_page)
+    })
+
+@warehouse_documents_bp.route('/records/export', methods=['GET'])
+@login_required
+def export_records():
+    """Excel (to_excel_dict) de los documentos guardados con los mismos filtros que /records"""
+    try:
+        conditions = _filtros_registros()
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Fechas no válidas (YYYY-MM-DD)'}), 400
+    
+    # write_only escribe cada fila al agregarla; los registros se leen de la base por bloques
+    fd, path = tempfile.mkstemp(suffix='.xlsx')
+    os.close(fd)
+    try:
+        workbook = Workbook(write_only=True)
+        worksheet = workbook.create_sheet('Documentos')
+        headers = excel_headers()
+        worksheet.append(headers)
+        for row in iter_excel_rows(conditions):
+            worksheet.append([row[header] for header in headers])
+        workbook.save(path)
+    except Exception:
+        os.remove(path)
+        raise
+    
+    filename = f'documentos_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
+    return temp_file_response(path, filename, chunk_size=EXPORT_CHUNK_SIZE)
+
 # routes/warehouse_documents.py
 @warehouse_documents_bp.route('/test-ocr-simple', methods=['GET'])
 def test_ocr_simple():
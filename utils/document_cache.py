@@ -0,0 +1,149 @@
+# utils/document_cache.py - Cache en disco de resultados de OCR y parseo por contenido
+#
+# Los choferes y almacenistas suben muchas veces el mismo ticket o guía. La clave es
+# el SHA-256 de los bytes del archivo más la configuración de OCR y la versión del
+# cache, así un archivo idéntico devuelve el texto y los campos ya extraídos sin
+# volver a pasar por Tesseract. Cada entrada es un JSON; al superar el tamaño máximo
+# se borran las menos usadas (el mtime se actualiza en cada acierto).
+import hashlib
+import json
+import logging
+import os
+import threading
+import uuid
+from typing import Any, Dict, List, Optional
+
+from utils.ocr_preprocess import DEFAULT_PREPROCESS
+from utils.ocr_reader import MIN_PAGE_TEXT, OCR_CONFIG, PDF_ZOOM
+
+logger = logging.getLogger(__name__)
+
+# Subir al cambiar el OCR o el parser para invalidar las entradas anteriores
+DOCUMENT_CACHE_VERSION = 3
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DocumentCache:
+    """Resultados de OCR + parseo en disco, direccionados por contenido, con desalojo LRU"""
+
+    def __init__(self, directory: str, max_bytes: int = 200 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._bytes = sum(entry.stat().st_size for entry in self._entries())
+
+    @staticmethod
+    def make_key(content_hash: str, preprocess: Optional[str] = None, templates: bool = False,
+                 required: Optional[List[str]] = None) -> str:
+        """Clave de un archivo: su hash más todo lo que cambia el texto extraído
+        (required: campos con los que se cortó el OCR en modo incremental)"""
+        settings = f'{DOCUMENT_CACHE_VERSION}|{OCR_CONFIG}|{PDF_ZOOM}|{MIN_PAGE_TEXT}|{preprocess or DEFAULT_PREPROCESS}'
+        if templates:
+            settings += '|plantillas'
+        if required:
+            settings += '|campos:' + ','.join(required)
+        return hashlib.sha256(f'{content_hash}|{settings}'.encode()).hexdigest()
+
+    def key_for_file(self, path: str, preprocess: Optional[str] = None, templates: bool = False,
+                     required: Optional[List[str]] = None) -> str:
+        return self.make_key(file_sha256(path), preprocess, templates, required)
+
+    def key_for_document(self, document, preprocess: Optional[str] = None, templates: bool = False,
+                         required: Optional[List[str]] = None) -> str:
+        """Clave de un UploadedDocument (hash de los bytes en memoria o del archivo)"""
+        return self.make_key(document.sha256(), preprocess, templates, required)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.json')
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # Marcar como usado recientemente para el LRU
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def set(self, key: str, entry: Dict[str, Any]):
+        path = self.path(key)
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        # Escritura atómica: otro proceso nunca lee un JSON a medio escribir
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"No se pudo guardar en el cache de documentos: {e}")
+            return
+        with self._lock:
+            self._bytes += len(data)
+            over = self._bytes > self.max_bytes
+        if over:
+            self._prune()
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.json')]
+
+    def _prune(self):
+        """Borrar las entradas menos usadas hasta quedar en el 90% del máximo"""
+        with self._lock:
+            try:
+                entries = [(entry, entry.stat()) for entry in self._entries()]
+                total = sum(stat.st_size for _, stat in entries)
+                entries.sort(key=lambda item: item[1].st_mtime)
+                target = self.max_bytes * 0.9
+                for entry, stat in entries:
+                    if total <= target:
+                        break
+                    os.remove(entry.path)
+                    total -= stat.st_size
+                    self.evictions += 1
+                self._bytes = total
+            except OSError as e:
+                logger.warning(f"No se pudo limpiar el cache de documentos: {e}")
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'directory': self.directory,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+            }
+
+
+_cache: Optional[DocumentCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_document_cache(directory: str, max_bytes: int) -> DocumentCache:
+    """Cache de documentos global del proceso"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DocumentCache(directory, max_bytes)
+        return _cache
@@ -0,0 +1,71 @@
+# utils/document_intake.py - Recepción de documentos subidos sin pasar por disco
+#
+# Los tickets y guías suelen pesar unos cientos de KB: se leen de la subida a memoria
+# y el OCR los abre desde los bytes (fitz.open(stream=...), Image.open(BytesIO)).
+# Solo los archivos que superan el umbral se guardan en disco, para no retener
+# documentos grandes en la memoria del worker mientras esperan el OCR.
+import hashlib
+import os
+import uuid
+from typing import Callable, Optional, Union
+
+from utils.document_cache import file_sha256
+
+
+class UploadedDocument:
+    """Archivo subido: bytes en memoria o, si superó el umbral, una ruta en disco"""
+
+    def __init__(self, filename: str, data: Optional[bytes] = None, path: Optional[str] = None):
+        self.filename = filename
+        self.data = data
+        self.path = path
+        self._sha256: Optional[str] = None
+
+    @property
+    def in_memory(self) -> bool:
+        return self.data is not None
+
+    @property
+    def name(self) -> str:
+        """Nombre para elegir el lector por extensión (la ruta si está en disco)"""
+        return self.filename if self.in_memory else self.path
+
+    @property
+    def source(self) -> Union[bytes, str]:
+        """Lo que reciben las funciones de OCR: los bytes o la ruta"""
+        return self.data if self.in_memory else self.path
+
+    @property
+    def ext(self) -> str:
+        return os.path.splitext(self.filename)[1].lower()
+
+    @property
+    def size(self) -> int:
+        return len(self.data) if self.in_memory else os.path.getsize(self.path)
+
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = hashlib.sha256(self.data).hexdigest() if self.in_memory else file_sha256(self.path)
+        return self._sha256
+
+    def discard(self):
+        """Liberar los bytes o borrar el archivo en disco"""
+        self.data = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+def receive_upload(file, size: int, spill_threshold: int, spill_dir: Callable[[], str]) -> UploadedDocument:
+    """Leer un FileStorage a memoria; por encima de spill_threshold bytes, guardarlo en spill_dir()"""
+    file.seek(0)
+    if size <= spill_threshold:
+        return UploadedDocument(file.filename, data=file.read())
+
+    # Solo la extensión del nombre original: decide el lector y no depende de secure_filename
+    path = os.path.join(spill_dir(), f"{uuid.uuid4().hex}{os.path.splitext(file.filename)[1].lower()}")
+    file.save(path)
+    return UploadedDocument(file.filename, path=path)
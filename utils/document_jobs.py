@@ -0,0 +1,161 @@
+# utils/document_jobs.py - Trabajos asíncronos de procesamiento de documentos
+#
+# En modo asíncrono la subida guarda los archivos, encola un trabajo por archivo en
+# un pool de hilos local y responde de inmediato con el id del trabajo. El estado
+# vive en un JSON por trabajo en disco (escritura atómica), así cualquier worker de
+# gunicorn puede responder la consulta o el stream SSE aunque el procesamiento
+# ocurra en otro. Cada hilo delega el OCR en el pool de procesos (utils/ocr_pool.py).
+# Los archivos chicos esperan en memoria; solo los grandes quedan en el directorio del trabajo.
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+JOB_STATUS_QUEUED = 'queued'
+JOB_STATUS_RUNNING = 'running'
+JOB_STATUS_DONE = 'done'
+FILE_STATUS_PENDING = 'pending'
+FILE_STATUS_DONE = 'done'
+
+
+class DocumentJobStore:
+    """Estado de los trabajos en disco: <directorio>/<job_id>/job.json y los archivos subidos"""
+
+    def __init__(self, directory: str, ttl: int = 3600):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def new_job_id() -> str:
+        return uuid.uuid4().hex
+
+    def job_dir(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def files_dir(self, job_id: str) -> str:
+        path = os.path.join(self.job_dir(job_id), 'files')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.job_dir(job_id), 'job.json')
+
+    def _write(self, job: Dict[str, Any]):
+        path = self._path(job['job_id'])
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(job, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        # El id viene de la URL: solo hex para no salir del directorio
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._path(job_id), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def create(self, job_id: str, resultados: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Registrar un trabajo; los archivos con status 'pending' quedan por procesar"""
+        self.prune()
+        completed = [i for i, r in enumerate(resultados) if r.get('status') != FILE_STATUS_PENDING]
+        # Los rechazados en la validación ya están terminados
+        for index in completed:
+            resultados[index]['status'] = FILE_STATUS_DONE
+        job = {
+            'job_id': job_id,
+            'status': JOB_STATUS_QUEUED if len(completed) < len(resultados) else JOB_STATUS_DONE,
+            'total_files': len(resultados),
+            'completed': len(completed),
+            'successful': 0,
+            'completed_order': completed,
+            'resultados': resultados,
+            'created_at': datetime.now().isoformat(),
+            'finished_at': None,
+        }
+        if job['status'] == JOB_STATUS_DONE:
+            job['finished_at'] = job['created_at']
+        os.makedirs(self.job_dir(job_id), exist_ok=True)
+        with self._lock:
+            self._write(job)
+        return job
+
+    def complete_file(self, job_id: str, index: int, file_result: Dict[str, Any]):
+        """Guardar el resultado de un archivo y cerrar el trabajo si era el último"""
+        with self._lock:
+            job = self.get(job_id)
+            if job is None:
+                return
+            file_result['status'] = FILE_STATUS_DONE
+            job['resultados'][index] = file_result
+            job['completed_order'].append(index)
+            job['completed'] = len(job['completed_order'])
+            job['successful'] = sum(1 for r in job['resultados'] if r.get('success'))
+            job['status'] = JOB_STATUS_RUNNING
+            if job['completed'] >= job['total_files']:
+                job['status'] = JOB_STATUS_DONE
+                job['finished_at'] = datetime.now().isoformat()
+            self._write(job)
+        if job['status'] == JOB_STATUS_DONE:
+            shutil.rmtree(os.path.join(self.job_dir(job_id), 'files'), ignore_errors=True)
+
+    def prune(self):
+        """Borrar trabajos más viejos que el TTL"""
+        cutoff = time.time() - self.ttl
+        try:
+            for entry in os.scandir(self.directory):
+                if entry.is_dir() and entry.stat().st_mtime < cutoff:
+                    job_path = os.path.join(entry.path, 'job.json')
+                    if not os.path.exists(job_path) or os.path.getmtime(job_path) < cutoff:
+                        shutil.rmtree(entry.path, ignore_errors=True)
+        except OSError as e:
+            logger.warning(f"No se pudieron limpiar los trabajos de documentos: {e}")
+
+
+class DocumentJobRunner:
+    """Pool de hilos que procesa los archivos de los trabajos, uno por tarea"""
+
+    def __init__(self, store: DocumentJobStore, max_workers: int = 2):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='document-job')
+
+    def submit(self, job_id: str, index: int, file_result: Dict[str, Any], document: Any,
+               process: Callable[[Dict[str, Any], Any], None]):
+        """Encolar un UploadedDocument; process(file_result, document) completa file_result en el hilo"""
+        self.executor.submit(self._run, job_id, index, file_result, document, process)
+
+    def _run(self, job_id, index, file_result, document, process):
+        try:
+            process(file_result, document)
+        except Exception as e:
+            logger.error(f"Error en el trabajo {job_id} ({file_result.get('filename')}): {e}")
+            file_result['success'] = False
+            file_result['error'] = str(e)
+        finally:
+            document.discard()
+            self.store.complete_file(job_id, index, file_result)
+
+
+_runner: Optional[DocumentJobRunner] = None
+_runner_lock = threading.Lock()
+
+
+def get_job_runner(directory: str, max_workers: int = 2, ttl: int = 3600) -> DocumentJobRunner:
+    """Runner de trabajos global del proceso"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = DocumentJobRunner(DocumentJobStore(directory, ttl), max_workers)
+        return _runner
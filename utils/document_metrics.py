@@ -0,0 +1,175 @@
+# utils/document_metrics.py - Métricas en proceso del pipeline de documentos
+#
+# Cada documento procesado deja sus tiempos por etapa (texto embebido, render,
+# preprocesado, Tesseract y parseo), sus páginas con texto embebido y con OCR, y la
+# confianza media de Tesseract. El registro guarda histogramas acumulados y los
+# últimos documentos para listar los más lentos; no hay dependencias ni hilos extra.
+# Es por proceso: con varios workers de gunicorn cada uno informa lo suyo.
+import os
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+STAGES = ('text_layer', 'render', 'preprocess', 'tesseract', 'parse', 'total')
+SECONDS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PAGE_SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0)
+CONFIDENCE_BUCKETS = (10, 20, 30, 40, 50, 60, 70, 80, 90, 95)
+RECENT_DOCUMENTS = 200  # Ventana de documentos de la que salen los más lentos
+SLOWEST_DOCUMENTS = 10
+
+
+class Histogram:
+    """Conteo por cubetas (límite superior inclusivo) más suma, mínimo y máximo"""
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # La última cubeta es +Inf
+        self.count = 0
+        self.total = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Aproximación: límite superior de la cubeta que alcanza el cuantil"""
+        if not self.count:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [str(bound) for bound in self.buckets] + ['+Inf']
+        return {
+            'count': self.count,
+            'sum': round(self.total, 4),
+            'mean': round(self.total / self.count, 4) if self.count else None,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            # Lista (no dict) para conservar el orden de las cubetas en el JSON
+            'buckets': [{'le': label, 'count': count} for label, count in zip(labels, self.counts)],
+        }
+
+
+class DocumentMetrics:
+    """Registro de métricas de OCR y parseo de documentos (seguro entre hilos)"""
+
+    def __init__(self, recent: int = RECENT_DOCUMENTS):
+        self._lock = threading.Lock()
+        self._recent_size = recent
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counters = {
+                'documents': 0,
+                'failed': 0,
+                'cache_hits': 0,
+                'pages': 0,
+                'text_layer_pages': 0,
+                'ocr_pages': 0,
+                'skipped_pages': 0,  # Sin leer: los campos requeridos ya estaban (modo incremental)
+                'early_exits': 0,
+            }
+            self.stages = {stage: Histogram(SECONDS_BUCKETS) for stage in STAGES}
+            self.page_ocr = Histogram(PAGE_SECONDS_BUCKETS)
+            self.confidence = Histogram(CONFIDENCE_BUCKETS)
+            self.recent = deque(maxlen=self._recent_size)
+
+    # ================= REGISTRO =================
+
+    def record_cache_hit(self):
+        with self._lock:
+            self.counters['cache_hits'] += 1
+
+    def record_document(self, filename: str, ocr_result: Dict[str, Any], parse_seconds: float, success: bool):
+        """Un documento que pasó por OCR (resultado de OCRPool.extract_many) y por el parser"""
+        timings = ocr_result.get('timings') or {}
+        stages = {
+            'text_layer': timings.get('text_layer_seconds', 0.0),
+            'render': timings.get('render_seconds', 0.0),
+            'preprocess': timings.get('preprocess_seconds', 0.0),
+            'tesseract': timings.get('tesseract_seconds', 0.0),
+            'parse': parse_seconds,
+        }
+        stages['total'] = sum(stages.values())
+        ocr_pages = timings.get('ocr_pages', 0)
+        text_pages = timings.get('text_pages', 0)
+        skipped_pages = timings.get('skipped_pages', 0)
+        confidences: List[float] = timings.get('page_confidences') or []
+
+        with self._lock:
+            self.counters['documents'] += 1
+            self.counters['failed'] += 0 if success else 1
+            self.counters['pages'] += ocr_result.get('pages', 0) or 0
+            self.counters['text_layer_pages'] += text_pages
+            self.counters['ocr_pages'] += ocr_pages
+            self.counters['skipped_pages'] += skipped_pages
+            self.counters['early_exits'] += 1 if skipped_pages else 0
+            for stage, seconds in stages.items():
+                self.stages[stage].observe(seconds)
+            if ocr_pages:
+                self.page_ocr.observe((stages['render'] + stages['preprocess'] + stages['tesseract']) / ocr_pages)
+            for confidence in confidences:
+                self.confidence.observe(confidence)
+            self.recent.append({
+                'filename': filename,
+                'file_type': ocr_result.get('file_type', ''),
+                'pages': ocr_result.get('pages', 0),
+                'text_layer_pages': text_pages,
+                'ocr_pages': ocr_pages,
+                'skipped_pages': skipped_pages,
+                'confidence': timings.get('confidence'),
+                'success': success,
+                'seconds': {stage: round(seconds, 4) for stage, seconds in stages.items()},
+                'finished_at': time.time(),
+            })
+
+    # ================= CONSULTA =================
+
+    def slowest(self, limit: int = SLOWEST_DOCUMENTS) -> List[Dict[str, Any]]:
+        with self._lock:
+            recent = list(self.recent)
+        return sorted(recent, key=lambda entry: entry['seconds']['total'], reverse=True)[:limit]
+
+    def snapshot(self, slowest: int = SLOWEST_DOCUMENTS) -> Dict[str, Any]:
+        with self._lock:
+            data = {
+                'pid': os.getpid(),
+                'since': self.started_at,
+                'counters': dict(self.counters),
+                'stages_seconds': {stage: histogram.snapshot() for stage, histogram in self.stages.items()},
+                'ocr_page_seconds': self.page_ocr.snapshot(),
+                'tesseract_confidence': self.confidence.snapshot(),
+                'recent_window': len(self.recent),
+            }
+        data['slowest_documents'] = self.slowest(slowest)
+        return data
+
+
+_metrics: Optional[DocumentMetrics] = None
+_metrics_lock = threading.Lock()
+
+
+def get_document_metrics() -> DocumentMetrics:
+    """Registro global de métricas de documentos del proceso"""
+    global _metrics
+    with _metrics_lock:
+        if _metrics is None:
+            _metrics = DocumentMetrics()
+        return _metrics
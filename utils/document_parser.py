@@ -1,66 +1,156 @@
 # utils/document_parser.py
 import re
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Iterable, List, Optional
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Patrones específicos para los 9 campos requeridos, en orden de prioridad:
+# por campo gana el primer patrón que encuentra un valor
+FIELD_PATTERNS = {
+    'numero_guia': [
+        r'GUIA[:\s]*N°?[\s]*(\d+)',
+        r'N°?[\s]*GUIA[:\s]*(\d+)',
+        r'PROCESO[:\s]*(\d+)',
+        r'PESAJE[:\s]*(\d+)',
+        r'TICKET[:\s]*(\d+)',
+        r'NUMERO[:\s]*(\d+)'
+    ],
+    'fecha': [
+        r'FECHA[:\s]*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
+        r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
+        r'FECHA[:\s]*(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[\s]+\d{1,2}[\s]+\d{4}'
+    ],
+    'cantidad': [
+        r'CANTIDAD[:\s]*(\d+[.,]?\d*)',
+        r'PESO[\s]*NETO[:\s]*(\d+)',
+        r'NETO[:\s]*(\d+)',
+        r'(\d+)[\s]*KG'
+    ],
+    'unidad': [
+        r'UNIDAD[:\s]*(KG|KILOS|KILOGRAMOS)',
+        r'(\d+)[\s]*(KG|KILOS)'
+    ],
+    'material': [
+        r'MATERIAL[:\s]*([^\n]{3,50})',
+        r'PRODUCTO[:\s]*([^\n]{3,50})',
+        r'DESCRIPCION[:\s]*([^\n]{3,50})',
+        r'(OXIDO[\s]+DE[\s]+CALCIO|CAL|CEMENTO|ARENA|ARCILLA|MINERAL)'
+    ],
+    'ruc_proveedor': [
+        r'RUC[\s]*PROVEEDOR[:\s]*(\d{11})',
+        r'PROVEEDOR.*RUC[:\s]*(\d{11})',
+        r'RUC[:\s]*(\d{11})'
+    ],
+    'ruc_transportista': [
+        r'RUC[\s]*TRANSPORTISTA[:\s]*(\d{11})',
+        r'TRANSPORTISTA.*RUC[:\s]*(\d{11})',
+        r'EMPRESA.*RUC[:\s]*(\d{11})'
+    ],
+    'placa_vehiculo': [
+        r'PLACA[:\s]*([A-Z]{2,3}[\s-]?\d{3,4})',
+        r'PATENTE[:\s]*([A-Z]{2,3}[\s-]?\d{3,4})',
+        r'VEHICULO[:\s]*([A-Z]{2,3}[\s-]?\d{3,4})'
+    ],
+    'licencia_conductor': [
+        r'LICENCIA[:\s]*(\d{8,10})',
+        r'DNI[:\s]*(\d{8})',
+        r'CONDUCTOR.*DNI[:\s]*(\d{8})',
+        r'LIC[:\s]*(\d{8})'
+    ]
+}
+
+# Campo interno -> nombre de columna, en el orden de las columnas A-I
+FIELD_COLUMNS = {
+    'numero_guia': 'N° de Guía',
+    'fecha': 'Fecha',
+    'cantidad': 'CANTIDAD DE PRESENTACION',
+    'unidad': 'Unidad (kg)',
+    'material': 'Material',
+    'ruc_proveedor': 'Número de RUC del PROVEEDOR',
+    'ruc_transportista': 'Número de RUC del transportista',
+    'placa_vehiculo': 'Placa del vehículo',
+    'licencia_conductor': 'Número de licencia de conducir del conductor',
+}
+# Valor cuando el texto no trae el campo
+FIELD_DEFAULTS = {'unidad': 'KG'}
+
+# Patrones "número antes de la unidad": en lugar de probar la regex en cada dígito
+# del texto se busca la unidad (literal) y se retrocede hasta los dígitos
+UNIT_PATTERNS = {
+    r'(\d+)[\s]*KG': ('KG',),
+    r'(\d+)[\s]*(KG|KILOS)': ('KG', 'KILOS'),
+}
+
+_LEADING_LITERAL = re.compile(r'[A-Z]+')
+
+
+class FieldRule:
+    """Patrón compilado una vez; si el texto no tiene su palabra inicial no se busca"""
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.regex = re.compile(pattern)
+        self.search = self.regex.search
+        self.group = 1 if self.regex.groups else 0
+        literal = _LEADING_LITERAL.match(pattern)
+        literal = literal.group(0) if literal else ''
+        # 'GUIAS?' solo garantiza 'GUIA'
+        if pattern[len(literal):len(literal) + 1] in ('?', '*', '{'):
+            literal = literal[:-1]
+        self.literal = literal or None
+
+    def find(self, text: str) -> Optional[str]:
+        if self.literal and self.literal not in text:
+            return None
+        match = self.search(text)
+        return match.group(self.group) if match else None
+
+
+class NumberBeforeUnitRule(FieldRule):
+    r"""Mismo resultado que (\d+)[\s]*(UNIDAD) con search: los dígitos pegados
+    (salvo espacios) a la primera unidad que los tenga"""
+
+    def __init__(self, pattern: str, units):
+        super().__init__(pattern)
+        self.units = units
+
+    def find(self, text: str) -> Optional[str]:
+        best = None
+        for unit in self.units:
+            pos = text.find(unit)
+            while pos != -1 and (best is None or pos < best[0]):
+                # \s y \d de re son str.isspace() y str.isdecimal()
+                end = pos
+                while end > 0 and text[end - 1].isspace():
+                    end -= 1
+                start = end
+                while start > 0 and text[start - 1].isdecimal():
+                    start -= 1
+                if start < end:
+                    best = (pos, text[start:end])
+                    break
+                pos = text.find(unit, pos + 1)
+        return best[1] if best else None
+
+
+def compile_field_rules(patterns: Dict[str, List[str]]) -> Dict[str, List[FieldRule]]:
+    return {
+        field: [NumberBeforeUnitRule(pattern, UNIT_PATTERNS[pattern]) if pattern in UNIT_PATTERNS
+                else FieldRule(pattern) for pattern in field_patterns]
+        for field, field_patterns in patterns.items()
+    }
+
+
+FIELD_RULES = compile_field_rules(FIELD_PATTERNS)
+
+
 class WarehouseDocumentParser:
     def __init__(self):
-        # Patrones específicos para los 9 campos requeridos
-        self.patterns = {
-            'numero_guia': [
-                r'GUIA[:\s]*N°?[\s]*(\d+)',
-                r'N°?[\s]*GUIA[:\s]*(\d+)',
-                r'PROCESO[:\s]*(\d+)',
-                r'PESAJE[:\s]*(\d+)',
-                r'TICKET[:\s]*(\d+)',
-                r'NUMERO[:\s]*(\d+)'
-            ],
-            'fecha': [
-                r'FECHA[:\s]*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-                r'(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-                r'FECHA[:\s]*(Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[\s]+\d{1,2}[\s]+\d{4}'
-            ],
-            'cantidad': [
-                r'CANTIDAD[:\s]*(\d+[.,]?\d*)',
-                r'PESO[\s]*NETO[:\s]*(\d+)',
-                r'NETO[:\s]*(\d+)',
-                r'(\d+)[\s]*KG'
-            ],
-            'unidad': [
-                r'UNIDAD[:\s]*(KG|KILOS|KILOGRAMOS)',
-                r'(\d+)[\s]*(KG|KILOS)'
-            ],
-            'material': [
-                r'MATERIAL[:\s]*([^\n]{3,50})',
-                r'PRODUCTO[:\s]*([^\n]{3,50})',
-                r'DESCRIPCION[:\s]*([^\n]{3,50})',
-                r'(OXIDO[\s]+DE[\s]+CALCIO|CAL|CEMENTO|ARENA|ARCILLA|MINERAL)'
-            ],
-            'ruc_proveedor': [
-                r'RUC[\s]*PROVEEDOR[:\s]*(\d{11})',
-                r'PROVEEDOR.*RUC[:\s]*(\d{11})',
-                r'RUC[:\s]*(\d{11})'
-            ],
-            'ruc_transportista': [
-                r'RUC[\s]*TRANSPORTISTA[:\s]*(\d{11})',
-                r'TRANSPORTISTA.*RUC[:\s]*(\d{11})',
-                r'EMPRESA.*RUC[:\s]*(\d{11})'
-            ],
-            'placa_vehiculo': [
-                r'PLACA[:\s]*([A-Z]{2,3}[\s-]?\d{3,4})',
-                r'PATENTE[:\s]*([A-Z]{2,3}[\s-]?\d{3,4})',
-                r'VEHICULO[:\s]*([A-Z]{2,3}[\s-]?\d{3,4})'
-            ],
-            'licencia_conductor': [
-                r'LICENCIA[:\s]*(\d{8,10})',
-                r'DNI[:\s]*(\d{8})',
-                r'CONDUCTOR.*DNI[:\s]*(\d{8})',
-                r'LIC[:\s]*(\d{8})'
-            ]
-        }
+        # Patrones compilados al cargar el módulo (compartidos por todas las instancias)
+        self.patterns = FIELD_PATTERNS
+        self.rules = FIELD_RULES
     
     def parse_document(self, text: str) -> Dict[str, Any]:
         """Extrae los 9 campos específicos del documento"""
@@ -76,35 +166,9 @@ class WarehouseDocumentParser:
             # Limpiar texto
             cleaned_text = text.upper()
             
-            # Definir los 9 campos requeridos
-            campos_requeridos = {
-                'A': 'N° de Guía',
-                'B': 'Fecha', 
-                'C': 'CANTIDAD DE PRESENTACION',
-                'D': 'Unidad (kg)',
-                'E': 'Material',
-                'F': 'Número de RUC del PROVEEDOR',
-                'G': 'Número de RUC del transportista',
-                'H': 'Placa del vehículo',
-                'I': 'Número de licencia de conducir del conductor'
-            }
-            
-            # Mapeo de campos internos a los nombres de columna
-            mapeo_campos = {
-                'A': ('numero_guia', self._extract_field(cleaned_text, 'numero_guia')),
-                'B': ('fecha', self._extract_field(cleaned_text, 'fecha')),
-                'C': ('cantidad', self._extract_field(cleaned_text, 'cantidad')),
-                'D': ('unidad', self._extract_field(cleaned_text, 'unidad', default='KG')),
-                'E': ('material', self._extract_field(cleaned_text, 'material')),
-                'F': ('ruc_proveedor', self._extract_field(cleaned_text, 'ruc_proveedor')),
-                'G': ('ruc_transportista', self._extract_field(cleaned_text, 'ruc_transportista')),
-                'H': ('placa_vehiculo', self._extract_field(cleaned_text, 'placa_vehiculo')),
-                'I': ('licencia_conductor', self._extract_field(cleaned_text, 'licencia_conductor'))
-            }
-            
-            # Procesar cada campo
-            for col, (campo_interno, valor) in mapeo_campos.items():
-                nombre_columna = campos_requeridos[col]
+            # Los 9 campos requeridos, en el orden de las columnas (A-I)
+            for campo_interno, nombre_columna in FIELD_COLUMNS.items():
+                valor = self._extract_field(cleaned_text, campo_interno, default=FIELD_DEFAULTS.get(campo_interno))
                 
                 if valor:
                     result['campos_extraidos'][nombre_columna] = valor
@@ -124,7 +188,7 @@ class WarehouseDocumentParser:
                 result['parse_error'] = 'No se pudo extraer ningún campo del documento'
             
             # Calcular porcentaje de éxito
-            total_campos = len(campos_requeridos)
+            total_campos = len(FIELD_COLUMNS)
             campos_encontrados = len(result['campos_extraidos'])
             result['porcentaje_exito'] = f"{(campos_encontrados / total_campos * 100):.1f}%"
             
@@ -136,14 +200,14 @@ class WarehouseDocumentParser:
     
     def _extract_field(self, text: str, field_name: str, default: Optional[str] = None) -> Optional[str]:
         """Extrae un campo específico usando múltiples patrones"""
-        if field_name not in self.patterns:
+        if field_name not in self.rules:
             return default
         
-        for pattern in self.patterns[field_name]:
+        for rule in self.rules[field_name]:
             try:
-                match = re.search(pattern, text)
-                if match:
-                    value = match.group(1).strip() if match.groups() else match.group(0).strip()
+                value = rule.find(text)
+                if value is not None:
+                    value = value.strip()
                     
                     # Limpiar valor
                     value = self._clean_value(value, field_name)
@@ -151,7 +215,7 @@ class WarehouseDocumentParser:
                     if value:
                         return value
             except Exception as e:
-                logger.debug(f"Patrón falló para {field_name}: {pattern}")
+                logger.debug(f"Patrón falló para {field_name}: {rule.pattern}")
                 continue
         
         return default
@@ -181,11 +245,30 @@ class WarehouseDocumentParser:
         else:
             return value.strip()
 
-# Funciones de conveniencia
+# Funciones de conveniencia (el parser no tiene estado: una instancia para todo el proceso)
+_parser = WarehouseDocumentParser()
+
 def parse_warehouse_document(text: str) -> Dict[str, Any]:
-    parser = WarehouseDocumentParser()
-    return parser.parse_document(text)
+    return _parser.parse_document(text)
 
 def parse_multiple_documents(texts: List[str]) -> List[Dict[str, Any]]:
-    parser = WarehouseDocumentParser()
-    return [parser.parse_document(text) for text in texts]
+    return [_parser.parse_document(text) for text in texts]
+
+def has_required_fields(text: str, fields: Optional[Iterable[str]] = None) -> bool:
+    """True si el texto ya tiene todos los campos pedidos (nombres internos de
+    FIELD_COLUMNS; None = los 9). Misma extracción que parse_document, sin armar el resultado."""
+    upper = text.upper()
+    return all(_parser._extract_field(upper, field, default=FIELD_DEFAULTS.get(field))
+               for field in (fields or FIELD_COLUMNS))
+
+def extract_field(text: str, field: str) -> Optional[str]:
+    """Valor de un campo interno (FIELD_COLUMNS) en el texto, sin el valor por defecto"""
+    return _parser._extract_field(text.upper(), field)
+
+def required_fields(names: Optional[Iterable[str]]) -> List[str]:
+    """Campos internos válidos de una lista (p. ej. de la configuración); vacía = los 9"""
+    names = [name.strip() for name in names or [] if name and name.strip()]
+    unknown = [name for name in names if name not in FIELD_COLUMNS]
+    if unknown:
+        logger.warning(f"Campos requeridos desconocidos ignorados: {', '.join(unknown)}")
+    return [name for name in names if name in FIELD_COLUMNS] or list(FIELD_COLUMNS)
@@ -0,0 +1,227 @@
+# utils/document_records.py - Guardado en lote y búsqueda de documentos extraídos
+#
+# Los campos que el parser extrae (utils/document_parser.py) se guardan en la tabla
+# document_records (models.document_record.DocumentRecord). Un documento se identifica
+# por (process_number, weigh_number): volver a subir el mismo ticket actualiza su fila
+# en lugar de duplicarla. El lote se resuelve con una consulta por los números de
+# proceso, un INSERT y un UPDATE por lotes (executemany), no un SELECT + INSERT por
+# documento. La búsqueda pagina sobre los índices del modelo y la exportación recorre
+# los registros por bloques (yield_per) sin cargar toda la tabla en memoria.
+import logging
+import re
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import func, insert, inspect, select, update
+from sqlalchemy.exc import IntegrityError
+
+from models import db
+from models.document_record import DocumentRecord
+
+logger = logging.getLogger(__name__)
+
+# Número de pesaje del ticket (el parser solo devuelve un número: el de guía o proceso)
+WEIGH_NUMBER_PATTERN = re.compile(r'PESAJE[:\s]*N?°?[\s]*(\d+)')
+DATE_FORMATS = ('%d/%m/%Y', '%d-%m-%Y', '%d/%m/%y', '%d-%m-%y')
+LOOKUP_CHUNK = 500  # Números de proceso por consulta IN (límite de parámetros de SQLite)
+EXPORT_YIELD = 500  # Registros por bloque al exportar
+MAX_PAGE_SIZE = 200
+
+# Resultado por documento de save_document_records
+RECORD_CREATED = 'creado'
+RECORD_UPDATED = 'actualizado'
+RECORD_SKIPPED = 'omitido'  # Sin número de proceso no hay con qué deduplicar
+RECORD_DUPLICATE = 'duplicado'  # Otro documento posterior del mismo lote tiene la misma clave
+
+
+# ================= ÍNDICES =================
+
+def ensure_document_record_indexes(engine) -> bool:
+    """Crear los índices de document_records en bases ya existentes.
+
+    db.create_all() no agrega índices a tablas que ya existen; sin tabla no hay nada
+    que hacer (create_all la crea con sus índices).
+    """
+    table = DocumentRecord.__table__
+    if not inspect(engine).has_table(table.name):
+        return False
+    for index in table.indexes:
+        index.create(engine, checkfirst=True)
+    return True
+
+
+# ================= CAMPOS -> COLUMNAS =================
+
+def normalize_plate(plate: Optional[str]) -> Optional[str]:
+    """Placa con el formato del parser (ABC-123) para guardar y buscar igual"""
+    if not plate:
+        return None
+    plate = re.sub(r'[^\w]', '', plate).upper()
+    if len(plate) >= 3 and plate[:3].isalpha():
+        return f"{plate[:3]}-{plate[3:]}"
+    return plate
+
+
+def parse_date(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value.strip(), date_format)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_number(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return float(str(value).replace(',', '.'))
+    except ValueError:
+        return None
+
+
+def record_values(campos: Dict[str, str], text: str = '', filename: Optional[str] = None,
+                  file_size: Optional[int] = None, uploaded_by: Optional[int] = None) -> Dict[str, Any]:
+    """Columnas de DocumentRecord a partir de campos_extraidos (nombres de columna del parser)"""
+    match = WEIGH_NUMBER_PATTERN.search(text.upper()) if text else None
+    ruc_transportista = campos.get('Número de RUC del transportista')
+    return {
+        'process_number': campos.get('N° de Guía') or None,
+        # '' y no NULL: el índice único trata cada NULL como distinto y no deduplicaría
+        'weigh_number': match.group(1) if match else '',
+        'weigh_date': parse_date(campos.get('Fecha')),
+        'guide_net_weight': parse_number(campos.get('CANTIDAD DE PRESENTACION')),
+        'unit': campos.get('Unidad (kg)') or None,
+        'product': campos.get('Material') or None,
+        'provider_nit': campos.get('Número de RUC del PROVEEDOR') or None,
+        'plate_tractor': normalize_plate(campos.get('Placa del vehículo')),
+        'driver_id': campos.get('Número de licencia de conducir del conductor') or None,
+        # El modelo no tiene columna para el RUC del transportista
+        'observations': f"RUC transportista: {ruc_transportista}" if ruc_transportista else None,
+        'original_file': filename,
+        'file_size': file_size,
+        'uploaded_by': uploaded_by,
+    }
+
+
+# ================= GUARDADO EN LOTE =================
+
+def _existing_ids(keys: Iterable[Tuple[str, str]]) -> Dict[Tuple[str, str], int]:
+    """id de las filas que ya existen para cada (process_number, weigh_number)"""
+    keys = set(keys)
+    process_numbers = sorted({process for process, _ in keys})
+    found = {}
+    for start in range(0, len(process_numbers), LOOKUP_CHUNK):
+        rows = db.session.execute(
+            select(DocumentRecord.id, DocumentRecord.process_number, DocumentRecord.weigh_number)
+            .where(DocumentRecord.process_number.in_(process_numbers[start:start + LOOKUP_CHUNK]))
+        )
+        for record_id, process, weigh in rows:
+            if (process, weigh or '') in keys:
+                found[(process, weigh or '')] = record_id
+    return found
+
+
+def _write(values_by_key: Dict[Tuple[str, str], Dict[str, Any]]) -> Dict[Tuple[str, str], str]:
+    existing = _existing_ids(values_by_key)
+    inserts = [values for key, values in values_by_key.items() if key not in existing]
+    # En las filas existentes solo se pisan los campos leídos: un OCR peor no borra datos
+    updates = [
+        dict({name: value for name, value in values.items() if value is not None}, id=existing[key])
+        for key, values in values_by_key.items() if key in existing
+    ]
+    if inserts:
+        db.session.execute(insert(DocumentRecord), inserts)
+    if updates:
+        db.session.execute(update(DocumentRecord), updates)
+    db.session.commit()
+    return {key: RECORD_UPDATED if key in existing else RECORD_CREATED for key in values_by_key}
+
+
+def save_document_records(rows: List[Dict[str, Any]]) -> List[str]:
+    """Insertar o actualizar un lote de valores de record_values; una acción por fila y en orden.
+
+    Dentro del lote, el último documento con la misma clave gana y los anteriores
+    quedan como duplicados. Si otro worker
+    insertó la misma clave entre la consulta y el INSERT, se reintenta una vez (esas
+    filas pasan a actualizarse).
+    """
+    values_by_key: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    keys: List[Optional[Tuple[str, str]]] = []
+    for values in rows:
+        if not values.get('process_number'):
+            keys.append(None)
+            continue
+        key = (values['process_number'], values.get('weigh_number') or '')
+        values_by_key[key] = dict(values, weigh_number=key[1])
+        keys.append(key)
+
+    actions: Dict[Tuple[str, str], str] = {}
+    for attempt in range(2 if values_by_key else 0):
+        try:
+            actions = _write(values_by_key)
+            break
+        except IntegrityError:
+            db.session.rollback()
+            if attempt:
+                raise
+            logger.info("Clave de documento insertada en paralelo, reintentando el lote")
+        except Exception:
+            db.session.rollback()
+            raise
+    last = {key: index for index, key in enumerate(keys) if key}
+    return [
+        RECORD_SKIPPED if key is None else actions[key] if last[key] == index else RECORD_DUPLICATE
+        for index, key in enumerate(keys)
+    ]
+
+
+# ================= BÚSQUEDA Y EXPORTACIÓN =================
+
+def record_filters(process_number: Optional[str] = None, weigh_number: Optional[str] = None,
+                   plate: Optional[str] = None, date_from: Optional[datetime] = None,
+                   date_to: Optional[datetime] = None) -> List[Any]:
+    """Condiciones por igualdad o rango sobre las columnas indexadas"""
+    conditions = []
+    if process_number:
+        conditions.append(DocumentRecord.process_number == process_number)
+    if weigh_number:
+        conditions.append(DocumentRecord.weigh_number == weigh_number)
+    if plate:
+        conditions.append(DocumentRecord.plate_tractor == normalize_plate(plate))
+    if date_from:
+        conditions.append(DocumentRecord.weigh_date >= date_from)
+    if date_to:
+        conditions.append(DocumentRecord.weigh_date < date_to)
+    return conditions
+
+
+def search_document_records(conditions: List[Any], page: int = 1,
+                            per_page: int = 50) -> Tuple[List[DocumentRecord], int]:
+    """(registros de la página, total) ordenados por fecha de pesaje, los más recientes primero"""
+    per_page = max(1, min(per_page, MAX_PAGE_SIZE))
+    total = db.session.execute(select(func.count(DocumentRecord.id)).where(*conditions)).scalar_one()
+    records = db.session.execute(
+        select(DocumentRecord).where(*conditions)
+        .order_by(DocumentRecord.weigh_date.desc(), DocumentRecord.id.desc())
+        .offset((max(page, 1) - 1) * per_page).limit(per_page)
+    ).scalars().all()
+    return records, total
+
+
+def excel_headers() -> List[str]:
+    """Columnas del Excel en el orden de to_excel_dict"""
+    return list(DocumentRecord().to_excel_dict())
+
+
+def iter_excel_rows(conditions: List[Any]) -> Iterator[Dict[str, Any]]:
+    """to_excel_dict de cada registro, leídos de la base por bloques"""
+    result = db.session.execute(
+        select(DocumentRecord).where(*conditions)
+        .order_by(DocumentRecord.weigh_date, DocumentRecord.id)
+        .execution_options(yield_per=EXPORT_YIELD)
+    ).scalars()
+    for record in result:
+        yield record.to_excel_dict()
@@ -1,14 +1,48 @@
 # utils/excel_splitter.py
+#
+# Un libro con una hoja por día (dd-mm-YYYY) se divide en un archivo por día. Cada
+# hoja se lee una sola vez en secuencia (iter_rows(values_only=True)): en modo
+# read_only, ws.cell(row, column) vuelve a recorrer el XML de la hoja en cada acceso.
+# Los archivos de salida se escriben con Workbook(write_only=True) y las hojas se
+# reparten en un pool de procesos; cada proceso abre el libro una vez para su grupo.
 from __future__ import annotations
 
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 from datetime import datetime
+from itertools import chain, islice
+import logging
+from multiprocessing import get_all_start_methods, get_context
+import os
 from pathlib import Path
 import re
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Sequence, Tuple
 
 from openpyxl import load_workbook, Workbook
 
+logger = logging.getLogger(__name__)
+
+HEADER_SCAN_ROWS = 30  # Filas donde se busca el encabezado
+
+# Header EXACTO de los archivos diarios (en este orden)
+HEADERS_OUT = ["Item", "Código del Material", "Texto breve de material", "Unidad Medida", "Ubicación", "Fisico", "STOCK", "Difere", "Observac."]
+
+# Nombre estándar -> nombres con los que aparece la columna en los libros
+HEADER_ALIASES = {
+    "Item": ["Item"],
+    "Código del Material": ["Código del Material", "Codigo del Material", "Codigo", "COD", "Material"],
+    "Texto breve de material": ["Texto breve de material", "Texto breve", "Descripcion", "Descripción", "Texto"],
+    "Unidad Medida": ["Unidad Medida", "Unidad", "Unidad de medida", "Unidad de medida base", "U.M.", "UM"],
+    "Ubicación": ["Ubicación", "Ubicacion", "Location", "UBI"],
+    "Fisico": ["Fisico", "Físico", "Libre utilización", "Libre utilizacion", "Cantidad", "Stock contado"],
+    "STOCK": ["STOCK", "Stock", "Stock sistema", "SISTEMA"],
+    "Difere": ["Difere", "Difer", "Diferencia"],
+    "Observac.": ["Observac.", "Observacion", "Observación", "Obs", "Observaciones"],
+}
+
+_SPACES = re.compile(r"\s+")
+
 
 @dataclass
 class SplitConfig:
@@ -21,10 +55,13 @@ class SplitConfig:
 def _norm(s: str) -> str:
     if s is None:
         return ""
+    if isinstance(s, (int, float)):
+        # Los números no traen espacios ni comillas
+        return str(s)
     s = str(s)
     s = s.replace("\n", " ").replace("\r", " ")
     s = s.replace("\u00a0", " ")
-    s = re.sub(r"\s+", " ", s).strip()
+    s = _SPACES.sub(" ", s).strip()
     s = s.replace('"', "").replace("“", "").replace("”", "")
     return s
 
@@ -37,43 +74,34 @@ def _parse_sheet_date(sheet_name: str) -> Optional[datetime]:
         return None
 
 
-def _find_header_row_and_map(ws) -> Tuple[int, Dict[str, int]]:
+# alias normalizado -> nombres estándar que lo aceptan
+_ALIAS_INDEX: Dict[str, List[str]] = {}
+for _std_name, _aliases in HEADER_ALIASES.items():
+    for _alias in _aliases:
+        _ALIAS_INDEX.setdefault(_norm(_alias).lower(), []).append(_std_name)
+
+
+def _find_header_row_and_map(rows: Sequence[Sequence]) -> Tuple[int, Dict[str, int]]:
     """
-    Busca la fila header (primeras 30 filas) y devuelve:
+    Busca la fila header (primeras 30 filas, ya leídas como valores) y devuelve:
     - row_idx (1-based)
     - mapping: nombre_col_estandar -> indice_col (0-based)
     """
-    required = {
-        "Item": ["Item"],
-        "Código del Material": ["Código del Material", "Codigo del Material", "Codigo", "COD", "Material"],
-        "Texto breve de material": ["Texto breve de material", "Texto breve", "Descripcion", "Descripción", "Texto"],
-        "Unidad Medida": ["Unidad Medida", "Unidad", "Unidad de medida", "Unidad de medida base", "U.M.", "UM"],
-        "Ubicación": ["Ubicación", "Ubicacion", "Location", "UBI"],
-        "Fisico": ["Fisico", "Físico", "Libre utilización", "Libre utilizacion", "Cantidad", "Stock contado"],
-        "STOCK": ["STOCK", "Stock", "Stock sistema", "SISTEMA"],
-        "Difere": ["Difere", "Difer", "Diferencia"],
-        "Observac.": ["Observac.", "Observacion", "Observación", "Obs", "Observaciones"],
-    }
-
-    # normalizamos los alias
-    required_norm = {k: [_norm(x).lower() for x in v] for k, v in required.items()}
-
     best_row = None
     best_map = {}
 
-    for r in range(1, 31):
-        row_vals = [ws.cell(row=r, column=c).value for c in range(1, ws.max_column + 1)]
-        headers = [_norm(v).lower() for v in row_vals]
+    # Si encontramos al menos 4 de estas, consideramos que es header válido
+    min_core = ["Código del Material", "Texto breve de material", "Unidad Medida", "Ubicación", "Fisico"]
 
+    for r, row_vals in enumerate(islice(rows, HEADER_SCAN_ROWS), start=1):
+        # Una pasada por las celdas: la primera columna de cada nombre estándar
         mapping: Dict[str, int] = {}
-        for std_name, aliases in required_norm.items():
-            for idx, h in enumerate(headers):
-                if h in aliases:
-                    mapping[std_name] = idx
-                    break
-
-        # Si encontramos al menos estas 6, consideramos que es header válido
-        min_core = ["Código del Material", "Texto breve de material", "Unidad Medida", "Ubicación", "Fisico"]
+        for idx, value in enumerate(row_vals):
+            if value is None:
+                continue
+            for std_name in _ALIAS_INDEX.get(_norm(value).lower(), ()):
+                mapping.setdefault(std_name, idx)
+
         score = sum(1 for x in min_core if x in mapping)
 
         if score >= 4:
@@ -89,25 +117,88 @@ def _find_header_row_and_map(ws) -> Tuple[int, Dict[str, int]]:
     if best_row is None:
         raise Exception("No se encontró fila de encabezados (header) en las primeras 30 filas.")
 
-    # Validación mínima: las que tú dijiste necesarias
-    necesarios = ["Item", "Código del Material", "Texto breve de material", "Unidad Medida", "Ubicación", "Fisico", "STOCK", "Difere", "Observac."]
-    faltantes = [c for c in necesarios if c not in best_map]
+    # Validación mínima: todas las columnas de salida
+    faltantes = [c for c in HEADERS_OUT if c not in best_map]
     if faltantes:
         raise Exception(f"❌ Columnas faltantes: {faltantes}")
 
     return best_row, best_map
 
 
+def _split_sheet(ws, titulo: str, out_path: str) -> None:
+    """Escribir el archivo diario de una hoja leyendo sus filas una sola vez"""
+    rows = ws.iter_rows(values_only=True)
+    head = list(islice(rows, HEADER_SCAN_ROWS))
+    header_row, colmap = _find_header_row_and_map(head)
+
+    columnas = [colmap[h] for h in HEADERS_OUT]  # 0-based, en el orden de salida
+    ubicacion = HEADERS_OUT.index("Ubicación")
+
+    out_wb = Workbook(write_only=True)
+    out_ws = out_wb.create_sheet(titulo)
+    out_ws.append(HEADERS_OUT)
+
+    # Filas desde la siguiente al header; sin dimensiones en el XML las filas
+    # pueden venir más cortas que el encabezado
+    for values in chain(head[header_row:], rows):
+        width = len(values)
+        row = [_norm(values[idx]) if idx < width else "" for idx in columnas]
+
+        # si no hay código de material, saltamos
+        if not row[1]:
+            continue
+
+        row[ubicacion] = row[ubicacion].replace(" ", "").upper()
+        out_ws.append(row)
+
+    out_wb.save(out_path)
+
+
+def _split_sheets(archivo_excel: str, tareas: List[Tuple[str, str, str]]) -> int:
+    """Tarea de un proceso: abrir el libro una vez y dividir sus hojas (hoja, título, destino)"""
+    wb = load_workbook(filename=archivo_excel, read_only=True, data_only=True)
+    try:
+        for sheet_name, titulo, out_path in tareas:
+            _split_sheet(wb[sheet_name], titulo, out_path)
+    finally:
+        wb.close()
+    return len(tareas)
+
+
+def _run_groups(archivo_excel: str, grupos: List[List[Tuple[str, str, str]]]) -> None:
+    if len(grupos) == 1:
+        _split_sheets(archivo_excel, grupos[0])
+        return
+
+    # forkserver como en utils/ocr_pool.py: sin fork de un proceso con hilos
+    if 'forkserver' in get_all_start_methods():
+        context = get_context('forkserver')
+        context.set_forkserver_preload(['utils.excel_splitter'])
+    else:
+        context = get_context('spawn')
+    try:
+        with ProcessPoolExecutor(max_workers=len(grupos), mp_context=context) as executor:
+            for future in [executor.submit(_split_sheets, archivo_excel, grupo) for grupo in grupos]:
+                future.result()
+    except BrokenProcessPool as e:
+        # Un worker murió (memoria, señal): se repite todo en este proceso
+        logger.warning(f"Pool de procesos caído al dividir {archivo_excel} ({e}); se divide en serie")
+        for grupo in grupos:
+            _split_sheets(archivo_excel, grupo)
+
+
 def dividir_excel_por_dias(
     archivo_excel: str | Path,
     salida_base: str | Path = "inventarios_procesados",
     anio: int = 2025,
     mes_inicio: int = 4,
     mes_fin: int = 12,
+    max_workers: Optional[int] = None,
 ) -> List[Path]:
     """
     Divide un Excel con muchas hojas (cada hoja = día) en archivos diarios.
-    Retorna lista de paths generados.
+    Las hojas se reparten entre max_workers procesos (None = núcleos; 1 = en serie).
+    Retorna lista de paths generados, en el orden de las hojas.
     """
     archivo_excel = Path(archivo_excel)
     if not archivo_excel.exists():
@@ -117,9 +208,13 @@ def dividir_excel_por_dias(
     cfg.salida_base.mkdir(parents=True, exist_ok=True)
 
     wb = load_workbook(filename=str(archivo_excel), read_only=True, data_only=True)
+    sheetnames = wb.sheetnames
+    wb.close()
+
+    tareas: List[Tuple[str, str, str]] = []
     generados: List[Path] = []
 
-    for sheet_name in wb.sheetnames:
+    for sheet_name in sheetnames:
         fecha = _parse_sheet_date(sheet_name)
         if not fecha:
             continue
@@ -129,51 +224,19 @@ def dividir_excel_por_dias(
         if not (cfg.mes_inicio <= fecha.month <= cfg.mes_fin):
             continue
 
-        ws = wb[sheet_name]
-
-        header_row, colmap = _find_header_row_and_map(ws)
-
         # destino: inventarios_procesados/2025/04/inventario_2025_04_10.xlsx
         out_dir = cfg.salida_base / f"{fecha.year}" / f"{fecha.month:02d}"
         out_dir.mkdir(parents=True, exist_ok=True)
         out_path = out_dir / f"inventario_{fecha:%Y_%m_%d}.xlsx"
 
-        out_wb = Workbook()
-        out_ws = out_wb.active
-        out_ws.title = f"{fecha:%d-%m-%Y}"
-
-        # Header EXACTO (lo que tú necesitas)
-        headers_out = ["Item", "Código del Material", "Texto breve de material", "Unidad Medida", "Ubicación", "Fisico", "STOCK", "Difere", "Observac."]
-        out_ws.append(headers_out)
-
-        # Recorremos filas desde la siguiente al header
-        max_r = ws.max_row
-        for r in range(header_row + 1, max_r + 1):
-            row = []
-            # extraemos en el orden de salida
-            for h in headers_out:
-                idx0 = colmap[h]  # 0-based
-                val = ws.cell(row=r, column=idx0 + 1).value
-
-                if h in ("Ubicación",):
-                    val = _norm(val).replace(" ", "").upper()
-                else:
-                    val = _norm(val)
-
-                row.append(val)
-
-            # si no hay código de material, saltamos
-            if not row[1]:
-                continue
-
-            out_ws.append(row)
-
-        out_wb.save(str(out_path))
+        tareas.append((sheet_name, f"{fecha:%d-%m-%Y}", str(out_path)))
         generados.append(out_path)
 
-    wb.close()
-
     if not generados:
         raise Exception("No se generó ningún archivo. Revisa nombres de hojas (dd-mm-YYYY) y rango Abril–Diciembre.")
 
+    # Un grupo por proceso, repartido en turnos: las hojas de todo el año pesan parecido
+    workers = max(1, min(max_workers or os.cpu_count() or 1, len(tareas)))
+    _run_groups(str(archivo_excel), [tareas[i::workers] for i in range(workers)])
+
     return generados
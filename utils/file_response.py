@@ -0,0 +1,43 @@
+# utils/file_response.py - Descarga de archivos temporales ya escritos (exportaciones a Excel)
+#
+# Los Excel grandes se escriben a un archivo temporal y se envían por bloques. El borrado
+# no puede quedar en el finally de un generador: si la respuesta se cierra antes del
+# primer bloque (HEAD, cliente que corta) el generador nunca arranca y el archivo queda.
+# El archivo se abre antes de armar la respuesta y se borra en ese momento; el
+# descriptor abierto lo sigue leyendo. Donde no se puede borrar un archivo abierto
+# (Windows) se borra al cerrar la respuesta.
+import os
+
+from flask import Response, request
+from werkzeug.wsgi import wrap_file
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+
+def _remove(path: str) -> bool:
+    try:
+        os.remove(path)
+        return True
+    except OSError:
+        return False
+
+
+def temp_file_response(path: str, filename: str, mimetype: str = XLSX_MIMETYPE,
+                       chunk_size: int = 256 * 1024) -> Response:
+    """Respuesta que envía el archivo temporal path como adjunto y lo borra"""
+    size = os.path.getsize(path)
+    f = open(path, 'rb')
+    removed = _remove(path)
+    response = Response(
+        wrap_file(request.environ, f, chunk_size),
+        mimetype=mimetype,
+        headers={
+            'Content-Disposition': f'attachment; filename={filename}',
+            'Content-Length': str(size)
+        },
+        direct_passthrough=True
+    )
+    response.call_on_close(f.close)
+    if not removed:
+        response.call_on_close(lambda: _remove(path))
+    return response
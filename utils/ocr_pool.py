@@ -0,0 +1,315 @@
+# utils/ocr_pool.py - OCR en paralelo de varias páginas y varios archivos
+#
+# Tesseract usa un solo núcleo por página. En lugar de procesar archivo por archivo
+# y página por página, cada página (o imagen) es una tarea independiente en un pool
+# de procesos del tamaño de los núcleos; el texto se reensambla en el orden de las
+# páginas y cada archivo devuelve sus tiempos. Los PDF se recorren una vez: las
+# páginas con texto embebido se leen al planificar y solo las escaneadas van al pool.
+# En modo incremental las páginas escaneadas van por tandas y el OCR se corta en
+# cuanto el texto reunido ya tiene los campos que se buscan.
+import logging
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_all_start_methods, get_context
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from utils.ocr_reader import (IMAGE_EXTENSIONS, OCR_BATCH_PAGES, OCR_CONFIG, AdvancedOCRReader, DocumentSource,
+                              ocr_image_file, ocr_pdf_pages, open_pdf, page_text_layer)
+
+logger = logging.getLogger(__name__)
+
+# Modo incremental: páginas escaneadas de la primera tanda (las siguientes duplican)
+INCREMENTAL_FIRST_PAGES = 1
+# Tiempos del resultado que se redondean al final
+SECONDS_KEYS = ('seconds', 'ocr_seconds', 'text_layer_seconds', 'render_seconds', 'preprocess_seconds',
+                'tesseract_seconds')
+
+
+class OCRPool:
+    """Pool de procesos para OCR, creado al primer uso y compartido por las peticiones"""
+
+    def __init__(self, max_workers: Optional[int] = None, config: str = OCR_CONFIG):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.config = config
+        self.reader = AdvancedOCRReader()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Sin fork: el proceso web tiene hilos (janitor, trabajos en segundo plano) y
+                # un hijo con fork hereda sus locks tomados. El servidor de forkserver arranca
+                # limpio con utils.ocr_reader ya importado y los workers salen de él. Como con
+                # spawn, cada worker importa el __main__ del padre (con gunicorn, el de gunicorn)
+                if 'forkserver' in get_all_start_methods():
+                    context = get_context('forkserver')
+                    context.set_forkserver_preload(['utils.ocr_reader'])
+                else:
+                    context = get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=context)
+            return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    # ================= EXTRACCIÓN =================
+
+    def extract_many(self, documents: List[Union[str, Any]], preprocess: Optional[str] = None,
+                     templates: bool = False, stop_when: Optional[Callable[[str], bool]] = None) -> List[Dict[str, Any]]:
+        """Extraer el texto de varios archivos a la vez (mismo formato que extract_text_from_file).
+
+        documents son rutas o UploadedDocument (utils/document_intake.py); los que
+        están en memoria llegan a los workers como bytes, sin archivo temporal.
+        Cada resultado incluye 'timings': segundos desde el inicio del lote hasta que
+        terminó el archivo, segundos de OCR sumados entre sus páginas, páginas con OCR,
+        con texto embebido y salteadas, segundos por etapa (texto embebido, render,
+        preprocesado, Tesseract) y la confianza media de Tesseract por página y del documento.
+        preprocess es el perfil de preprocesado del tipo de documento (utils/ocr_preprocess.py)
+        y templates activa el OCR por regiones de los formatos conocidos (utils/ocr_templates.py).
+
+        stop_when(texto) -> bool activa el modo incremental: las páginas escaneadas de
+        cada PDF se leen en tandas de 1, 2, 4... páginas y la siguiente tanda solo se
+        encola si stop_when todavía da False con el texto reunido (si el texto embebido
+        ya alcanza, el PDF no pasa por OCR).
+        """
+        sources = [self._describe(document) for document in documents]
+        if not self.reader.tesseract_available:
+            return [self.reader.extract_text_from_file(name, data, stop_when) for name, _, data in sources]
+
+        started = time.perf_counter()
+        results = [self._new_result() for _ in documents]
+
+        # Por archivo: tandas de páginas pendientes y la tarea (función, argumentos) que lee un lote
+        waves: Dict[int, List[List[int]]] = {}
+        make_task: Dict[int, Callable[[List[int]], Tuple[Callable, tuple]]] = {}
+        direct: Dict[int, List] = {}  # Páginas con texto embebido, leídas al planificar
+        for index, (name, source, _) in enumerate(sources):
+            result = results[index]
+            ext = os.path.splitext(name)[1].lower()
+            if ext == '.pdf':
+                result['file_type'] = 'pdf'
+                try:
+                    direct[index], pages = self._plan_pdf(source, result)
+                except Exception as e:
+                    result['error'] = str(e)
+                    logger.error(f"Error abriendo PDF {name}: {e}")
+                    continue
+                if pages and stop_when and direct[index] and stop_when(self._join_pages(direct[index])):
+                    # Los campos ya están en el texto embebido: sin OCR
+                    result['timings']['skipped_pages'] = len(pages)
+                    pages = []
+                if pages:
+                    waves[index] = self._waves(pages, incremental=stop_when is not None)
+                    # Las páginas ya están clasificadas: los workers no vuelven a leer el texto embebido
+                    make_task[index] = lambda chunk, source=source: (
+                        ocr_pdf_pages, (source, chunk, self.config, preprocess, False, True, templates))
+            elif ext in IMAGE_EXTENSIONS:
+                result['file_type'] = 'image'
+                result['pages'] = 1
+                waves[index] = [[0]]
+                make_task[index] = lambda chunk, source=source: (
+                    ocr_image_file, (source, self.config, preprocess, templates))
+            else:
+                result['error'] = f"Formato no soportado: {ext}"
+
+        # Archivos que no pasan por el pool (texto directo o error) ya terminaron
+        for index, result in enumerate(results):
+            if index not in waves:
+                result['timings']['seconds'] = time.perf_counter() - started
+
+        page_texts = self._run(waves, make_task, direct, results, started, stop_when)
+
+        for index, result in enumerate(results):
+            if index in page_texts:
+                # Reensamblar en el orden de las páginas
+                result['text'] = self._join_pages(page_texts[index])
+                if result['file_type'] == 'image':
+                    result['text'] = result['text'].strip() or "No se pudo extraer texto"
+            result['success'] = bool(result['text'].strip()) and not result['error']
+            timings = result['timings']
+            for key in SECONDS_KEYS:
+                timings[key] = round(timings[key], 3)
+            confidences = timings['page_confidences']
+            timings['confidence'] = round(sum(confidences) / len(confidences), 1) if confidences else None
+        return results
+
+    @staticmethod
+    def _join_pages(pages: List[Tuple[int, str]]) -> str:
+        """Texto de las páginas en su orden, sin las vacías"""
+        return "\n\n".join(text for _, text in sorted(pages) if text.strip())
+
+    @staticmethod
+    def _describe(document) -> Tuple[str, DocumentSource, Optional[bytes]]:
+        """(nombre con extensión, ruta o bytes, bytes si está en memoria)"""
+        if isinstance(document, str):
+            return document, document, None
+        return document.name, document.source, document.data
+
+    def _new_result(self) -> Dict[str, Any]:
+        return {
+            'success': False,
+            'text': '',
+            'file_type': '',
+            'pages': 0,
+            'error': None,
+            'tesseract_available': self.reader.tesseract_available,
+            'tesseract_path': self.reader.tesseract_path,
+            'timings': {'seconds': 0.0, 'ocr_seconds': 0.0, 'ocr_pages': 0, 'text_pages': 0,
+                        'text_layer_seconds': 0.0, 'render_seconds': 0.0, 'preprocess_seconds': 0.0,
+                        'tesseract_seconds': 0.0, 'skipped_pages': 0, 'page_confidences': [], 'confidence': None},
+        }
+
+    @staticmethod
+    def _reset_ocr_timings(timings: Dict[str, Any]):
+        """Descartar lo acumulado por las tareas del pool (se vuelven a ejecutar)"""
+        timings.update(seconds=0.0, ocr_seconds=0.0, ocr_pages=0, render_seconds=0.0, preprocess_seconds=0.0,
+                       tesseract_seconds=0.0, skipped_pages=0, page_confidences=[])
+
+    def _plan_pdf(self, source: DocumentSource, result: Dict[str, Any]) -> Tuple[List[Tuple[int, str]], List[int]]:
+        """Una pasada por el PDF: [(página, texto embebido)] y las páginas que necesitan OCR"""
+        direct, scanned = [], []
+        started = time.perf_counter()
+        doc = open_pdf(source)
+        try:
+            result['pages'] = len(doc)
+            for page_num, page in enumerate(doc):
+                text = page_text_layer(page)
+                if text:
+                    direct.append((page_num, text))
+                else:
+                    scanned.append(page_num)
+        finally:
+            doc.close()
+        result['timings']['text_pages'] = len(direct)
+        result['timings']['text_layer_seconds'] = time.perf_counter() - started
+        return direct, scanned
+
+    def _chunk_pages(self, pages: List[int]) -> List[List[int]]:
+        """Lotes de páginas por tarea: repartir un documento entre los workers sin
+        lanzar Tesseract por cada página (máximo OCR_BATCH_PAGES por lote)"""
+        pages = list(pages)
+        if not pages:
+            return []
+        size = max(1, min(OCR_BATCH_PAGES, -(-len(pages) // self.max_workers)))
+        return [pages[i:i + size] for i in range(0, len(pages), size)]
+
+    @staticmethod
+    def _waves(pages: List[int], incremental: bool = False) -> List[List[int]]:
+        """Tandas de páginas: todas juntas, o en modo incremental 1, 2, 4... en orden"""
+        if not incremental:
+            return [list(pages)]
+        waves, start, size = [], 0, INCREMENTAL_FIRST_PAGES
+        while start < len(pages):
+            waves.append(list(pages[start:start + size]))
+            start += size
+            size *= 2
+        return waves
+
+    def _run(self, waves, make_task, direct, results, started, stop_when=None) -> Dict[int, List]:
+        """Ejecutar las tandas de cada archivo en el pool; si el pool no está disponible, en este proceso"""
+        initial_waves = {index: [list(wave) for wave in file_waves] for index, file_waves in waves.items()}
+        page_texts: Dict[int, List] = {}
+        pending: Dict[int, int] = {}  # Tareas en curso de la tanda actual de cada archivo
+
+        def reset():
+            page_texts.clear()
+            page_texts.update({index: list(pages) for index, pages in direct.items() if pages})
+            waves.clear()
+            waves.update({index: [list(wave) for wave in file_waves] for index, file_waves in initial_waves.items()})
+
+        def next_tasks(index):
+            """Tareas de la próxima tanda del archivo; [] si terminó (sin tandas, con
+            error o porque stop_when ya se cumple con el texto reunido)"""
+            remaining = waves[index]
+            if remaining and results[index]['error']:
+                remaining.clear()
+            if remaining and stop_when and index in page_texts \
+                    and stop_when(self._join_pages(page_texts[index])):
+                results[index]['timings']['skipped_pages'] += sum(len(wave) for wave in remaining)
+                remaining.clear()
+            if not remaining:
+                results[index]['timings']['seconds'] = time.perf_counter() - started
+                return []
+            make = make_task[index]
+            tasks = [(index,) + make(chunk) for chunk in self._chunk_pages(remaining.pop(0))]
+            pending[index] = len(tasks)
+            return tasks
+
+        def collect(index, outcome):
+            # Una imagen devuelve (página, texto, segundos, etapas); un lote de PDF, una lista
+            timings = results[index]['timings']
+            for page_num, text, seconds, stats in outcome if isinstance(outcome, list) else [outcome]:
+                page_texts.setdefault(index, []).append((page_num, text))
+                timings['ocr_seconds'] += seconds
+                timings['ocr_pages'] += 1
+                timings['render_seconds'] += stats.get('render', 0.0)
+                timings['preprocess_seconds'] += stats.get('preprocess', 0.0)
+                timings['tesseract_seconds'] += stats.get('ocr', 0.0)
+                if stats.get('confidence') is not None:
+                    timings['page_confidences'].append(stats['confidence'])
+
+        def fail(index, error):
+            logger.error(f"Error de OCR: {error}")
+            results[index]['error'] = str(error)
+
+        reset()
+        try:
+            futures = {}
+
+            def submit(tasks):
+                for index, function, args in tasks:
+                    futures[self.executor.submit(function, *args)] = index
+
+            for index in list(waves):
+                submit(next_tasks(index))
+            while futures:
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = futures.pop(future)
+                    try:
+                        collect(index, future.result())
+                    except BrokenProcessPool:
+                        raise
+                    except Exception as e:
+                        fail(index, e)
+                    pending[index] -= 1
+                    if not pending[index]:
+                        submit(next_tasks(index))
+        except BrokenProcessPool as e:
+            logger.warning(f"Pool de OCR no disponible, procesando en este proceso: {e}")
+            self.shutdown()
+            reset()
+            for index in waves:
+                results[index]['error'] = None
+                self._reset_ocr_timings(results[index]['timings'])
+            for index in list(waves):
+                tasks = next_tasks(index)
+                while tasks:
+                    for _, function, args in tasks:
+                        try:
+                            collect(index, function(*args))
+                        except Exception as e:
+                            fail(index, e)
+                    tasks = next_tasks(index)
+        return page_texts
+
+
+_pool: Optional[OCRPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_ocr_pool(max_workers: Optional[int] = None) -> OCRPool:
+    """Pool de OCR global del proceso (0 o None = un worker por núcleo)"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = OCRPool(max_workers or None)
+        return _pool
@@ -0,0 +1,191 @@
+# utils/ocr_preprocess.py - Preprocesado de imágenes para OCR con NumPy
+#
+# Las fotos de celular y los escaneos torcidos le cuestan a Tesseract más tiempo y
+# peores lecturas que una página limpia. Cada tipo de documento elige un perfil:
+# binarización (Otsu global o umbral adaptativo por bloques), recorte de bordes,
+# enderezado y reducción al tamaño de letra que Tesseract necesita. Todo se calcula
+# sobre arreglos de NumPy; PIL solo rota y redimensiona.
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+# Perfiles por tipo de documento. 'basico' es el comportamiento anterior
+# (contraste + límite de tamaño, en utils.ocr_reader.optimize_image).
+PREPROCESS_PROFILES: Dict[str, Dict[str, Any]] = {
+    'basico': {'binarize': None, 'crop': False, 'deskew': False, 'text_height': None},
+    # Ticket de báscula impreso y escaneado: fondo parejo, basta un umbral global
+    'ticket': {'binarize': 'otsu', 'crop': True, 'deskew': True, 'text_height': 32},
+    # Guía de remisión: formulario con tramas y sellos, umbral local
+    'guia': {'binarize': 'adaptive', 'crop': True, 'deskew': True, 'text_height': 32},
+    # Foto de celular: iluminación despareja, bordes oscuros y giro
+    'foto': {'binarize': 'adaptive', 'crop': True, 'deskew': True, 'text_height': 32},
+}
+DEFAULT_PREPROCESS = 'basico'
+
+ADAPTIVE_BLOCK = 41  # Lado (px, impar) de la ventana del umbral adaptativo
+ADAPTIVE_OFFSET = 12  # Un píxel es tinta si es este valor más oscuro que su vecindario
+DESPECKLE_NEIGHBORS = 3
+BORDER_FRACTION = 0.5  # Filas/columnas del borde con más tinta que esto son marco, no texto
+EDGE_BAND = 0.1  # Fracción del lado donde se busca el marco
+CROP_MARGIN = 12
+MIN_CONTENT_SIDE = 32
+MAX_SKEW_ANGLE = 5.0
+MIN_DESKEW_ANGLE = 0.2  # Giros menores no justifican rotar
+SKEW_SAMPLE = 40000  # Píxeles de tinta usados para estimar el giro
+MIN_INK_PIXELS = 200
+MIN_SCALE = 0.5
+
+
+def is_valid_profile(name: Optional[str]) -> bool:
+    return name in PREPROCESS_PROFILES
+
+
+# ================= BINARIZACIÓN =================
+
+def otsu_threshold(gray: np.ndarray) -> int:
+    """Umbral de Otsu: maximiza la varianza entre clases del histograma"""
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    prob = hist / hist.sum()
+    omega = np.cumsum(prob)
+    mu = np.cumsum(prob * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (mu[-1] * omega - mu) ** 2 / (omega * (1.0 - omega))
+    return int(np.argmax(np.nan_to_num(between)))
+
+
+def otsu_mask(gray: np.ndarray) -> np.ndarray:
+    """Máscara de tinta (True = oscuro) con umbral global"""
+    return gray <= otsu_threshold(gray)
+
+
+def box_sum(values: np.ndarray, block: int) -> np.ndarray:
+    """Suma de cada ventana block x block centrada en cada píxel (imagen integral, sin bucles)"""
+    pad = block // 2
+    padded = np.pad(values, pad, mode='edge')
+    integral = np.zeros((padded.shape[0] + 1, padded.shape[1] + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(padded, axis=0, dtype=np.int64), axis=1, out=integral[1:, 1:])
+    return (integral[block:, block:] - integral[:-block, block:]
+            - integral[block:, :-block] + integral[:-block, :-block])
+
+
+def adaptive_mask(gray: np.ndarray, block: int = ADAPTIVE_BLOCK, offset: int = ADAPTIVE_OFFSET) -> np.ndarray:
+    """Máscara de tinta contra la media local, sin los puntos sueltos del ruido del sensor"""
+    mean = box_sum(gray, block) / float(block * block)
+    return despeckle(gray < mean - offset)
+
+
+def despeckle(mask: np.ndarray, min_neighbors: int = DESPECKLE_NEIGHBORS) -> np.ndarray:
+    """Quitar píxeles de tinta con menos de min_neighbors vecinos de tinta (3x3)"""
+    neighbors = box_sum(mask.view(np.uint8), 3) - mask
+    return mask & (neighbors >= min_neighbors)
+
+
+# ================= RECORTE Y ENDEREZADO =================
+
+def content_box(mask: np.ndarray, margin: int = CROP_MARGIN) -> Tuple[int, int, int, int]:
+    """(y0, y1, x0, x1) del contenido: sin marcos oscuros en los bordes ni márgenes vacíos"""
+    height, width = mask.shape
+
+    def inner(profile):
+        # El marco son las filas casi todo tinta dentro de la franja del borde
+        solid = profile > BORDER_FRACTION
+        band = max(1, int(len(profile) * EDGE_BAND))
+        head = np.flatnonzero(solid[:band])
+        tail = np.flatnonzero(solid[-band:])
+        start = int(head[-1]) + 1 if len(head) else 0
+        end = len(profile) - band + int(tail[0]) if len(tail) else len(profile)
+        # Después del marco, el margen vacío (el margen de recorte no vuelve a entrar al marco)
+        ink = np.flatnonzero(profile[start:end] > 0)
+        if not len(ink):
+            return start, end
+        return max(start, start + int(ink[0]) - margin), min(end, start + int(ink[-1]) + 1 + margin)
+
+    y0, y1 = inner(mask.mean(axis=1))
+    x0, x1 = inner(mask.mean(axis=0))
+    if y1 - y0 < MIN_CONTENT_SIDE or x1 - x0 < MIN_CONTENT_SIDE:
+        return 0, height, 0, width
+    return y0, y1, x0, x1
+
+
+def _projection_scores(ys: np.ndarray, xs: np.ndarray, angles: np.ndarray) -> np.ndarray:
+    """Nitidez del perfil horizontal de la tinta inclinada a cada ángulo"""
+    slopes = np.tan(np.radians(angles))
+    rows = np.rint(ys[None, :] - xs[None, :] * slopes[:, None]).astype(np.int64)
+    rows -= rows.min()
+    span = int(rows.max()) + 1
+    rows += np.arange(len(angles))[:, None] * span
+    hist = np.bincount(rows.ravel(), minlength=len(angles) * span).reshape(len(angles), span)
+    # Energía del gradiente: premia los saltos entre líneas y renglones, no los
+    # bloques parejos (ruido, fondos) que son más "nítidos" a 0°
+    return (np.diff(hist.astype(np.float64), axis=1) ** 2).sum(axis=1)
+
+
+def estimate_skew(mask: np.ndarray, max_angle: float = MAX_SKEW_ANGLE) -> float:
+    """Giro de las líneas de texto en grados (positivo = bajan hacia la derecha).
+
+    Perfil de proyección: al ángulo correcto las filas de tinta se concentran en
+    los renglones y el perfil cambia bruscamente entre renglón y espacio. Búsqueda
+    gruesa cada 1° y fina cada 0.1° alrededor de la mejor.
+    """
+    ys, xs = np.nonzero(mask)
+    if len(ys) < MIN_INK_PIXELS:
+        return 0.0
+    if len(ys) > SKEW_SAMPLE:
+        step = len(ys) // SKEW_SAMPLE + 1
+        ys, xs = ys[::step], xs[::step]
+
+    coarse = np.arange(-max_angle, max_angle + 0.5, 1.0)
+    best = coarse[int(np.argmax(_projection_scores(ys, xs, coarse)))]
+    fine = np.arange(best - 1.0, best + 1.05, 0.1)
+    return float(round(fine[int(np.argmax(_projection_scores(ys, xs, fine)))], 2))
+
+
+def text_line_height(mask: np.ndarray) -> Optional[float]:
+    """Altura mediana (px) de las líneas de texto según el perfil horizontal"""
+    rows = mask.sum(axis=1)
+    if not rows.any():
+        return None
+    inked = np.concatenate(([False], rows > rows.max() * 0.05, [False]))
+    edges = np.flatnonzero(np.diff(inked.astype(np.int8)))
+    runs = edges[1::2] - edges[::2]
+    runs = runs[runs >= 3]  # Ruido y líneas de tabla
+    return float(np.median(runs)) if len(runs) else None
+
+
+# ================= PIPELINE =================
+
+def preprocess_image(image: Image.Image, profile: str, max_side: int = 2000) -> Image.Image:
+    """Imagen binaria (0/255) lista para OCR según el perfil del tipo de documento"""
+    settings = PREPROCESS_PROFILES[profile]
+    if image.mode != 'L':
+        image = image.convert('L')
+    if max(image.size) > max_side:
+        ratio = max_side / max(image.size)
+        image = image.resize((int(image.width * ratio), int(image.height * ratio)), Image.Resampling.BOX)
+
+    gray = np.asarray(image)
+    global_mask = otsu_mask(gray)
+    mask = adaptive_mask(gray) if settings['binarize'] == 'adaptive' else global_mask
+
+    if settings['crop']:
+        # El marco se detecta con el umbral global: el adaptativo solo marca su contorno
+        y0, y1, x0, x1 = content_box(global_mask)
+        mask = mask[y0:y1, x0:x1]
+
+    output = Image.fromarray(np.where(mask, 0, 255).astype(np.uint8))
+
+    if settings['deskew']:
+        angle = estimate_skew(mask)
+        if abs(angle) >= MIN_DESKEW_ANGLE:
+            output = output.rotate(angle, resample=Image.Resampling.NEAREST, expand=True, fillcolor=255)
+
+    # Reducir hasta la altura de línea que necesita Tesseract (nunca agrandar)
+    target = settings['text_height']
+    height = text_line_height(np.asarray(output) == 0) if target else None
+    if height and height > target * 1.25:
+        # Acotado: una altura mal estimada (líneas pegadas) no destruye la imagen
+        ratio = max(target / height, MIN_SCALE)
+        size = (max(1, int(output.width * ratio)), max(1, int(output.height * ratio)))
+        output = output.resize(size, Image.Resampling.BOX).point(lambda v: 255 if v > 127 else 0)
+    return output
@@ -6,10 +6,319 @@ import io
 import os
 import subprocess
 import logging
-from typing import Dict, Any, Optional
+import tempfile
+import time
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple, Union
+
+from utils.ocr_preprocess import DEFAULT_PREPROCESS, PREPROCESS_PROFILES, preprocess_image
 
 logger = logging.getLogger(__name__)
 
+# Configuración optimizada
+OCR_CONFIG = r'--oem 3 --psm 6 -l spa'
+PDF_ZOOM = 1.5  # Resolución moderada para Railway
+MIN_PAGE_TEXT = 30  # Caracteres de texto directo para no hacer OCR de la página
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+TESSERACT_MISSING_ERROR = (
+    'Tesseract OCR no está instalado en Railway.\n'
+    'Railway necesita instalar dependencias del sistema.\n'
+    'Crea un archivo "aptfile" con:\n'
+    'tesseract-ocr\ntesseract-ocr-spa\npoppler-utils'
+)
+# Páginas por invocación de Tesseract: cada proceso nuevo vuelve a cargar spa.traineddata
+OCR_BATCH_PAGES = 16
+# Lado mayor (px) de la imagen que recibe Tesseract; la resolución de cada página
+# se elige para caer en este rango sin tener que redimensionar después
+OCR_MIN_SIDE = 1000
+OCR_MAX_SIDE = 2000
+
+
+# Un documento llega como ruta en disco o como los bytes de la subida (utils/document_intake.py)
+DocumentSource = Union[str, bytes]
+
+
+# ================= OCR POR PÁGINA =================
+# Funciones de módulo (no métodos) para poder ejecutarlas también en los
+# procesos del pool de OCR (utils/ocr_pool.py).
+
+def open_pdf(source: DocumentSource) -> fitz.Document:
+    """PDF desde una ruta o desde memoria, sin escribirlo a disco"""
+    if isinstance(source, (bytes, bytearray)):
+        return fitz.open(stream=source, filetype='pdf')
+    return fitz.open(source)
+
+
+def open_image(source: DocumentSource) -> Image.Image:
+    """Imagen desde una ruta o desde memoria"""
+    if isinstance(source, (bytes, bytearray)):
+        return Image.open(io.BytesIO(source))
+    return Image.open(source)
+
+
+def optimize_image(image: Image.Image) -> Image.Image:
+    """Optimiza imagen para OCR en Railway (sin OpenCV)"""
+    try:
+        # Convertir a escala de grises
+        if image.mode != 'L':
+            image = image.convert('L')
+        
+        # Mejorar contraste (simple)
+        enhancer = ImageEnhance.Contrast(image)
+        image = enhancer.enhance(1.5)
+        
+        # Redimensionar si es muy grande (para eficiencia)
+        max_size = OCR_MAX_SIDE
+        if image.width > max_size or image.height > max_size:
+            ratio = max_size / max(image.width, image.height)
+            new_size = (int(image.width * ratio), int(image.height * ratio))
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+        
+        return image
+        
+    except Exception as e:
+        logger.warning(f"Error optimizando imagen: {e}")
+        return image
+
+
+def prepare_image(image: Image.Image, preprocess: Optional[str] = None) -> Image.Image:
+    """Preprocesado según el perfil del tipo de documento (utils/ocr_preprocess.py)"""
+    profile = preprocess or DEFAULT_PREPROCESS
+    if not PREPROCESS_PROFILES.get(profile, {}).get('binarize'):
+        return optimize_image(image)
+    try:
+        return preprocess_image(image, profile, max_side=OCR_MAX_SIDE)
+    except Exception as e:
+        logger.warning(f"Error en el preprocesado '{profile}', se usa el básico: {e}")
+        return optimize_image(image)
+
+
+def ocr_images_scored(images: List[Image.Image], config: str = OCR_CONFIG) -> Tuple[List[str], List[Optional[float]]]:
+    """OCR de varias imágenes con una sola invocación de Tesseract.
+
+    Tesseract acepta como entrada un archivo de texto con una imagen por línea y
+    separa la salida de cada página con un form feed; así el modelo se carga una
+    vez por lote y no una vez por página. La misma invocación escribe el TSV de
+    palabras (tessedit_create_tsv), de donde sale la confianza media de cada
+    imagen sin otra pasada de OCR. Devuelve (textos, confianzas); la confianza es
+    None si Tesseract no la informó.
+    """
+    with tempfile.TemporaryDirectory(prefix='ocr_batch_') as tmp_dir:
+        paths = []
+        for i, image in enumerate(images):
+            # PNM sin compresión: escribirlo es mucho más barato que un PNG
+            path = os.path.join(tmp_dir, f'{i:04d}.pnm')
+            image.save(path, format='PPM')
+            paths.append(path)
+        
+        if len(paths) == 1:
+            input_path = paths[0]
+        else:
+            input_path = os.path.join(tmp_dir, 'pages.txt')
+            with open(input_path, 'w') as f:
+                f.write('\n'.join(paths) + '\n')
+        
+        output_base = os.path.join(tmp_dir, 'output')
+        pytesseract.pytesseract.run_tesseract(input_path, output_base, extension='txt', lang='spa',
+                                              config=f'{config} -c tessedit_create_tsv=1')
+        with open(f'{output_base}.txt', 'r', encoding='utf-8') as f:
+            output = f.read()
+        confidences = tsv_confidences(f'{output_base}.tsv', len(images))
+    
+    pages = output.split('\f')
+    # Cada página termina con el separador: sobra el tramo vacío del final
+    if len(pages) == len(images) + 1 and not pages[-1].strip():
+        pages = pages[:-1]
+    if len(pages) != len(images):
+        logger.warning(f"Salida de Tesseract por lotes inesperada ({len(pages)} de {len(images)} páginas), OCR por página")
+        return ([pytesseract.image_to_string(image, config=config, lang='spa') for image in images],
+                [None] * len(images))
+    return pages, confidences
+
+
+def ocr_images_batch(images: List[Image.Image], config: str = OCR_CONFIG) -> List[str]:
+    """Textos de ocr_images_scored, sin las confianzas"""
+    return ocr_images_scored(images, config)[0]
+
+
+def tsv_confidences(tsv_path: str, pages: int) -> List[Optional[float]]:
+    """Confianza media (0-100) de las palabras de cada página del TSV de Tesseract"""
+    totals = [0.0] * pages
+    counts = [0] * pages
+    try:
+        with open(tsv_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                # level page_num block par line word left top width height conf text
+                cols = line.rstrip('\n').split('\t')
+                if len(cols) < 12 or cols[0] != '5' or not cols[11].strip():
+                    continue
+                try:
+                    page, conf = int(cols[1]) - 1, float(cols[10])
+                except ValueError:
+                    continue
+                if conf >= 0 and 0 <= page < pages:
+                    totals[page] += conf
+                    counts[page] += 1
+    except OSError:
+        return [None] * pages
+    return [round(total / count, 1) if count else None for total, count in zip(totals, counts)]
+
+
+def ocr_function(templates: bool = False):
+    """OCR por lotes de página completa, o por regiones de plantilla; ambos devuelven (textos, confianzas)"""
+    if not templates:
+        return ocr_images_scored
+    # Import diferido: utils.ocr_templates usa ocr_images_scored de este módulo
+    from utils.ocr_templates import ocr_images_by_template
+    return ocr_images_by_template
+
+
+def page_zoom(page) -> float:
+    """Zoom de render de una página: PDF_ZOOM, acotado para que el lado mayor quede
+    entre OCR_MIN_SIDE y OCR_MAX_SIDE (tickets angostos suben, planos grandes bajan)"""
+    longest = max(page.rect.width, page.rect.height)
+    if longest <= 0:
+        return PDF_ZOOM
+    return min(max(PDF_ZOOM, OCR_MIN_SIDE / longest), OCR_MAX_SIDE / longest)
+
+
+def render_pdf_page(page, preprocess: Optional[str] = None, stats: Optional[Dict[str, Any]] = None) -> Image.Image:
+    """Imagen optimizada de una página para OCR.
+    
+    La página se rasteriza directo en escala de grises (1 byte por píxel) y PIL lee
+    las muestras del pixmap sin copiarlas: sin RGB, sin codificar/decodificar PNG y
+    sin convert('L'). Si se pasa stats, se anotan los segundos de 'render' y 'preprocess'.
+    """
+    started = time.perf_counter()
+    zoom = page_zoom(page)
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+    image = Image.frombuffer('L', (pix.width, pix.height), pix.samples_mv, 'raw', 'L', pix.stride, 1)
+    rendered = time.perf_counter()
+    
+    # La imagen comparte la memoria del pixmap: se preprocesa (el resultado es una
+    # imagen nueva) y se libera antes que el pixmap, que no se destruye con la vista exportada
+    try:
+        optimized = prepare_image(image, preprocess)
+        return optimized.copy() if optimized is image else optimized
+    finally:
+        image.close()
+        del image
+        if stats is not None:
+            stats['render'] = rendered - started
+            stats['preprocess'] = time.perf_counter() - rendered
+
+
+def page_text_layer(page) -> Optional[str]:
+    """Texto embebido de la página si alcanza para no hacer OCR"""
+    text = page.get_text()
+    if text and len(text.strip()) > MIN_PAGE_TEXT:
+        return text
+    return None
+
+
+# Resultado de una página: (página, texto, segundos, etapas). etapas indica de dónde
+# salió el texto ('source': 'text' embebido, 'ocr', 'none' sin Tesseract o 'skipped'
+# si no hizo falta leerla porque ya estaban los campos), los
+# segundos de cada etapa ('text_layer', 'render', 'preprocess', 'ocr') y la
+# confianza media de Tesseract ('confidence') en las páginas con OCR.
+PageResult = Tuple[int, str, float, Dict[str, Any]]
+
+
+def ocr_pdf_pages(pdf_source: DocumentSource, page_nums: Optional[Iterable[int]] = None, config: str = OCR_CONFIG,
+                  preprocess: Optional[str] = None, text_layer: bool = True,
+                  ocr: bool = True, templates: bool = False,
+                  stop_when: Optional[Callable[[str], bool]] = None) -> List[PageResult]:
+    """Texto de las páginas del PDF en una sola pasada: por página, el texto
+    embebido si lo tiene y si no, OCR por lotes.
+
+    page_nums=None recorre todo el documento. Devuelve [(página, texto, segundos, etapas)]
+    en el orden pedido, para reensamblar desde el pool; el tiempo de cada lote de
+    OCR se reparte entre sus páginas. text_layer=False cuando las páginas ya se
+    clasificaron como escaneadas (el pool) y ocr=False sin Tesseract (las páginas
+    escaneadas quedan vacías). templates=True lee solo las regiones de los campos
+    en las páginas que coinciden con un formato conocido (utils/ocr_templates.py).
+    
+    stop_when(texto) -> bool activa el modo incremental: se evalúa con el texto
+    reunido después de cada página con texto embebido y de cada lote de OCR (lotes
+    de 1, 2, 4... páginas) y, cuando devuelve True, las páginas restantes quedan
+    como 'skipped' sin leerse.
+    """
+    ocr_batch = ocr_function(templates)
+    results = {}
+    doc = open_pdf(pdf_source)
+    try:
+        batch = []  # (página, imagen, segundos hasta el render, etapas)
+        batch_size = 1 if stop_when else OCR_BATCH_PAGES
+        
+        def flush():
+            started = time.perf_counter()
+            texts, confidences = ocr_batch([image for _, image, _, _ in batch], config)
+            share = (time.perf_counter() - started) / len(batch)
+            for (page_num, _, render_seconds, stats), text, confidence in zip(batch, texts, confidences):
+                stats.update(ocr=share, confidence=confidence)
+                results[page_num] = (page_num, text, render_seconds + share, stats)
+            batch.clear()
+        
+        def enough() -> bool:
+            text = "\n\n".join(results[n][1] for n in sorted(results) if results[n][1].strip())
+            return stop_when is not None and bool(text) and stop_when(text)
+        
+        page_nums = list(range(len(doc)) if page_nums is None else page_nums)
+        for page_num in page_nums:
+            started = time.perf_counter()
+            page = doc.load_page(page_num)
+            
+            # 1. Intentar texto directo
+            text = page_text_layer(page) if text_layer else None
+            stats = {'source': 'text' if text else 'none', 'text_layer': time.perf_counter() - started}
+            if text or not ocr:
+                results[page_num] = (page_num, text or '', time.perf_counter() - started, stats)
+                if text and enough():
+                    batch.clear()  # Páginas anteriores aún sin OCR: ya no hacen falta
+                    break
+                continue
+            
+            # 2. OCR si no hay texto (se acumula en el lote)
+            stats['source'] = 'ocr'
+            image = render_pdf_page(page, preprocess, stats)
+            batch.append((page_num, image, time.perf_counter() - started, stats))
+            if len(batch) >= batch_size:
+                flush()
+                if enough():
+                    break
+                if stop_when:
+                    batch_size = min(batch_size * 2, OCR_BATCH_PAGES)
+        
+        if batch:
+            flush()
+    finally:
+        doc.close()
+    return [results.get(page_num) or (page_num, '', 0.0, {'source': 'skipped'}) for page_num in page_nums]
+
+
+def ocr_pdf_page(pdf_source: DocumentSource, page_num: int, config: str = OCR_CONFIG,
+                 preprocess: Optional[str] = None) -> PageResult:
+    """Texto de una página del PDF; devuelve (página, texto, segundos, etapas)"""
+    return ocr_pdf_pages(pdf_source, [page_num], config, preprocess)[0]
+
+
+def ocr_image_file(image_source: DocumentSource, config: str = OCR_CONFIG,
+                   preprocess: Optional[str] = None, templates: bool = False) -> PageResult:
+    """OCR de una imagen completa; devuelve (0, texto, segundos, etapas)"""
+    started = time.perf_counter()
+    image = open_image(image_source)
+    
+    # Preprocesar según el tipo de documento
+    image = prepare_image(image, preprocess)
+    prepared = time.perf_counter()
+    
+    # OCR simple - un solo intento para eficiencia
+    texts, confidences = ocr_function(templates)([image], config)
+    finished = time.perf_counter()
+    stats = {'source': 'ocr', 'preprocess': prepared - started, 'ocr': finished - prepared,
+             'confidence': confidences[0]}
+    return 0, texts[0], finished - started, stats
+
+
 class RailwayOCRReader:
     def __init__(self):
         """Inicializa el lector OCR optimizado para Railway"""
@@ -22,8 +331,7 @@ class RailwayOCRReader:
         else:
             logger.error("❌ Tesseract NO disponible en Railway")
         
-        # Configuración optimizada
-        self.config = r'--oem 3 --psm 6 -l spa'
+        self.config = OCR_CONFIG
     
     def _find_tesseract(self) -> Optional[str]:
         """Busca Tesseract en Railway"""
@@ -49,8 +357,10 @@ class RailwayOCRReader:
         
         return None
     
-    def extract_text_from_file(self, file_path: str) -> Dict[str, Any]:
-        """Extrae texto de archivos en Railway"""
+    def extract_text_from_file(self, file_path: str, data: Optional[bytes] = None,
+                               stop_when: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+        """Extrae texto de archivos en Railway (de data si el archivo ya está en memoria).
+        Con stop_when, un PDF deja de leerse en cuanto el texto reunido lo satisface."""
         result = {
             'success': False,
             'text': '',
@@ -61,27 +371,24 @@ class RailwayOCRReader:
             'tesseract_path': self.tesseract_path
         }
         
-        if not self.tesseract_available:
-            result['error'] = (
-                'Tesseract OCR no está instalado en Railway.\n'
-                'Railway necesita instalar dependencias del sistema.\n'
-                'Crea un archivo "aptfile" con:\n'
-                'tesseract-ocr\ntesseract-ocr-spa\npoppler-utils'
-            )
+        ext = os.path.splitext(file_path)[1].lower()
+        source = data if data is not None else file_path
+        
+        # Sin Tesseract todavía se puede leer el texto embebido de los PDF
+        if not self.tesseract_available and ext != '.pdf':
+            result['error'] = TESSERACT_MISSING_ERROR
             return result
         
         try:
-            ext = os.path.splitext(file_path)[1].lower()
-            
             if ext == '.pdf':
                 result['file_type'] = 'pdf'
-                text, pages = self._process_pdf_railway(file_path)
+                text, pages = self._process_pdf_railway(source, stop_when)
                 result['text'] = text
                 result['pages'] = pages
                 
-            elif ext in ['.jpg', '.jpeg', '.png', '.bmp']:
+            elif ext in IMAGE_EXTENSIONS:
                 result['file_type'] = 'image'
-                result['text'] = self._process_image_railway(file_path)
+                result['text'] = self._process_image_railway(source)
                 result['pages'] = 1
                 
             else:
@@ -89,6 +396,8 @@ class RailwayOCRReader:
                 return result
             
             result['success'] = bool(result['text'].strip())
+            if not result['success'] and not self.tesseract_available:
+                result['error'] = TESSERACT_MISSING_ERROR
             
         except Exception as e:
             result['error'] = str(e)
@@ -96,67 +405,21 @@ class RailwayOCRReader:
         
         return result
     
-    def _process_pdf_railway(self, pdf_path: str):
-        """Procesa PDFs optimizado para Railway"""
+    def _process_pdf_railway(self, pdf_source: DocumentSource, stop_when: Optional[Callable[[str], bool]] = None):
+        """Procesa PDFs en una pasada: texto embebido por página y OCR solo de las escaneadas"""
         try:
-            doc = fitz.open(pdf_path)
-            all_text = []
-            total_pages = len(doc)
-            
-            # Procesar máximo 10 páginas para eficiencia
-            max_pages = min(total_pages, 10)
-            
-            for page_num in range(max_pages):
-                page = doc.load_page(page_num)
-                
-                # 1. Intentar texto directo
-                text = page.get_text()
-                if text and len(text.strip()) > 30:
-                    all_text.append(text)
-                    continue
-                
-                # 2. OCR si no hay texto
-                zoom = 1.5  # Resolución moderada para Railway
-                mat = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=mat, alpha=False)
-                
-                img_data = pix.tobytes("png")
-                image = Image.open(io.BytesIO(img_data))
-                
-                # Optimizar imagen para Railway
-                image = self._optimize_image_railway(image)
-                
-                page_text = pytesseract.image_to_string(
-                    image, 
-                    config=self.config,
-                    lang='spa'
-                )
-                
-                if page_text.strip():
-                    all_text.append(page_text)
-            
-            doc.close()
-            return "\n\n".join(all_text), total_pages
+            pages = ocr_pdf_pages(pdf_source, config=self.config, ocr=self.tesseract_available, stop_when=stop_when)
+            all_text = [page_text for _, page_text, _, _ in pages if page_text.strip()]
+            return "\n\n".join(all_text), len(pages)
             
         except Exception as e:
             logger.error(f"Error procesando PDF en Railway: {e}")
             return f"Error PDF: {str(e)}", 0
     
-    def _process_image_railway(self, image_path: str) -> str:
+    def _process_image_railway(self, image_source: DocumentSource) -> str:
         """Procesa imágenes optimizado para Railway"""
         try:
-            image = Image.open(image_path)
-            
-            # Optimizar para Railway
-            image = self._optimize_image_railway(image)
-            
-            # OCR simple - un solo intento para eficiencia
-            text = pytesseract.image_to_string(
-                image,
-                config=self.config,
-                lang='spa'
-            )
-            
+            _, text, _, _ = ocr_image_file(image_source, self.config)
             return text.strip() if text.strip() else "No se pudo extraer texto"
                 
         except Exception as e:
@@ -165,27 +428,7 @@ class RailwayOCRReader:
     
     def _optimize_image_railway(self, image: Image.Image) -> Image.Image:
         """Optimiza imagen para OCR en Railway (sin OpenCV)"""
-        try:
-            # Convertir a escala de grises
-            if image.mode != 'L':
-                image = image.convert('L')
-            
-            # Mejorar contraste (simple)
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(1.5)
-            
-            # Redimensionar si es muy grande (para eficiencia)
-            max_size = 2000
-            if image.width > max_size or image.height > max_size:
-                ratio = max_size / max(image.width, image.height)
-                new_size = (int(image.width * ratio), int(image.height * ratio))
-                image = image.resize(new_size, Image.Resampling.LANCZOS)
-            
-            return image
-            
-        except Exception as e:
-            logger.warning(f"Error optimizando imagen: {e}")
-            return image
+        return optimize_image(image)
     
     def test_tesseract(self) -> Dict[str, Any]:
         """Prueba Tesseract en Railway"""
@@ -268,27 +511,12 @@ class AdvancedOCRReader(RailwayOCRReader):
         super().__init__()
         self.prefer_tesseract = prefer_tesseract
 
-    def extract_text_from_file(self, file_path: str) -> Dict[str, Any]:
-        # Intentar extracción con PyMuPDF (texto directo) como primera opción
+    def extract_text_from_file(self, file_path: str, data: Optional[bytes] = None,
+                               stop_when: Optional[Callable[[str], bool]] = None) -> Dict[str, Any]:
+        # Una sola pasada: RailwayOCRReader decide por página entre el texto
+        # embebido (PyMuPDF) y el OCR, también en PDFs mixtos
         try:
-            ext = os.path.splitext(file_path)[1].lower()
-            if ext == '.pdf':
-                try:
-                    doc = fitz.open(file_path)
-                    full_text = []
-                    for page in doc:
-                        txt = page.get_text()
-                        if txt and len(txt.strip())>10:
-                            full_text.append(txt)
-                    doc.close()
-                    text = "\n\n".join(full_text).strip()
-                    if text:
-                        return {'success': True, 'text': text, 'pages': len(full_text), 'error': None}
-                except Exception:
-                    pass
-
-            # Fallback al comportamiento Railway (que puede usar tesseract si está disponible)
-            return super().extract_text_from_file(file_path)
+            return super().extract_text_from_file(file_path, data, stop_when)
         except Exception as e:
             return {'success': False, 'text': '', 'pages': 0, 'error': str(e)}
 
@@ -0,0 +1,236 @@
+# utils/ocr_templates.py - OCR por regiones para los formatos conocidos de documentos
+#
+# El ticket de báscula, la guía de remisión y la hoja de mercancía (las tres páginas
+# de models.document_record.DocumentRecord) tienen un formato fijo. En lugar de leer
+# la página completa con --psm 6 y buscar los campos con regex, la página se clasifica
+# con el OCR de su encabezado y solo se leen los recortes de los campos de su
+# plantilla, cada uno con su modo de segmentación (--psm) y su lista de caracteres.
+# El texto de la página se arma con líneas "ETIQUETA: valor" que el parser
+# (utils/document_parser.py) ya reconoce; unparsed_regions comprueba que cada etiqueta
+# devuelve su campo. Si la página no coincide con ninguna
+# plantilla o falta un campo obligatorio, se hace el OCR de la página completa.
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image
+
+from utils.document_parser import extract_field
+from utils.ocr_reader import OCR_CONFIG, ocr_images_batch, ocr_images_scored
+
+logger = logging.getLogger(__name__)
+
+# Franja superior de la página (fracción de la altura) que se lee para clasificarla
+HEADER_FRACTION = 0.08
+# Margen (px) alrededor de cada región: Tesseract lee peor el texto pegado al borde
+REGION_PADDING = 6
+
+DIGITS = '0123456789'
+LETTERS = 'ABCDEFGHIJKLMNÑOPQRSTUVWXYZÁÉÍÓÚ'
+DATE_CHARS = DIGITS + '/-'
+PLATE_CHARS = LETTERS + DIGITS + '-'
+DECIMAL_CHARS = DIGITS + '.,'
+
+
+@dataclass(frozen=True)
+class FieldRegion:
+    label: str  # Etiqueta con la que el parser reconoce el valor
+    box: Tuple[float, float, float, float]  # (x0, y0, x1, y1) en fracción de la página
+    psm: int = 7  # 7 = una línea de texto
+    whitelist: Optional[str] = None
+    pattern: Optional[str] = None  # Valor válido dentro del texto leído
+    required: bool = False  # Sin este campo la página se lee completa
+    parser_field: Optional[str] = None  # Campo del parser (FIELD_COLUMNS) que se lee de esta línea
+
+
+@dataclass(frozen=True)
+class DocumentTemplate:
+    name: str
+    title: str  # Primera línea del texto armado (como la imprime el documento)
+    keywords: Tuple[str, ...]  # Palabras del encabezado que identifican el formato
+    fields: Tuple[FieldRegion, ...] = field(default_factory=tuple)
+
+
+def _row(top: float, height: float = 0.04, x0: float = 0.30, x1: float = 0.95) -> Tuple[float, float, float, float]:
+    """Caja de la columna de valores de una fila del formulario"""
+    return x0, top, x1, top + height
+
+
+# Las cajas se tomaron de los formatos de ejemplo (A4 vertical, etiquetas a la
+# izquierda y valores desde el 30% del ancho); con otro proveedor se ajustan aquí.
+DOCUMENT_TEMPLATES: Dict[str, DocumentTemplate] = {
+    # Página 1: ticket de pesaje
+    'ticket_pesaje': DocumentTemplate(
+        name='ticket_pesaje',
+        title='TICKET DE BASCULA',
+        keywords=('BASCULA', 'PESAJE', 'BALANZA'),
+        fields=(
+            FieldRegion('PROCESO', _row(0.10), whitelist=DIGITS, pattern=r'\d{4,}', required=True,
+                        parser_field='numero_guia'),
+            FieldRegion('PESAJE', _row(0.14), whitelist=DIGITS, pattern=r'\d{4,}'),
+            FieldRegion('FECHA', _row(0.18), whitelist=DATE_CHARS, pattern=r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}',
+                        parser_field='fecha'),
+            FieldRegion('PLACA', _row(0.22), whitelist=PLATE_CHARS, pattern=r'[A-Z]{2,3}-?\d{3,4}',
+                        parser_field='placa_vehiculo'),
+            FieldRegion('CONDUCTOR', _row(0.26), whitelist=LETTERS),
+            FieldRegion('TARA', _row(0.30), whitelist=DIGITS, pattern=r'\d+'),
+            FieldRegion('BRUTO', _row(0.34), whitelist=DIGITS, pattern=r'\d+'),
+            FieldRegion('NETO', _row(0.38), whitelist=DIGITS, pattern=r'\d+', required=True, parser_field='cantidad'),
+            FieldRegion('MATERIAL', _row(0.42), psm=6, whitelist=LETTERS + DIGITS + '.%', parser_field='material'),
+            FieldRegion('RUC', _row(0.46), whitelist=DIGITS, pattern=r'\d{11}', parser_field='ruc_proveedor'),
+            FieldRegion('DNI', _row(0.50), whitelist=DIGITS, pattern=r'\d{8}', parser_field='licencia_conductor'),
+        ),
+    ),
+    # Página 2: guía de remisión (traslado)
+    'guia_remision': DocumentTemplate(
+        name='guia_remision',
+        title='GUIA DE REMISION',
+        keywords=('REMISION', 'REMITENTE', 'TRASLADO'),
+        fields=(
+            FieldRegion('N° GUIA', _row(0.10), whitelist=DIGITS, pattern=r'\d{4,}', required=True,
+                        parser_field='numero_guia'),
+            FieldRegion('FECHA', _row(0.14), whitelist=DATE_CHARS, pattern=r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}',
+                        parser_field='fecha'),
+            FieldRegion('RUC PROVEEDOR', _row(0.18), whitelist=DIGITS, pattern=r'\d{11}', required=True,
+                        parser_field='ruc_proveedor'),
+            FieldRegion('RUC TRANSPORTISTA', _row(0.22), whitelist=DIGITS, pattern=r'\d{11}',
+                        parser_field='ruc_transportista'),
+            FieldRegion('PLACA', _row(0.26), whitelist=PLATE_CHARS, pattern=r'[A-Z]{2,3}-?\d{3,4}',
+                        parser_field='placa_vehiculo'),
+            FieldRegion('CONDUCTOR', _row(0.30), whitelist=LETTERS),
+            FieldRegion('LICENCIA', _row(0.34), whitelist=LETTERS + DIGITS, pattern=r'\d{8,10}',
+                        parser_field='licencia_conductor'),
+        ),
+    ),
+    # Página 3: mercancía
+    'mercancia': DocumentTemplate(
+        name='mercancia',
+        title='DETALLE DE MERCANCIA',
+        keywords=('MERCANCIA', 'BIENES', 'DESCRIPCION'),
+        fields=(
+            FieldRegion('PRODUCTO', _row(0.10), psm=6, whitelist=LETTERS + DIGITS + '.%', required=True,
+                        parser_field='material'),
+            FieldRegion('CANTIDAD', _row(0.14), whitelist=DECIMAL_CHARS, pattern=r'\d+[.,]?\d*', required=True,
+                        parser_field='cantidad'),
+            FieldRegion('UNIDAD', _row(0.18), whitelist=LETTERS, pattern=r'KILOGRAMOS|KILOS|KG', parser_field='unidad'),
+            FieldRegion('PESO NETO', _row(0.22), whitelist=DECIMAL_CHARS, pattern=r'\d+'),
+            FieldRegion('PESO BRUTO', _row(0.26), whitelist=DECIMAL_CHARS, pattern=r'\d+'),
+        ),
+    ),
+}
+
+
+def region_config(region: FieldRegion) -> str:
+    config = f'--oem 3 --psm {region.psm} -l spa'
+    if region.whitelist:
+        config += f' -c tessedit_char_whitelist={region.whitelist}'
+    return config
+
+
+def classify_text(text: str) -> Optional[DocumentTemplate]:
+    """Plantilla cuyas palabras clave aparecen en el texto (ninguna si hay empate)"""
+    upper = text.upper()
+    scores = [(sum(keyword in upper for keyword in template.keywords), template)
+              for template in DOCUMENT_TEMPLATES.values()]
+    scores = sorted((score for score in scores if score[0]), key=lambda score: score[0], reverse=True)
+    if not scores or (len(scores) > 1 and scores[0][0] == scores[1][0]):
+        return None
+    return scores[0][1]
+
+
+def crop_region(image: Image.Image, box: Tuple[float, float, float, float]) -> Image.Image:
+    x0, y0, x1, y1 = box
+    width, height = image.size
+    return image.crop((max(0, int(x0 * width) - REGION_PADDING), max(0, int(y0 * height) - REGION_PADDING),
+                       min(width, int(x1 * width) + REGION_PADDING), min(height, int(y1 * height) + REGION_PADDING)))
+
+
+def region_value(region: FieldRegion, text: str) -> Optional[str]:
+    """Valor del campo en el texto leído del recorte (None si no es válido)"""
+    text = ' '.join(text.upper().split())
+    if region.pattern:
+        match = re.search(region.pattern, text)
+        return match.group(0) if match else None
+    return text or None
+
+
+def template_text(template: DocumentTemplate, found: Dict[FieldRegion, Optional[str]]) -> str:
+    """Texto de la página leída por plantilla: el título y una línea "ETIQUETA: valor" por campo leído"""
+    return '\n'.join([template.title] + [f"{region.label}: {found[region]}" for region in template.fields
+                                          if found.get(region)])
+
+
+def unparsed_regions(template: DocumentTemplate, values: Dict[str, str]) -> List[str]:
+    """Etiquetas cuyo campo del parser no sale del texto armado con template_text.
+
+    values tiene un valor de ejemplo por etiqueta, como lo imprime el documento. Cada
+    región con parser_field tiene que devolver en el texto de la página el mismo valor
+    que en su línea sola; si no, la plantilla da la página por leída y el campo se pierde.
+    """
+    found = {region: region_value(region, values[region.label]) for region in template.fields}
+    text = template_text(template, found)
+    missing = []
+    for region in template.fields:
+        if region.parser_field is None:
+            continue
+        expected = extract_field(f"{region.label}: {found[region]}", region.parser_field)
+        if not expected or extract_field(text, region.parser_field) != expected:
+            missing.append(region.label)
+    return missing
+
+
+def ocr_images_by_template(images: List[Image.Image],
+                           config: str = OCR_CONFIG) -> Tuple[List[str], List[Optional[float]]]:
+    """Mismo contrato que ocr_images_scored: (textos, confianzas), uno por imagen y en orden.
+    La confianza de una página leída por plantilla es la media de sus recortes.
+
+    1. Encabezados de todas las páginas en una invocación de Tesseract para clasificarlas.
+    2. Recortes de los campos agrupados por configuración (psm + lista de caracteres):
+       una invocación por configuración para todo el lote, no una por recorte.
+    3. Las páginas sin plantilla o sin algún campo obligatorio, completas en un lote.
+    """
+    headers = ocr_images_batch([crop_region(image, (0.0, 0.0, 1.0, HEADER_FRACTION)) for image in images], config)
+    templates = [classify_text(header) for header in headers]
+
+    groups: Dict[str, List[Tuple[int, FieldRegion]]] = {}
+    crops: Dict[str, List[Image.Image]] = {}
+    for index, (image, template) in enumerate(zip(images, templates)):
+        if template is None:
+            continue
+        for region in template.fields:
+            key = region_config(region)
+            groups.setdefault(key, []).append((index, region))
+            crops.setdefault(key, []).append(crop_region(image, region.box))
+
+    values: Dict[int, Dict[FieldRegion, Optional[str]]] = {}
+    region_confidences: Dict[int, List[float]] = {}
+    for key, regions in groups.items():
+        for (index, region), text, confidence in zip(regions, *ocr_images_scored(crops[key], key)):
+            values.setdefault(index, {})[region] = region_value(region, text)
+            if confidence is not None:
+                region_confidences.setdefault(index, []).append(confidence)
+
+    texts: List[Optional[str]] = []
+    for index, template in enumerate(templates):
+        if template is None:
+            texts.append(None)
+            continue
+        found = values.get(index, {})
+        if any(region.required and not found.get(region) for region in template.fields):
+            logger.info(f"Plantilla {template.name}: faltan campos obligatorios en la página, OCR completo")
+            texts.append(None)
+            continue
+        texts.append(template_text(template, found))
+
+    confidences: List[Optional[float]] = [
+        round(sum(region_confidences[index]) / len(region_confidences[index]), 1)
+        if text is not None and region_confidences.get(index) else None
+        for index, text in enumerate(texts)
+    ]
+    pending = [index for index, text in enumerate(texts) if text is None]
+    if pending:
+        for index, text, confidence in zip(pending, *ocr_images_scored([images[index] for index in pending], config)):
+            texts[index] = text
+            confidences[index] = confidence
+    return texts, confidences
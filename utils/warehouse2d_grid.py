@@ -0,0 +1,459 @@
+# utils/warehouse2d_grid.py - Rejilla NumPy en memoria del mapa 2D (zona × fila × columna)
+#
+# El layout ya parseado es una rejilla densa; cargarlo una vez en arreglos NumPy
+# permite responder mapas de calor, resúmenes por zona y consultas de vecindad
+# sin volver a la base en cada interacción.
+import bisect
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Código numérico de cada estado en la rejilla (-1 = celda sin ubicación)
+STATUS_NAMES = ('vacio', 'critico', 'bajo', 'normal')
+NO_LOCATION = -1
+
+# Estados que aceptan material nuevo al sugerir ubicaciones
+PUTAWAY_STATUSES = ('vacio', 'bajo')
+
+# Límite de celdas para no reservar rejillas gigantes con códigos de ubicación raros
+MAX_GRID_CELLS = 5_000_000
+
+
+def parse_location_code(location_code):
+    """Parsear código de ubicación en zona, fila y columna (formatos A-01-02 y A0102)"""
+    if not location_code:
+        return 'A', 1, 1
+
+    try:
+        location_str = str(location_code).strip()
+
+        # Diferentes formatos soportados
+        if '-' in location_str:
+            parts = location_str.split('-')
+            zone = parts[0] if len(parts) > 0 else 'A'
+
+            # Extraer números de fila
+            row_num = 1
+            if len(parts) > 1:
+                row_part = parts[1]
+                numbers = ''.join(filter(str.isdigit, row_part))
+                row_num = int(numbers) if numbers else 1
+
+            # Extraer números de columna
+            col_num = 1
+            if len(parts) > 2:
+                col_part = parts[2]
+                numbers = ''.join(filter(str.isdigit, col_part))
+                col_num = int(numbers) if numbers else 1
+
+            return zone, row_num, col_num
+
+        elif location_str.isalnum():
+            # Formato A0101
+            zone = location_str[0] if location_str[0].isalpha() else 'A'
+            numbers = ''.join(filter(str.isdigit, location_str))
+
+            if len(numbers) >= 2:
+                row_num = int(numbers[:2])
+                col_num = int(numbers[2:4]) if len(numbers) >= 4 else 1
+            else:
+                row_num = 1
+                col_num = 1
+
+            return zone, row_num, col_num
+
+        else:
+            return 'A', 1, 1
+
+    except Exception:
+        return 'A', 1, 1
+
+
+def classify_status(quantity, ocupation):
+    """Código de estado (índice en STATUS_NAMES) según cantidad y % de ocupación"""
+    quantity = np.asarray(quantity, dtype=float)
+    ocupation = np.asarray(ocupation, dtype=float)
+    return np.select(
+        [quantity <= 0, ocupation < 20, ocupation < 50],
+        [0, 1, 2],
+        default=3
+    ).astype(np.int8)
+
+
+def fit_grid_bounds(zones: int, rows: np.ndarray, cols: np.ndarray):
+    """Mayor fila y columna con las que la rejilla entra en MAX_GRID_CELLS.
+
+    Un código fuera de serie (A-99999-1) estira todo el eje: se baja, de a un valor
+    distinto por vez, el eje que más reduce la rejilla hasta que entra.
+    """
+    row_values = np.unique(rows)
+    col_values = np.unique(cols)
+    ri, ci = len(row_values) - 1, len(col_values) - 1
+    while zones * int(row_values[ri]) * int(col_values[ci]) > MAX_GRID_CELLS:
+        if ri == 0 and ci == 0:
+            raise ValueError(f'El layout tiene demasiadas zonas para la rejilla en memoria ({zones})')
+        by_row = int(row_values[ri - 1]) * int(col_values[ci]) if ri else float('inf')
+        by_col = int(row_values[ri]) * int(col_values[ci - 1]) if ci else float('inf')
+        if by_row <= by_col:
+            ri -= 1
+        else:
+            ci -= 1
+    return int(row_values[ri]), int(col_values[ci])
+
+
+class LayoutGrid:
+    """Arreglos densos de un layout: ocupación, estado, capacidad, cantidad y material.
+
+    Todas las matrices tienen forma (zonas, max_fila, max_columna); fila y columna
+    se guardan con base 1 en las consultas y base 0 en los índices.
+    Si varias filas del archivo caen en la misma ubicación se suman cantidad y
+    capacidad, y el material de la celda es el primero que aparece.
+    Las ubicaciones que harían superar MAX_GRID_CELLS quedan fuera y se listan en omitted.
+    """
+
+    def __init__(self, zones: List[str], shape, codes, occupancy, status,
+                 capacity, quantity, material, materials: List[str], records,
+                 material_cells=None, material_offsets=None, omitted: Optional[List[str]] = None,
+                 material_quantity=None):
+        self.zones = zones
+        self.zone_index = {zone: i for i, zone in enumerate(zones)}
+        self.shape = shape
+        self.codes = codes
+        self.occupancy = occupancy
+        self.status = status
+        self.capacity = capacity
+        self.quantity = quantity
+        self.material = material
+        self.materials = materials
+        self.records = records
+        # Celdas (índice plano) de cada material: material_cells[offsets[i]:offsets[i + 1]]
+        self.material_cells = material_cells if material_cells is not None else np.empty(0, dtype=np.int64)
+        self.material_offsets = (material_offsets if material_offsets is not None
+                                 else np.zeros(len(materials) + 1, dtype=np.int64))
+        # Cantidad del propio material en cada una de esas celdas (alineada con material_cells)
+        self.material_quantity = (material_quantity if material_quantity is not None
+                                  else np.zeros(len(self.material_cells), dtype=np.float32))
+        self.omitted = omitted or []
+        self.built_at = time.time()
+        self._slot_index: Optional['SlotIndex'] = None
+        self._route_model = None
+
+    @classmethod
+    def from_locations(cls, locations: Iterable[Dict[str, Any]]) -> 'LayoutGrid':
+        """Construir la rejilla a partir de filas de warehouse_locations"""
+        codes_list, zones_list, rows_list, cols_list = [], [], [], []
+        materials_list, quantity_list, capacity_list = [], [], []
+        for row in locations:
+            codes_list.append(row['location_code'])
+            zones_list.append(row['zone'] or '')
+            rows_list.append(row['row_num'] or 1)
+            cols_list.append(row['col_num'] or 1)
+            materials_list.append(row['material_code'] or '')
+            quantity_list.append(row['quantity'] or 0.0)
+            capacity_list.append(row['capacity'] or 0.0)
+
+        zones = sorted(set(zones_list))
+        rows = np.maximum(np.asarray(rows_list, dtype=np.int64), 1)
+        cols = np.maximum(np.asarray(cols_list, dtype=np.int64), 1)
+        shape = (len(zones), int(rows.max()) if len(rows) else 0, int(cols.max()) if len(cols) else 0)
+
+        omitted = []
+        if shape[0] * shape[1] * shape[2] > MAX_GRID_CELLS:
+            max_row, max_col = fit_grid_bounds(len(zones), rows, cols)
+            keep = (rows <= max_row) & (cols <= max_col)
+            omitted = [codes_list[i] for i in np.nonzero(~keep)[0].tolist()]
+            logger.warning(f"Rejilla {shape} supera {MAX_GRID_CELLS} celdas: se omiten {len(omitted)} "
+                           f"ubicaciones fuera de fila {max_row} / columna {max_col} ({omitted[:5]})")
+
+            kept = np.nonzero(keep)[0].tolist()
+            codes_list = [codes_list[i] for i in kept]
+            zones_list = [zones_list[i] for i in kept]
+            materials_list = [materials_list[i] for i in kept]
+            quantity_list = [quantity_list[i] for i in kept]
+            capacity_list = [capacity_list[i] for i in kept]
+            rows, cols = rows[keep], cols[keep]
+            zones = sorted(set(zones_list))
+            shape = (len(zones), int(rows.max()) if len(rows) else 0, int(cols.max()) if len(cols) else 0)
+
+        zone_index = {zone: i for i, zone in enumerate(zones)}
+        z = np.fromiter((zone_index[zone] for zone in zones_list), dtype=np.int64, count=len(zones_list))
+        r = rows - 1
+        c = cols - 1
+        flat = np.ravel_multi_index((z, r, c), shape) if len(z) else np.empty(0, dtype=np.int64)
+
+        cells = int(np.prod(shape))
+        quantity = np.bincount(flat, weights=np.asarray(quantity_list, dtype=float), minlength=cells)
+        capacity = np.bincount(flat, weights=np.asarray(capacity_list, dtype=float), minlength=cells)
+        records = np.bincount(flat, minlength=cells).astype(np.int32)
+        occupied = records > 0
+
+        occupancy = np.full(cells, np.nan, dtype=np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            occupancy[occupied] = np.where(
+                capacity[occupied] > 0, quantity[occupied] / capacity[occupied] * 100, 0.0
+            )
+
+        status = np.full(cells, NO_LOCATION, dtype=np.int8)
+        status[occupied] = classify_status(quantity[occupied], occupancy[occupied])
+
+        # Primer código de ubicación y primer material de cada celda
+        _, first = np.unique(flat, return_index=True)
+        first_flat = flat[first]
+        codes = np.full(cells, None, dtype=object)
+        codes[first_flat] = np.asarray(codes_list, dtype=object)[first]
+
+        materials, material_idx = np.unique(np.asarray(materials_list, dtype=object).astype(str), return_inverse=True)
+        material = np.full(cells, -1, dtype=np.int32)
+        material[first_flat] = material_idx[first]
+
+        # Todas las celdas donde está cada material (sin repetir), agrupadas por material
+        order = np.lexsort((flat, material_idx))
+        sorted_materials = material_idx[order]
+        sorted_cells = flat[order]
+        distinct = np.ones(len(order), dtype=bool)
+        distinct[1:] = (np.diff(sorted_materials) != 0) | (np.diff(sorted_cells) != 0)
+        material_offsets = np.searchsorted(sorted_materials[distinct], np.arange(len(materials) + 1))
+        sorted_quantity = np.asarray(quantity_list, dtype=float)[order]
+        material_quantity = (np.add.reduceat(sorted_quantity, np.nonzero(distinct)[0]) if len(order)
+                             else np.empty(0, dtype=float))
+
+        return cls(
+            zones, shape,
+            codes.reshape(shape),
+            occupancy.reshape(shape),
+            status.reshape(shape),
+            capacity.astype(np.float32).reshape(shape),
+            quantity.astype(np.float32).reshape(shape),
+            material.reshape(shape),
+            materials.tolist(),
+            records.reshape(shape),
+            sorted_cells[distinct],
+            material_offsets,
+            omitted,
+            material_quantity.astype(np.float32),
+        )
+
+    # ================= CONSULTAS =================
+
+    @property
+    def cells(self) -> int:
+        return int(np.prod(self.shape))
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.codes, self.occupancy, self.status, self.capacity, self.quantity,
+                  self.material, self.records, self.material_cells, self.material_offsets,
+                  self.material_quantity)
+        return int(sum(a.nbytes for a in arrays))
+
+    def zone_heatmap(self, zone: str) -> Dict[str, Any]:
+        """Matrices fila × columna de una zona (None donde no hay ubicación)"""
+        z = self.zone_index[zone]
+        occupancy = np.round(self.occupancy[z].astype(float), 2)
+        return {
+            'zone': zone,
+            'rows': self.shape[1],
+            'cols': self.shape[2],
+            'occupancy': [[None if np.isnan(v) else v for v in row] for row in occupancy.tolist()],
+            'status': self.status[z].tolist(),
+            'status_names': list(STATUS_NAMES),
+        }
+
+    def zone_summary(self, zone: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Resumen por zona calculado sobre la rejilla"""
+        zones = [zone] if zone else self.zones
+        summary = []
+        for name in zones:
+            z = self.zone_index[name]
+            status = self.status[z]
+            occupied = status != NO_LOCATION
+            counts = np.bincount(status[occupied], minlength=len(STATUS_NAMES))
+            capacity = float(self.capacity[z][occupied].sum())
+            quantity = float(self.quantity[z][occupied].sum())
+            summary.append({
+                'zone': name,
+                'locations': int(occupied.sum()),
+                'status_counts': dict(zip(STATUS_NAMES, counts.tolist())),
+                'avg_ocupation': round(float(np.nanmean(self.occupancy[z])), 2) if occupied.any() else 0.0,
+                'total_quantity': quantity,
+                'total_capacity': capacity,
+                'free_capacity': float(np.clip(self.capacity[z] - self.quantity[z], 0, None)[occupied].sum()),
+            })
+        return summary
+
+    def cell(self, z: int, r: int, c: int) -> Dict[str, Any]:
+        material = int(self.material[z, r, c])
+        occupancy = self.occupancy[z, r, c]
+        return {
+            'code': self.codes[z, r, c],
+            'zone': self.zones[z],
+            'row': r + 1,
+            'col': c + 1,
+            'material': self.materials[material] if material >= 0 else None,
+            'quantity': float(self.quantity[z, r, c]),
+            'capacity': float(self.capacity[z, r, c]),
+            'ocupation_percent': None if np.isnan(occupancy) else round(float(occupancy), 2),
+            'status': STATUS_NAMES[self.status[z, r, c]] if self.status[z, r, c] != NO_LOCATION else None,
+        }
+
+    def neighborhood(self, zone: str, row: int, col: int, radius: int = 1) -> List[Dict[str, Any]]:
+        """Ubicaciones dentro de un radio (distancia de Chebyshev) en la misma zona"""
+        z = self.zone_index[zone]
+        r0, r1 = max(row - 1 - radius, 0), min(row + radius, self.shape[1])
+        c0, c1 = max(col - 1 - radius, 0), min(col + radius, self.shape[2])
+        window = self.status[z, r0:r1, c0:c1]
+        rs, cs = np.nonzero(window != NO_LOCATION)
+        return [self.cell(z, r0 + r, c0 + c) for r, c in zip(rs.tolist(), cs.tolist())]
+
+    def material_locations(self, material_code: str) -> np.ndarray:
+        """Índices planos de las celdas donde está el material (vacío si no existe)"""
+        return self.material_stock(material_code)[0]
+
+    def material_stock(self, material_code: str):
+        """(celdas, cantidad del material en cada celda); la celda puede tener otros materiales"""
+        i = bisect.bisect_left(self.materials, material_code)
+        if i == len(self.materials) or self.materials[i] != material_code:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        window = slice(self.material_offsets[i], self.material_offsets[i + 1])
+        return self.material_cells[window], self.material_quantity[window]
+
+    @property
+    def route_model(self):
+        """Modelo de distancias para rutas de picking, cacheado junto a la rejilla"""
+        if self._route_model is None:
+            from utils.warehouse2d_route import RouteModel
+            self._route_model = RouteModel(self)
+        return self._route_model
+
+    @property
+    def slot_index(self) -> 'SlotIndex':
+        """Índice de ubicaciones libres; se arma una vez y vive junto a la rejilla en el cache"""
+        if self._slot_index is None:
+            self._slot_index = SlotIndex(self)
+        return self._slot_index
+
+
+class SlotIndex:
+    """Coordenadas y capacidad libre de las ubicaciones vacías o con ocupación baja.
+
+    Las consultas son un recorrido vectorizado sobre estos arreglos compactos
+    (sin volver a la rejilla completa), seguido de argpartition para los k mejores.
+    La distancia es Manhattan en fila/columna; cambiar de zona suma una penalización
+    mayor que cualquier distancia dentro de una zona, así primero se agotan los
+    huecos de la zona de referencia.
+    """
+
+    def __init__(self, grid: LayoutGrid):
+        codes = [STATUS_NAMES.index(name) for name in PUTAWAY_STATUSES]
+        z, r, c = np.nonzero(np.isin(grid.status, codes))
+        self.grid = grid
+        self.z = z.astype(np.int32)
+        self.r = r.astype(np.int32)
+        self.c = c.astype(np.int32)
+        self.free = np.clip(grid.capacity[z, r, c] - grid.quantity[z, r, c], 0, None)
+        self.zone_penalty = int(grid.shape[1] + grid.shape[2])
+
+    def __len__(self):
+        return len(self.z)
+
+    def nearest(self, zone: str, row: int, col: int, required: float = 0.0,
+                k: int = 5, same_zone: bool = False) -> List[Dict[str, Any]]:
+        """Las k ubicaciones libres más cercanas con al menos `required` de capacidad libre"""
+        zi = self.grid.zone_index[zone]
+        mask = self.free >= required
+        if same_zone:
+            mask &= self.z == zi
+        candidates = np.nonzero(mask)[0]
+        if not len(candidates):
+            return []
+
+        distance = (np.abs(self.r[candidates] - (row - 1)) + np.abs(self.c[candidates] - (col - 1))
+                    + np.abs(self.z[candidates] - zi) * self.zone_penalty)
+        k = min(k, len(candidates))
+        best = np.argpartition(distance, k - 1)[:k]
+        best = best[np.lexsort((self.free[candidates[best]] * -1, distance[best]))]
+
+        results = []
+        for i in best.tolist():
+            slot = candidates[i]
+            cell = self.grid.cell(int(self.z[slot]), int(self.r[slot]), int(self.c[slot]))
+            cell['free_capacity'] = round(float(self.free[slot]), 2)
+            cell['distance'] = int(abs(self.r[slot] - (row - 1)) + abs(self.c[slot] - (col - 1)))
+            cell['same_zone'] = bool(self.z[slot] == zi)
+            results.append(cell)
+        return results
+
+
+class GridCache:
+    """Cache LRU de rejillas por clave (layout), seguro entre hilos.
+
+    Se acota por cantidad de entradas y por memoria (nbytes de cada entrada): una
+    rejilla grande desplaza a varias chicas y una que sola supera max_bytes no se guarda.
+    Las entradas del mapa en vivo crecen al armar su rejilla, por eso el tamaño se
+    vuelve a medir en cada inserción.
+    """
+
+    def __init__(self, max_entries: int = 16, max_bytes: Optional[int] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._grids: 'OrderedDict[Hashable, LayoutGrid]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, builder: Callable[[], LayoutGrid]) -> LayoutGrid:
+        """Devolver la rejilla en cache o construirla con builder()"""
+        with self._lock:
+            grid = self._grids.get(key)
+            if grid is not None:
+                self._grids.move_to_end(key)
+                self.hits += 1
+                return grid
+            self.misses += 1
+
+        # Construir fuera del lock para no bloquear otras consultas
+        started = time.monotonic()
+        grid = builder()
+        logger.debug(f"Rejilla {key} construida en {time.monotonic() - started:.3f}s ({grid.nbytes} bytes)")
+
+        with self._lock:
+            self._grids[key] = grid
+            self._grids.move_to_end(key)
+            while len(self._grids) > self.max_entries:
+                self._grids.popitem(last=False)
+            if self.max_bytes is not None:
+                self._trim_bytes()
+        return grid
+
+    def _trim_bytes(self):
+        """Sacar las entradas menos usadas hasta entrar en max_bytes (con el lock tomado)"""
+        total = sum(grid.nbytes for grid in self._grids.values())
+        while self._grids and total > self.max_bytes:
+            key, grid = self._grids.popitem(last=False)
+            total -= grid.nbytes
+            logger.debug(f"Rejilla {key} fuera del cache por memoria ({grid.nbytes} bytes)")
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._grids.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._grids.clear()
+
+    def info(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'entries': len(self._grids),
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': sum(grid.nbytes for grid in self._grids.values()),
+            }
@@ -0,0 +1,130 @@
+# utils/warehouse2d_heatmap.py - Mapa de calor PNG del layout 2D, renderizado en el servidor
+#
+# Cada celda de la rejilla se pinta con el color de su estado (los mismos colores
+# de templates/warehouse2d/map.html) y el PNG se guarda en disco por
+# (hash del archivo, zona, escala), así las pantallas de resumen descargan una
+# sola imagen pequeña en lugar de dibujar miles de celdas en el navegador.
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from io import BytesIO
+from typing import Callable, Optional
+
+import numpy as np
+from PIL import Image
+
+from utils.warehouse2d_grid import NO_LOCATION, STATUS_NAMES, LayoutGrid
+
+logger = logging.getLogger(__name__)
+
+STATUS_COLORS = {
+    'vacio': (108, 117, 125),
+    'critico': (220, 53, 69),
+    'bajo': (255, 193, 7),
+    'normal': (40, 167, 69),
+}
+BACKGROUND_COLOR = (248, 249, 250)
+GAP_COLOR = (255, 255, 255)
+
+# Índices de la paleta: 0 fondo, 1 separador, 2.. estados en el orden de STATUS_NAMES
+_BACKGROUND = 0
+_GAP = 1
+_PALETTE = [BACKGROUND_COLOR, GAP_COLOR] + [STATUS_COLORS[name] for name in STATUS_NAMES]
+
+MIN_SCALE = 1
+MAX_SCALE = 40
+# Tamaño máximo de la imagen para no generar PNG gigantes con escalas altas
+MAX_PIXELS = 16_000_000
+
+# Parte de la clave del PNG sin zona (todas las zonas); las zonas se guardan como hash
+# hexadecimal, así ningún nombre de zona puede producirla
+ALL_ZONES_KEY = 'all-zones'
+
+
+def _zone_indices(grid: LayoutGrid, z: int) -> np.ndarray:
+    """Matriz fila × columna de índices de paleta de una zona"""
+    status = grid.status[z]
+    return np.where(status == NO_LOCATION, _BACKGROUND, status.astype(np.int16) + 2).astype(np.uint8)
+
+
+def render_heatmap(grid: LayoutGrid, zone: Optional[str] = None, scale: int = 8) -> bytes:
+    """PNG de una zona o, sin zona, de todas las zonas lado a lado"""
+    if zone:
+        cells = _zone_indices(grid, grid.zone_index[zone])
+    elif grid.zones:
+        # Una columna de separación entre zonas
+        separator = np.full((grid.shape[1], 1), _GAP, dtype=np.uint8)
+        parts = []
+        for z in range(len(grid.zones)):
+            if parts:
+                parts.append(separator)
+            parts.append(_zone_indices(grid, z))
+        cells = np.hstack(parts)
+    else:
+        cells = np.full((1, 1), _BACKGROUND, dtype=np.uint8)
+
+    if cells.size * scale * scale > MAX_PIXELS:
+        scale = max(MIN_SCALE, int((MAX_PIXELS / cells.size) ** 0.5))
+
+    pixels = np.repeat(np.repeat(cells, scale, axis=0), scale, axis=1)
+    if scale >= 4:
+        # Línea de un píxel entre celdas para que se distingan las ubicaciones
+        pixels[scale - 1::scale, :] = _GAP
+        pixels[:, scale - 1::scale] = _GAP
+
+    image = Image.fromarray(pixels, mode='P')
+    image.putpalette([channel for color in _PALETTE for channel in color])
+
+    output = BytesIO()
+    image.save(output, format='PNG', optimize=True)
+    return output.getvalue()
+
+
+class HeatmapDiskCache:
+    """PNG renderizados en disco, direccionados por contenido (hash, zona, escala)"""
+
+    def __init__(self, directory: str, max_files: int = 500):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def make_key(file_hash: str, zone: Optional[str], scale: int) -> str:
+        # Hash y no el nombre saneado: "A.1", "A 1" y "A_1" son zonas distintas
+        zone_key = hashlib.md5(zone.encode('utf-8')).hexdigest()[:12] if zone else ALL_ZONES_KEY
+        return f'{file_hash}_{zone_key}_{scale}'
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, f'{key}.png')
+
+    def get_or_render(self, key: str, render: Callable[[], bytes]) -> str:
+        """Ruta del PNG en disco; se renderiza solo si todavía no existe"""
+        path = self.path(key)
+        if os.path.exists(path):
+            return path
+
+        data = render()
+        # Escritura atómica: otro proceso nunca ve un PNG a medio escribir
+        tmp_path = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        self._prune()
+        return path
+
+    def _prune(self):
+        """Borrar los PNG más antiguos cuando se supera max_files"""
+        with self._lock:
+            try:
+                entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.png')]
+                if len(entries) <= self.max_files:
+                    return
+                entries.sort(key=lambda entry: entry.stat().st_mtime)
+                for entry in entries[:len(entries) - self.max_files]:
+                    os.remove(entry.path)
+            except OSError as e:
+                logger.warning(f"No se pudo limpiar el cache de mapas de calor: {e}")
@@ -0,0 +1,133 @@
+# utils/warehouse2d_janitor.py - Limpieza en segundo plano del almacenamiento del mapa 2D
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class WarehouseJanitor:
+    """Expira sesiones y layouts del mapa 2D en lotes pequeños, fuera de las peticiones.
+
+    Cada ciclo tiene un presupuesto de tiempo; lo que no alcanza a borrar queda
+    para el siguiente ciclo, así ninguna transacción bloquea la base por mucho tiempo.
+    """
+
+    def __init__(self, storage, interval: int = 300, batch_size: int = 2000,
+                 time_budget: float = 0.5, compact_every: int = 12, orphan_batch: int = 20):
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.time_budget = time_budget
+        self.compact_every = compact_every
+        self.orphan_batch = orphan_batch
+
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._cycles = 0
+        self.last_run: Dict[str, Any] = {}
+
+    # ================= CICLO DE VIDA =================
+
+    def start(self):
+        """Iniciar el hilo de limpieza (una sola vez por proceso)"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._loop, name='warehouse2d-janitor', daemon=True)
+        self._thread.start()
+        logger.info(f"Janitor warehouse2d iniciado (cada {self.interval}s)")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def wake(self):
+        """Pedir un ciclo inmediato sin esperar el intervalo"""
+        self._wake.set()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._thread and self._thread.is_alive())
+
+    def _loop(self):
+        try:
+            self.storage.prepare()
+        except Exception as e:
+            logger.error(f"Error preparando el almacenamiento warehouse2d: {e}")
+
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Error en janitor warehouse2d: {e}")
+
+    # ================= CICLO DE LIMPIEZA =================
+
+    def run_once(self) -> Dict[str, Any]:
+        """Ejecutar un ciclo de limpieza acotado por self.time_budget"""
+        started = time.monotonic()
+        deadline = started + self.time_budget
+        self._cycles += 1
+
+        result = {
+            'expired_sessions': self._expire_sessions(deadline),
+            'deleted_locations': self._purge_layouts(deadline),
+            'orphan_rows': self._sweep_orphans(deadline),
+            'compacted': False,
+        }
+        if self._cycles % self.compact_every == 0:
+            self.storage.compact()
+            result['compacted'] = True
+
+        result['seconds'] = round(time.monotonic() - started, 3)
+        result['finished_at'] = datetime.now().isoformat()
+        self.last_run = result
+        return result
+
+    def _expire_sessions(self, deadline) -> int:
+        """Eliminar sesiones vencidas y liberar su referencia al layout"""
+        expired = 0
+        while time.monotonic() < deadline:
+            count = self.storage.expire_sessions(self.batch_size)
+            expired += count
+            if count < self.batch_size:
+                break
+        return expired
+
+    def _purge_layouts(self, deadline) -> int:
+        """Borrar por lotes las ubicaciones de layouts sin referencias"""
+        deleted = 0
+        for layout_id in self.storage.mark_unreferenced_layouts():
+            removed, finished = self._delete_layout_rows(layout_id, deadline)
+            deleted += removed
+            if not finished:
+                break
+            self.storage.drop_layout(layout_id)
+        return deleted
+
+    def _delete_layout_rows(self, layout_id, deadline):
+        """Borrar las ubicaciones de un layout por lotes; devuelve (filas borradas, terminó)"""
+        deleted = 0
+        while time.monotonic() < deadline:
+            count = self.storage.delete_layout_rows(layout_id, self.batch_size)
+            deleted += count
+            if count < self.batch_size:
+                return deleted, True
+        return deleted, False
+
+    def _sweep_orphans(self, deadline) -> int:
+        """Eliminar filas que apuntan a layouts o sesiones inexistentes"""
+        swept = self.storage.sweep_orphan_metadata()
+        for layout_id in self.storage.orphan_location_layouts(self.orphan_batch):
+            removed, finished = self._delete_layout_rows(layout_id, deadline)
+            swept += removed
+            if not finished:
+                break
+        return swept
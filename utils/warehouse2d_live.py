@@ -0,0 +1,297 @@
+# utils/warehouse2d_live.py - Mapa 2D en vivo desde las tablas de inventario
+#
+# En lugar de subir un Excel aparte, el modo "live" arma las filas del layout con una
+# sola consulta agregada sobre warehouse_locations (stock, stock máximo) e inventory
+# (stock contado por el usuario). La ubicación ya viene parseada en las columnas
+# zone/row_num/col_num, que los modelos llenan al guardar.
+#
+# El resultado se cachea por versión: cada commit que toca esas tablas sube la versión
+# en este proceso, y el TTL acota lo que puede tardar en verse un cambio hecho desde
+# otro proceso o directamente en la base.
+import heapq
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import bindparam, case, event, func, inspect, literal, select, union_all, update
+from sqlalchemy.orm import Session
+
+from utils.warehouse2d_grid import STATUS_NAMES, LayoutGrid, classify_status, parse_location_code
+
+logger = logging.getLogger(__name__)
+
+COORDINATE_COLUMNS = ('zone', 'row_num', 'col_num')
+BACKFILL_BATCH = 1000
+DEFAULT_CAPACITY = 100.0
+
+# Mismas columnas y campos de búsqueda que storage.search_locations()
+SEARCH_COLUMNS = ('location_code', 'zone', 'row_num', 'col_num', 'material_code',
+                  'material_desc', 'quantity', 'capacity', 'ocupation_percent', 'status')
+SEARCH_FIELDS = ('location_code', 'zone', 'material_code', 'material_desc')
+
+_version = 0
+_version_lock = threading.Lock()
+_listeners_registered = False
+
+
+def _live_tables():
+    """(modelo, columna de ubicación) de las tablas que alimentan el mapa en vivo"""
+    from models.inventory import InventoryItem
+    from models.warehouse2d import WarehouseLocation
+    return ((WarehouseLocation, 'ubicacion'), (InventoryItem, 'location'))
+
+
+# ================= VERSIÓN E INVALIDACIÓN =================
+
+def current_version() -> int:
+    return _version
+
+
+def bump_version():
+    global _version
+    with _version_lock:
+        _version += 1
+
+
+def live_cache_key(user_id: int, ttl: int) -> Tuple[Any, ...]:
+    """Clave del mapa en vivo: usuario, versión local y ventana de TTL"""
+    window = int(time.time() // ttl) if ttl > 0 else 0
+    return ('live', user_id, current_version(), window)
+
+
+def _flushed_objects(session):
+    """Objetos nuevos, modificados y borrados del flush en curso"""
+    yield from session.new
+    yield from session.dirty
+    yield from session.deleted
+
+
+def register_live_invalidation():
+    """Subir la versión cuando se confirma un cambio en inventory o warehouse_locations.
+
+    after_flush cubre altas/bajas/cambios de objetos; do_orm_execute cubre los
+    query.delete()/update() masivos (como la recarga de inventario).
+    """
+    global _listeners_registered
+    if _listeners_registered:
+        return
+    _listeners_registered = True
+
+    models = tuple(model for model, _ in _live_tables())
+
+    def mark_dirty(session, flush_context):
+        for obj in _flushed_objects(session):
+            if isinstance(obj, models):
+                session.info['warehouse2d_live_dirty'] = True
+                return
+
+    def mark_bulk(orm_execute_state):
+        if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+            return
+        mapper = orm_execute_state.bind_mapper
+        if mapper is not None and issubclass(mapper.class_, models):
+            orm_execute_state.session.info['warehouse2d_live_dirty'] = True
+
+    def after_commit(session):
+        if session.info.pop('warehouse2d_live_dirty', False):
+            bump_version()
+
+    def after_rollback(session):
+        session.info.pop('warehouse2d_live_dirty', None)
+
+    event.listen(Session, 'after_flush', mark_dirty)
+    event.listen(Session, 'do_orm_execute', mark_bulk)
+    event.listen(Session, 'after_commit', after_commit)
+    event.listen(Session, 'after_rollback', after_rollback)
+
+
+# ================= COLUMNAS DE COORDENADAS =================
+
+def ensure_coordinate_columns(engine) -> Dict[str, int]:
+    """Agregar zone/row_num/col_num e índices a tablas ya existentes y completar filas viejas.
+
+    La app no usa migraciones (db.create_all() no altera tablas existentes), así que
+    las bases anteriores a estas columnas se actualizan aquí al arrancar.
+    """
+    inspector = inspect(engine)
+    backfilled = {}
+    for model, location_column in _live_tables():
+        table = model.__table__
+        if not inspector.has_table(table.name):
+            continue
+
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        with engine.begin() as conn:
+            for name in COORDINATE_COLUMNS:
+                if name not in existing:
+                    column_type = table.c[name].type.compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {name} {column_type}')
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+
+        backfilled[table.name] = _backfill_coordinates(engine, table, table.c[location_column])
+    return backfilled
+
+
+def _backfill_coordinates(engine, table, location) -> int:
+    """Parsear cada ubicación distinta sin coordenadas una vez y actualizar en lotes"""
+    with engine.connect() as conn:
+        codes = conn.execute(select(location).where(table.c.zone.is_(None)).distinct()).scalars().all()
+    if not codes:
+        return 0
+
+    statement = (
+        update(table)
+        .where(location == bindparam('b_code'), table.c.zone.is_(None))
+        .values(zone=bindparam('b_zone'), row_num=bindparam('b_row'), col_num=bindparam('b_col'))
+    )
+    params = []
+    for code in codes:
+        zone, row_num, col_num = parse_location_code(code)
+        params.append({'b_code': code, 'b_zone': zone, 'b_row': row_num, 'b_col': col_num})
+
+    with engine.begin() as conn:
+        for start in range(0, len(params), BACKFILL_BATCH):
+            conn.execute(statement, params[start:start + BACKFILL_BATCH])
+    logger.info(f"Coordenadas del mapa 2D completadas en {table.name}: {len(codes)} ubicaciones")
+    return len(codes)
+
+
+# ================= CONSULTA EN VIVO =================
+
+def live_locations_query(user_id: int):
+    """Una fila por (ubicación, material) con cantidad y capacidad agregadas.
+
+    La cantidad es la contada por el usuario en inventory cuando existe; si no, la
+    libre utilización de warehouse_locations. La capacidad es el stock máximo.
+    """
+    from models.inventory import InventoryItem
+    from models.warehouse2d import WarehouseLocation
+    master = WarehouseLocation.__table__
+    counted = InventoryItem.__table__
+
+    rows = union_all(
+        select(
+            master.c.zone, master.c.row_num, master.c.col_num,
+            master.c.ubicacion.label('location_code'),
+            func.coalesce(master.c.material_code, '').label('material_code'),
+            func.coalesce(master.c.material_text, master.c.descripcion).label('material_desc'),
+            master.c.base_unit.label('unit'),
+            literal(0).label('counted'),
+            literal(0.0).label('counted_quantity'),
+            master.c.libre_utilizacion.label('master_quantity'),
+            master.c.stock_maximo.label('capacity'),
+        ),
+        select(
+            counted.c.zone, counted.c.row_num, counted.c.col_num,
+            counted.c.location.label('location_code'),
+            counted.c.material_code,
+            counted.c.material_text.label('material_desc'),
+            counted.c.base_unit.label('unit'),
+            literal(1).label('counted'),
+            counted.c.libre_utilizacion.label('counted_quantity'),
+            literal(0.0).label('master_quantity'),
+            literal(0.0).label('capacity'),
+        ).where(counted.c.user_id == user_id),
+    ).subquery('live_rows')
+
+    zone = func.max(rows.c.zone).label('zone')
+    row_num = func.max(rows.c.row_num).label('row_num')
+    col_num = func.max(rows.c.col_num).label('col_num')
+    quantity = case(
+        (func.sum(rows.c.counted) > 0, func.sum(rows.c.counted_quantity)),
+        else_=func.sum(rows.c.master_quantity),
+    ).label('quantity')
+
+    return (
+        select(
+            rows.c.location_code, zone, row_num, col_num, rows.c.material_code,
+            func.max(rows.c.material_desc).label('material_desc'),
+            func.max(rows.c.unit).label('unit'),
+            quantity,
+            func.sum(rows.c.capacity).label('capacity'),
+        )
+        .group_by(rows.c.location_code, rows.c.material_code)
+        .order_by(zone, row_num, col_num, rows.c.location_code)
+    )
+
+
+def load_live_locations(engine, user_id: int) -> List[Dict[str, Any]]:
+    """Filas del mapa en vivo con el mismo formato que warehouse2d_locations"""
+    with engine.connect() as conn:
+        rows = conn.execute(live_locations_query(user_id)).all()
+    if not rows:
+        return []
+
+    quantity = np.array([row.quantity or 0.0 for row in rows], dtype=float)
+    capacity = np.array([row.capacity or 0.0 for row in rows], dtype=float)
+    capacity = np.where(capacity > 0, capacity, DEFAULT_CAPACITY)
+    ocupation = quantity / capacity * 100
+    status = np.array(STATUS_NAMES)[classify_status(quantity, ocupation)]
+
+    locations = []
+    for i, row in enumerate(rows):
+        zone, row_num, col_num = row.zone, row.row_num, row.col_num
+        if zone is None:
+            # Fila escrita fuera del ORM (sin coordenadas todavía)
+            zone, row_num, col_num = parse_location_code(row.location_code)
+        material = row.material_code or ''
+        locations.append({
+            'location_code': row.location_code,
+            'zone': zone,
+            'row_num': int(row_num or 1),
+            'col_num': int(col_num or 1),
+            'material_code': material,
+            'material_desc': (row.material_desc or material)[:200],
+            'quantity': float(quantity[i]),
+            'capacity': float(capacity[i]),
+            'unit': row.unit or 'UN',
+            'ocupation_percent': round(float(ocupation[i]), 2),
+            'status': str(status[i]),
+        })
+    return locations
+
+
+class LiveMap:
+    """Filas, estadísticas y rejilla de un mapa en vivo (una entrada del GridCache)"""
+
+    def __init__(self, key: Tuple[Any, ...], locations: List[Dict[str, Any]], stats: List[Dict[str, Any]]):
+        self.key = key
+        self.locations = locations
+        self.stats = stats
+        self.built_at = time.time()
+        self._grid: Optional[LayoutGrid] = None
+        self._grid_lock = threading.Lock()
+
+    @property
+    def revision(self) -> str:
+        """Identificador del contenido para claves de cache y ETag"""
+        return '-'.join(str(part) for part in self.key)
+
+    @property
+    def grid(self) -> LayoutGrid:
+        with self._grid_lock:
+            if self._grid is None:
+                self._grid = LayoutGrid.from_locations(self.locations)
+            return self._grid
+
+    def stats_row(self, zone: str) -> Optional[Dict[str, Any]]:
+        return next((row for row in self.stats if row['zone'] == zone), None)
+
+    @property
+    def nbytes(self) -> int:
+        # Aproximado: las filas son dicts de Python, la rejilla se mide exacta
+        return len(self.locations) * 1024 + (self._grid.nbytes if self._grid is not None else 0)
+
+
+def search_live_locations(locations: List[Dict[str, Any]], query: str, limit: int = 50) -> List[Dict[str, Any]]:
+    """Búsqueda de /search-locations sobre las filas en memoria del mapa en vivo"""
+    term = query.lower()
+    matches = (
+        row for row in locations
+        if any(term in (row[field] or '').lower() for field in SEARCH_FIELDS)
+    )
+    best = heapq.nsmallest(limit, matches, key=lambda row: row['location_code'] or '')
+    return [{column: row[column] for column in SEARCH_COLUMNS} for row in best]
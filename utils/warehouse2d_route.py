@@ -0,0 +1,154 @@
+# utils/warehouse2d_route.py - Rutas de picking sobre el layout 2D
+#
+# Modelo de distancias: las zonas se ubican una al lado de la otra (como en el mapa),
+# con un pasillo transversal delante de la fila 1. Dentro de una zona se camina en
+# distancia Manhattan; para cambiar de zona se sale al pasillo, se cruza y se entra.
+# El modelo se arma una vez por rejilla (layout + hash) y cada ruta se resuelve con
+# vecino más cercano + 2-opt sobre una matriz de distancias de las paradas.
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Columnas de pasillo entre zonas consecutivas
+AISLE_WIDTH = 1
+MAX_ROUTE_STOPS = 500
+
+
+class RouteModel:
+    """Geometría de recorrido del layout: posición x de cada zona y del pasillo transversal"""
+
+    def __init__(self, grid):
+        self.grid = grid
+        zones, rows, cols = grid.shape
+        self.zone_offsets = np.arange(max(zones, 1), dtype=np.int64) * (cols + AISLE_WIDTH)
+
+    def cell_for(self, zone: str, row: int, col: int) -> Optional[int]:
+        """Índice plano de una coordenada, o None si cae fuera del layout"""
+        z = self.grid.zone_index.get(zone)
+        if z is None or not (1 <= row <= self.grid.shape[1]) or not (1 <= col <= self.grid.shape[2]):
+            return None
+        return int(np.ravel_multi_index((z, row - 1, col - 1), self.grid.shape))
+
+    # ================= DISTANCIAS =================
+
+    def _point_arrays(self, cells):
+        """Zona, x, y de cada punto; el punto -1 es el depósito (inicio del pasillo)"""
+        cells = np.asarray(cells, dtype=np.int64)
+        depot = cells < 0
+        if self.grid.cells:
+            z, r, c = np.unravel_index(np.where(depot, 0, cells), self.grid.shape)
+        else:
+            z = r = c = np.zeros(len(cells), dtype=np.int64)
+        zone = np.where(depot, -1, z)
+        x = np.where(depot, 0, self.zone_offsets[z] + c)
+        # La fila 1 queda a un paso del pasillo transversal
+        y = np.where(depot, 0, r + 1)
+        return zone, x, y
+
+    def distances_from(self, cell: int, cells) -> np.ndarray:
+        """Distancia de un punto a muchos (vectorizado)"""
+        z0, x0, y0 = self._point_arrays([cell])
+        z, x, y = self._point_arrays(cells)
+        same_zone = (z == z0[0]) & (z >= 0)
+        return np.abs(x - x0[0]) + np.where(same_zone, np.abs(y - y0[0]), y + y0[0])
+
+    def distance_matrix(self, cells) -> np.ndarray:
+        z, x, y = self._point_arrays(cells)
+        same_zone = (z[:, None] == z[None, :]) & (z[:, None] >= 0)
+        return (np.abs(x[:, None] - x[None, :])
+                + np.where(same_zone, np.abs(y[:, None] - y[None, :]), y[:, None] + y[None, :]))
+
+    # ================= RUTA =================
+
+    def solve(self, candidates: Sequence[np.ndarray], start: int = -1, return_to_start: bool = True,
+              max_seconds: float = 0.5) -> Dict[str, Any]:
+        """Ordenar las paradas; cada elemento de `candidates` son las celdas posibles de una parada.
+
+        El vecino más cercano elige también qué celda visitar cuando un material está en
+        varias ubicaciones; luego 2-opt mejora el orden con las celdas ya elegidas.
+        """
+        started = time.monotonic()
+
+        # Vecino más cercano sobre todas las celdas candidatas a la vez
+        owner = np.concatenate([np.full(len(c), i, dtype=np.int64) for i, c in enumerate(candidates)]
+                               or [np.empty(0, dtype=np.int64)])
+        pool = np.concatenate(list(candidates) or [np.empty(0, dtype=np.int64)]).astype(np.int64)
+        pending = np.ones(len(candidates), dtype=bool)
+        assigned = [None] * len(candidates)
+        path = [start]
+        current = start
+        while pending.any():
+            distance = self.distances_from(current, pool).astype(float)
+            distance[~pending[owner]] = np.inf
+            best = int(np.argmin(distance))
+            current = int(pool[best])
+            assigned[owner[best]] = current
+            pending[owner[best]] = False
+            path.append(current)
+
+        # Paradas repetidas (dos materiales en la misma celda) se visitan una vez
+        _, first = np.unique(path, return_index=True)
+        path = [path[i] for i in sorted(first)]
+        if return_to_start:
+            path.append(start)
+
+        points = np.array(path, dtype=np.int64)
+        matrix = self.distance_matrix(points)
+        order = np.arange(len(points))
+        nn_distance = self._path_length(matrix, order)
+        order = self._two_opt(matrix, order, closed=return_to_start, deadline=started + max_seconds)
+
+        return {
+            'cells': points[order].tolist(),
+            'assigned': assigned,
+            'distance': int(self._path_length(matrix, order)),
+            'nn_distance': int(nn_distance),
+        }
+
+    @staticmethod
+    def _path_length(matrix, order) -> int:
+        return int(matrix[order[:-1], order[1:]].sum())
+
+    @staticmethod
+    def _two_opt(matrix, order, closed: bool, deadline: float):
+        """2-opt con el primer punto fijo (y el último si la ruta vuelve al inicio).
+
+        Invertir order[i..k] cambia los tramos (a, b) y (c, d) por (a, c) y (b, d);
+        para cada i se evalúan todos los k a la vez y se aplica la mejor inversión.
+        """
+        order = order.copy()
+        n = len(order)
+        last = n - 1 if closed else n
+        improved = True
+        while improved and time.monotonic() < deadline:
+            improved = False
+            for i in range(1, last - 1):
+                a, b = order[i - 1], order[i]
+                k = np.arange(i + 1, last)
+                c = order[k]
+                # En una ruta abierta el último punto no tiene tramo siguiente
+                has_next = k + 1 < n
+                d = order[np.minimum(k + 1, n - 1)]
+                gain = (matrix[a, b] - matrix[a, c]) + np.where(has_next, matrix[c, d] - matrix[b, d], 0)
+                best = int(np.argmax(gain))
+                if gain[best] > 0:
+                    end = int(k[best])
+                    order[i:end + 1] = order[i:end + 1][::-1].copy()
+                    improved = True
+        return order
+
+
+def describe_route(grid, cells: List[int], picks: Dict[int, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Paradas de la ruta con datos de la ubicación y lo que se recoge en cada una"""
+    stops = []
+    for cell in cells:
+        if cell < 0:
+            stops.append({'seq': len(stops), 'code': None, 'depot': True})
+            continue
+        z, r, c = np.unravel_index(cell, grid.shape)
+        stop = grid.cell(int(z), int(r), int(c))
+        stop['seq'] = len(stops)
+        stop['picks'] = picks.get(cell, [])
+        stops.append(stop)
+    return stops
@@ -0,0 +1,1022 @@
+# utils/warehouse2d_storage.py - Almacenamiento de sesiones y layouts del mapa 2D
+#
+# Dos implementaciones con la misma interfaz:
+#   - SQLiteWarehouseStorage: archivo SQLite local (un solo nodo)
+#   - SQLAlchemyWarehouseStorage: base principal de la app (SQLite o Postgres),
+#     compartida entre contenedores, sin necesidad de sesiones "sticky"
+import csv
+import io
+import logging
+import sqlite3
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterator, List, Optional
+
+from sqlalchemy import bindparam, delete, func, insert, literal, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+logger = logging.getLogger(__name__)
+
+LOCATION_COLUMNS = [
+    'location_code', 'zone', 'row_num', 'col_num', 'material_code',
+    'material_desc', 'quantity', 'capacity', 'unit', 'ocupation_percent', 'status'
+]
+
+STATS_COLUMNS = [
+    'zone', 'total_records', 'total_locations', 'total_materials', 'total_quantity',
+    'total_capacity', 'max_row', 'max_col', 'zones', 'status_stats'
+]
+
+# Fila de estadísticas con los totales de todo el layout
+STATS_ALL_ZONES = '*'
+
+SESSION_TTL = timedelta(hours=24)
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _format_date(value) -> Optional[str]:
+    if value is None or isinstance(value, str):
+        return value
+    return value.strftime(DATE_FORMAT)
+
+
+class WarehouseStorage:
+    """Interfaz común de almacenamiento del mapa 2D.
+
+    Las sesiones apuntan a layouts; un layout (ubicaciones + agregados) se guarda
+    una sola vez por contenido de archivo y se elimina cuando nadie lo referencia.
+    """
+
+    # ================= SESIONES Y LAYOUTS =================
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def attach_layout_by_hash(self, session_id: str, user_id: str, file_name: str,
+                              content_hash: str) -> Optional[int]:
+        """Apuntar la sesión a un layout ya guardado con ese contenido.
+
+        Devuelve el total de registros, o None si hay que procesar el archivo.
+        """
+        raise NotImplementedError
+
+    def save_layout(self, session_id: str, user_id: str, file_name: str, content_hash: str,
+                    records: List[tuple], stats_rows: List[Dict[str, Any]]) -> int:
+        """Guardar un layout nuevo y apuntar la sesión a él"""
+        raise NotImplementedError
+
+    def release_session(self, session_id: str):
+        """Eliminar la sesión y liberar su referencia al layout"""
+        raise NotImplementedError
+
+    # ================= CARGAS INCREMENTALES =================
+
+    def detach_layout_for_update(self, session_id: str) -> Optional[str]:
+        """Dejar la sesión con un layout propio que se pueda modificar.
+
+        Si el layout es compartido se copia; si no, solo se quita su content_hash
+        para que ninguna subida futura lo reutilice. Devuelve el layout_id a modificar.
+        """
+        raise NotImplementedError
+
+    def find_locations(self, layout_id: str, location_codes: List[str]) -> List[Dict[str, Any]]:
+        """Filas actuales de las ubicaciones indicadas"""
+        raise NotImplementedError
+
+    def upsert_locations(self, session_id: str, layout_id: str, file_hash: str,
+                         records: List[tuple]) -> int:
+        """Reemplazar las filas con la misma (ubicación, material) e insertar las nuevas.
+
+        Actualiza el total de registros y el hash de la sesión; devuelve el nuevo total.
+        """
+        raise NotImplementedError
+
+    def count_materials(self, layout_id: str) -> int:
+        raise NotImplementedError
+
+    def save_layout_stats(self, layout_id: str, stats_rows: List[Dict[str, Any]]):
+        """Reemplazar las filas de agregados indicadas (por zona)"""
+        raise NotImplementedError
+
+    # ================= LECTURAS =================
+
+    def get_layout_stats(self, layout_id: str, zone: str = STATS_ALL_ZONES) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def list_layout_stats(self, layout_id: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    def iter_locations(self, layout_id: str, limit: Optional[int] = None, ordered: bool = True,
+                       zones: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """Recorrer las ubicaciones del layout (o solo de algunas zonas) sin cargarlas todas en memoria"""
+        raise NotImplementedError
+
+    def search_locations(self, layout_id: str, query: str, limit: int = 50) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # ================= MANTENIMIENTO (janitor) =================
+
+    def expire_sessions(self, limit: int) -> int:
+        """Eliminar hasta `limit` sesiones vencidas; devuelve cuántas eliminó"""
+        raise NotImplementedError
+
+    def mark_unreferenced_layouts(self) -> List[str]:
+        """Marcar (ref_count = -1) los layouts sin referencias y devolver los marcados"""
+        raise NotImplementedError
+
+    def delete_layout_rows(self, layout_id: Optional[str], limit: int) -> int:
+        """Borrar hasta `limit` ubicaciones del layout; devuelve cuántas borró"""
+        raise NotImplementedError
+
+    def drop_layout(self, layout_id: str):
+        """Borrar los agregados y la fila del layout (sus ubicaciones ya fueron borradas)"""
+        raise NotImplementedError
+
+    def sweep_orphan_metadata(self) -> int:
+        """Borrar sesiones y agregados que apuntan a layouts inexistentes"""
+        raise NotImplementedError
+
+    def orphan_location_layouts(self, limit: int) -> List[Optional[str]]:
+        """Hasta `limit` layouts referenciados por ubicaciones pero que ya no existen"""
+        raise NotImplementedError
+
+    def prepare(self):
+        """Mantenimiento único y lento al arrancar (lo ejecuta el hilo del janitor)"""
+
+    def compact(self):
+        """Devolver espacio libre al disco (si el motor lo permite)"""
+
+
+class SQLiteWarehouseStorage(WarehouseStorage):
+    """Almacenamiento en un archivo SQLite local (un solo nodo)"""
+
+    def __init__(self, db_path: str, vacuum_pages: int = 1000):
+        self.db_path = db_path
+        self.vacuum_pages = vacuum_pages
+        self.init_db()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def init_db(self):
+        """Crear las tablas del almacenamiento temporal"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        # auto_vacuum incremental para devolver espacio al disco sin un VACUUM completo.
+        # En un archivo nuevo basta con fijarlo antes de crear las tablas; los archivos
+        # existentes se convierten una sola vez desde el janitor (prepare())
+        if not cursor.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+            cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+        # WAL para que el janitor no bloquee las lecturas
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        # Las ubicaciones pertenecen a un layout compartido y no a la sesión.
+        # Los datos son temporales (24h), así que las tablas del formato anterior se recrean.
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'warehouse_locations'")
+        if cursor.fetchone():
+            columns = [row[1] for row in cursor.execute('PRAGMA table_info(warehouse_locations)')]
+            if 'layout_id' not in columns:
+                cursor.execute('DROP TABLE IF EXISTS warehouse_locations')
+                cursor.execute('DROP TABLE IF EXISTS warehouse_session_stats')
+                cursor.execute('DROP TABLE IF EXISTS warehouse_sessions')
+
+        # Tabla para datos de usuario (cada sesión apunta a un layout)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS warehouse_sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            layout_id TEXT,
+            file_name TEXT,
+            file_hash TEXT,
+            total_records INTEGER,
+            created_at TIMESTAMP,
+            expires_at TIMESTAMP,
+            metadata TEXT
+        )
+        ''')
+
+        # Layouts procesados, guardados una sola vez por contenido del archivo
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS warehouse_layouts (
+            layout_id TEXT PRIMARY KEY,
+            content_hash TEXT,
+            total_records INTEGER,
+            ref_count INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP,
+            last_used_at TIMESTAMP
+        )
+        ''')
+
+        # Tabla para datos procesados (optimizado para el mapa)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS warehouse_locations (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            layout_id TEXT,
+            location_code TEXT,
+            zone TEXT,
+            row_num INTEGER,
+            col_num INTEGER,
+            material_code TEXT,
+            material_desc TEXT,
+            quantity REAL,
+            capacity REAL,
+            unit TEXT,
+            ocupation_percent REAL,
+            status TEXT,
+            FOREIGN KEY (layout_id) REFERENCES warehouse_layouts(layout_id)
+        )
+        ''')
+
+        # Índices para mejor rendimiento
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_layout_hash ON warehouse_layouts(content_hash)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_session_layout ON warehouse_sessions(layout_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_layout ON warehouse_locations(layout_id)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_layout_location ON warehouse_locations(layout_id, location_code)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_zone ON warehouse_locations(zone)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_status ON warehouse_locations(status)')
+
+        # Agregados precalculados durante la carga (zone = '*' guarda los totales del layout)
+        cursor.execute('''
+        CREATE TABLE IF NOT EXISTS warehouse_layout_stats (
+            layout_id TEXT NOT NULL,
+            zone TEXT NOT NULL,
+            total_records INTEGER,
+            total_locations INTEGER,
+            total_materials INTEGER,
+            total_quantity REAL,
+            total_capacity REAL,
+            max_row INTEGER,
+            max_col INTEGER,
+            zones TEXT,
+            status_stats TEXT,
+            PRIMARY KEY (layout_id, zone)
+        )
+        ''')
+
+        conn.commit()
+        conn.close()
+
+    # ================= SESIONES Y LAYOUTS =================
+
+    def get_session(self, session_id):
+        conn = self._connect()
+        try:
+            row = conn.execute('''
+                SELECT session_id, user_id, layout_id, file_name, file_hash, total_records, created_at, expires_at
+                FROM warehouse_sessions
+                WHERE session_id = ?
+            ''', (session_id,)).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def _release(self, cursor, session_id):
+        cursor.execute('SELECT layout_id FROM warehouse_sessions WHERE session_id = ?', (session_id,))
+        row = cursor.fetchone()
+        cursor.execute('DELETE FROM warehouse_sessions WHERE session_id = ?', (session_id,))
+        if row and row[0]:
+            cursor.execute(
+                'UPDATE warehouse_layouts SET ref_count = MAX(ref_count - 1, 0) WHERE layout_id = ?',
+                (row[0],)
+            )
+
+    def _acquire(self, cursor, layout_id):
+        """Sumar una referencia al layout; False si el janitor ya lo está eliminando"""
+        cursor.execute(
+            'UPDATE warehouse_layouts SET ref_count = ref_count + 1, last_used_at = ? '
+            'WHERE layout_id = ? AND ref_count >= 0',
+            (datetime.now().strftime(DATE_FORMAT), layout_id)
+        )
+        return cursor.rowcount == 1
+
+    def _attach(self, cursor, session_id, user_id, layout_id, file_name, content_hash):
+        """Apuntar la sesión a un layout ya adquirido, liberando el que tuviera antes"""
+        self._release(cursor, session_id)
+
+        now = datetime.now()
+        cursor.execute('SELECT total_records FROM warehouse_layouts WHERE layout_id = ?', (layout_id,))
+        total_records = cursor.fetchone()[0]
+
+        cursor.execute('''
+            INSERT INTO warehouse_sessions
+            (session_id, user_id, layout_id, file_name, file_hash, total_records, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (session_id, user_id, layout_id, file_name, content_hash, total_records,
+              now.strftime(DATE_FORMAT), (now + SESSION_TTL).strftime(DATE_FORMAT)))
+        return total_records
+
+    def attach_layout_by_hash(self, session_id, user_id, file_name, content_hash):
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('SELECT layout_id FROM warehouse_layouts WHERE content_hash = ?', (content_hash,))
+            row = cursor.fetchone()
+            if not row or not self._acquire(cursor, row[0]):
+                conn.rollback()
+                return None
+            total_records = self._attach(cursor, session_id, user_id, row[0], file_name, content_hash)
+            conn.commit()
+            return total_records
+        finally:
+            conn.close()
+
+    def save_layout(self, session_id, user_id, file_name, content_hash, records, stats_rows):
+        layout_id = uuid.uuid4().hex
+        now = datetime.now().strftime(DATE_FORMAT)
+
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO warehouse_layouts (layout_id, content_hash, total_records, ref_count, created_at, last_used_at)
+                VALUES (?, ?, ?, 1, ?, ?)
+            ''', (layout_id, content_hash, len(records), now, now))
+
+            # Insertar en lotes para mejor rendimiento
+            batch_size = 1000
+            for i in range(0, len(records), batch_size):
+                cursor.executemany('''
+                    INSERT INTO warehouse_locations
+                    (layout_id, location_code, zone, row_num, col_num, material_code,
+                     material_desc, quantity, capacity, unit, ocupation_percent, status)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [(layout_id,) + tuple(record) for record in records[i:i + batch_size]])
+
+            self._save_stats(cursor, layout_id, stats_rows)
+            total_records = self._attach(cursor, session_id, user_id, layout_id, file_name, content_hash)
+            conn.commit()
+            return total_records
+        except sqlite3.IntegrityError:
+            # Otra sesión guardó el mismo archivo al mismo tiempo
+            conn.rollback()
+            total_records = self.attach_layout_by_hash(session_id, user_id, file_name, content_hash)
+            if total_records is None:
+                raise
+            return total_records
+        finally:
+            conn.close()
+
+    def _save_stats(self, cursor, layout_id, stats_rows):
+        cursor.executemany('''
+            INSERT OR REPLACE INTO warehouse_layout_stats
+            (layout_id, zone, total_records, total_locations, total_materials, total_quantity,
+             total_capacity, max_row, max_col, zones, status_stats)
+            VALUES (:layout_id, :zone, :total_records, :total_locations, :total_materials, :total_quantity,
+                    :total_capacity, :max_row, :max_col, :zones, :status_stats)
+        ''', [dict(row, layout_id=layout_id) for row in stats_rows])
+
+    def release_session(self, session_id):
+        conn = self._connect()
+        try:
+            self._release(conn.cursor(), session_id)
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ================= CARGAS INCREMENTALES =================
+
+    def detach_layout_for_update(self, session_id):
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            row = cursor.execute('''
+                SELECT l.layout_id, l.ref_count, l.total_records
+                FROM warehouse_sessions s JOIN warehouse_layouts l ON l.layout_id = s.layout_id
+                WHERE s.session_id = ?
+            ''', (session_id,)).fetchone()
+            if not row:
+                return None
+            layout_id, ref_count, total_records = row
+
+            if ref_count <= 1:
+                cursor.execute('UPDATE warehouse_layouts SET content_hash = NULL WHERE layout_id = ?', (layout_id,))
+                conn.commit()
+                return layout_id
+
+            # Layout compartido: copiar ubicaciones y agregados a un layout propio de la sesión
+            new_layout_id = uuid.uuid4().hex
+            now = datetime.now().strftime(DATE_FORMAT)
+            location_columns = ', '.join(LOCATION_COLUMNS)
+            stats_columns = ', '.join(STATS_COLUMNS)
+            cursor.execute('''
+                INSERT INTO warehouse_layouts (layout_id, content_hash, total_records, ref_count, created_at, last_used_at)
+                VALUES (?, NULL, ?, 1, ?, ?)
+            ''', (new_layout_id, total_records, now, now))
+            cursor.execute(
+                f'INSERT INTO warehouse_locations (layout_id, {location_columns}) '
+                f'SELECT ?, {location_columns} FROM warehouse_locations WHERE layout_id = ?',
+                (new_layout_id, layout_id)
+            )
+            cursor.execute(
+                f'INSERT INTO warehouse_layout_stats (layout_id, {stats_columns}) '
+                f'SELECT ?, {stats_columns} FROM warehouse_layout_stats WHERE layout_id = ?',
+                (new_layout_id, layout_id)
+            )
+            cursor.execute(
+                'UPDATE warehouse_layouts SET ref_count = MAX(ref_count - 1, 0) WHERE layout_id = ?', (layout_id,)
+            )
+            cursor.execute(
+                'UPDATE warehouse_sessions SET layout_id = ? WHERE session_id = ?', (new_layout_id, session_id)
+            )
+            conn.commit()
+            return new_layout_id
+        finally:
+            conn.close()
+
+    def find_locations(self, layout_id, location_codes):
+        rows = []
+        conn = self._connect()
+        try:
+            for i in range(0, len(location_codes), 500):
+                chunk = list(location_codes[i:i + 500])
+                rows.extend(dict(row) for row in conn.execute(
+                    f'SELECT {", ".join(LOCATION_COLUMNS)} FROM warehouse_locations '
+                    f'WHERE layout_id = ? AND location_code IN ({", ".join("?" * len(chunk))})',
+                    [layout_id] + chunk
+                ))
+            return rows
+        finally:
+            conn.close()
+
+    def upsert_locations(self, session_id, layout_id, file_hash, records):
+        code_idx = LOCATION_COLUMNS.index('location_code')
+        material_idx = LOCATION_COLUMNS.index('material_code')
+
+        conn = self._connect()
+        try:
+            cursor = conn.cursor()
+            cursor.executemany(
+                'DELETE FROM warehouse_locations WHERE layout_id = ? AND location_code = ? AND material_code = ?',
+                [(layout_id, record[code_idx], record[material_idx]) for record in records]
+            )
+            cursor.executemany(f'''
+                INSERT INTO warehouse_locations (layout_id, {", ".join(LOCATION_COLUMNS)})
+                VALUES (?, {", ".join("?" * len(LOCATION_COLUMNS))})
+            ''', [(layout_id,) + tuple(record) for record in records])
+
+            total_records = cursor.execute(
+                'SELECT COUNT(*) FROM warehouse_locations WHERE layout_id = ?', (layout_id,)
+            ).fetchone()[0]
+            cursor.execute(
+                'UPDATE warehouse_layouts SET total_records = ?, last_used_at = ? WHERE layout_id = ?',
+                (total_records, datetime.now().strftime(DATE_FORMAT), layout_id)
+            )
+            cursor.execute(
+                'UPDATE warehouse_sessions SET total_records = ?, file_hash = ? WHERE session_id = ?',
+                (total_records, file_hash, session_id)
+            )
+            conn.commit()
+            return total_records
+        finally:
+            conn.close()
+
+    def count_materials(self, layout_id):
+        conn = self._connect()
+        try:
+            return conn.execute(
+                'SELECT COUNT(DISTINCT material_code) FROM warehouse_locations WHERE layout_id = ?', (layout_id,)
+            ).fetchone()[0]
+        finally:
+            conn.close()
+
+    def save_layout_stats(self, layout_id, stats_rows):
+        conn = self._connect()
+        try:
+            self._save_stats(conn.cursor(), layout_id, stats_rows)
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ================= LECTURAS =================
+
+    def get_layout_stats(self, layout_id, zone=STATS_ALL_ZONES):
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                f'SELECT {", ".join(STATS_COLUMNS)} FROM warehouse_layout_stats WHERE layout_id = ? AND zone = ?',
+                (layout_id, zone)
+            ).fetchone()
+            return dict(row) if row else None
+        finally:
+            conn.close()
+
+    def list_layout_stats(self, layout_id):
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                f'SELECT {", ".join(STATS_COLUMNS)} FROM warehouse_layout_stats WHERE layout_id = ? ORDER BY zone',
+                (layout_id,)
+            ).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    def iter_locations(self, layout_id, limit=None, ordered=True, zones=None):
+        sql = f'SELECT {", ".join(LOCATION_COLUMNS)} FROM warehouse_locations WHERE layout_id = ?'
+        params = [layout_id]
+        if zones is not None:
+            sql += f' AND zone IN ({", ".join("?" * len(zones))})'
+            params.extend(zones)
+        if ordered:
+            sql += ' ORDER BY zone, row_num, col_num'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        conn = self._connect()
+        try:
+            for row in conn.execute(sql, params):
+                yield dict(row)
+        finally:
+            conn.close()
+
+    def search_locations(self, layout_id, query, limit=50):
+        search_term = f'%{query}%'
+        conn = self._connect()
+        try:
+            rows = conn.execute('''
+                SELECT
+                    location_code, zone, row_num, col_num, material_code,
+                    material_desc, quantity, capacity, ocupation_percent, status
+                FROM warehouse_locations
+                WHERE layout_id = ? AND (
+                    location_code LIKE ? OR
+                    zone LIKE ? OR
+                    material_code LIKE ? OR
+                    material_desc LIKE ?
+                )
+                ORDER BY location_code
+                LIMIT ?
+            ''', (layout_id, search_term, search_term, search_term, search_term, limit)).fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            conn.close()
+
+    # ================= MANTENIMIENTO (janitor) =================
+
+    def expire_sessions(self, limit):
+        now = datetime.now().strftime(DATE_FORMAT)
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            rows = conn.execute(
+                'SELECT session_id, layout_id FROM warehouse_sessions WHERE expires_at < ? LIMIT ?',
+                (now, limit)
+            ).fetchall()
+            conn.executemany('DELETE FROM warehouse_sessions WHERE session_id = ?',
+                             [(session_id,) for session_id, _ in rows])
+            conn.executemany(
+                'UPDATE warehouse_layouts SET ref_count = ref_count - 1 WHERE layout_id = ? AND ref_count > 0',
+                [(layout_id,) for _, layout_id in rows if layout_id]
+            )
+            conn.commit()
+            return len(rows)
+        finally:
+            conn.close()
+
+    def mark_unreferenced_layouts(self):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            # Sin content_hash ninguna subida puede reutilizar un layout a medio borrar
+            conn.execute('UPDATE warehouse_layouts SET ref_count = -1, content_hash = NULL WHERE ref_count = 0')
+            conn.commit()
+            return [row[0] for row in conn.execute('SELECT layout_id FROM warehouse_layouts WHERE ref_count < 0')]
+        finally:
+            conn.close()
+
+    def delete_layout_rows(self, layout_id, limit):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            cursor = conn.execute(
+                'DELETE FROM warehouse_locations WHERE id IN '
+                '(SELECT id FROM warehouse_locations WHERE layout_id IS ? LIMIT ?)',
+                (layout_id, limit)
+            )
+            conn.commit()
+            return cursor.rowcount
+        finally:
+            conn.close()
+
+    def drop_layout(self, layout_id):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.execute('DELETE FROM warehouse_layout_stats WHERE layout_id = ?', (layout_id,))
+            conn.execute('DELETE FROM warehouse_layouts WHERE layout_id = ?', (layout_id,))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def sweep_orphan_metadata(self):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            swept = conn.execute(
+                'DELETE FROM warehouse_sessions WHERE layout_id IS NULL '
+                'OR layout_id NOT IN (SELECT layout_id FROM warehouse_layouts)'
+            ).rowcount
+            swept += conn.execute(
+                'DELETE FROM warehouse_layout_stats WHERE layout_id NOT IN (SELECT layout_id FROM warehouse_layouts)'
+            ).rowcount
+            conn.commit()
+            return swept
+        finally:
+            conn.close()
+
+    def orphan_location_layouts(self, limit):
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            return [row[0] for row in conn.execute(
+                'SELECT DISTINCT layout_id FROM warehouse_locations '
+                'WHERE layout_id IS NULL OR layout_id NOT IN (SELECT layout_id FROM warehouse_layouts) '
+                'LIMIT ?', (limit,)
+            )]
+        finally:
+            conn.close()
+
+    def prepare(self):
+        """Convertir una sola vez los archivos creados sin auto_vacuum incremental.
+
+        El VACUUM reescribe todo el archivo: corre en el hilo del janitor y no al
+        registrar el blueprint. Si otro proceso tiene la base ocupada se reintenta
+        en el próximo arranque.
+        """
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+                return
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            logger.info(f"auto_vacuum incremental activado en {self.db_path}")
+        except sqlite3.OperationalError as e:
+            logger.warning(f"No se pudo activar auto_vacuum en {self.db_path}: {e}")
+        finally:
+            conn.close()
+
+    def compact(self):
+        """Devolver páginas libres al sistema y truncar el WAL"""
+        conn = sqlite3.connect(self.db_path, timeout=1)
+        try:
+            conn.execute(f'PRAGMA incremental_vacuum({int(self.vacuum_pages)})').fetchall()
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        except sqlite3.OperationalError as e:
+            logger.warning(f"No se pudo compactar {self.db_path}: {e}")
+        finally:
+            conn.close()
+
+
+class SQLAlchemyWarehouseStorage(WarehouseStorage):
+    """Almacenamiento en la base principal de la app (tablas warehouse2d_*).
+
+    Usa SQLAlchemy Core sobre el engine para funcionar también desde el hilo del
+    janitor, fuera del contexto de Flask.
+    """
+
+    def __init__(self, engine):
+        from models.warehouse2d import (Warehouse2DLayout, Warehouse2DLayoutStats,
+                                        Warehouse2DLocation, Warehouse2DSession)
+        self.engine = engine
+        self.sessions = Warehouse2DSession.__table__
+        self.layouts = Warehouse2DLayout.__table__
+        self.locations = Warehouse2DLocation.__table__
+        self.stats = Warehouse2DLayoutStats.__table__
+
+        # create_all() en app.py ya las crea; esto cubre despliegues con el blueprint solo
+        for table in (self.layouts, self.sessions, self.locations, self.stats):
+            table.create(self.engine, checkfirst=True)
+
+    # ================= SESIONES Y LAYOUTS =================
+
+    def get_session(self, session_id):
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(self.sessions).where(self.sessions.c.session_id == session_id)
+            ).mappings().first()
+        if not row:
+            return None
+        data = dict(row)
+        data['created_at'] = _format_date(data['created_at'])
+        data['expires_at'] = _format_date(data['expires_at'])
+        return data
+
+    def _release(self, conn, session_id):
+        layout_id = conn.execute(
+            select(self.sessions.c.layout_id).where(self.sessions.c.session_id == session_id)
+        ).scalar()
+        conn.execute(delete(self.sessions).where(self.sessions.c.session_id == session_id))
+        if layout_id:
+            conn.execute(
+                update(self.layouts)
+                .where(self.layouts.c.layout_id == layout_id, self.layouts.c.ref_count > 0)
+                .values(ref_count=self.layouts.c.ref_count - 1)
+            )
+
+    def _acquire(self, conn, layout_id):
+        result = conn.execute(
+            update(self.layouts)
+            .where(self.layouts.c.layout_id == layout_id, self.layouts.c.ref_count >= 0)
+            .values(ref_count=self.layouts.c.ref_count + 1, last_used_at=datetime.now())
+        )
+        return result.rowcount == 1
+
+    def _attach(self, conn, session_id, user_id, layout_id, file_name, content_hash):
+        self._release(conn, session_id)
+
+        now = datetime.now()
+        total_records = conn.execute(
+            select(self.layouts.c.total_records).where(self.layouts.c.layout_id == layout_id)
+        ).scalar()
+        conn.execute(insert(self.sessions).values(
+            session_id=session_id, user_id=user_id, layout_id=layout_id, file_name=file_name,
+            file_hash=content_hash, total_records=total_records,
+            created_at=now, expires_at=now + SESSION_TTL
+        ))
+        return total_records
+
+    def attach_layout_by_hash(self, session_id, user_id, file_name, content_hash):
+        with self.engine.begin() as conn:
+            layout_id = conn.execute(
+                select(self.layouts.c.layout_id).where(self.layouts.c.content_hash == content_hash)
+            ).scalar()
+            if not layout_id or not self._acquire(conn, layout_id):
+                return None
+            return self._attach(conn, session_id, user_id, layout_id, file_name, content_hash)
+
+    def save_layout(self, session_id, user_id, file_name, content_hash, records, stats_rows):
+
+        layout_id = uuid.uuid4().hex
+        now = datetime.now()
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(insert(self.layouts).values(
+                    layout_id=layout_id, content_hash=content_hash, total_records=len(records),
+                    ref_count=1, created_at=now, last_used_at=now
+                ))
+                self._bulk_insert_locations(conn, layout_id, records)
+                if stats_rows:
+                    conn.execute(insert(self.stats), [dict(row, layout_id=layout_id) for row in stats_rows])
+                return self._attach(conn, session_id, user_id, layout_id, file_name, content_hash)
+        except IntegrityError:
+            # Otra sesión (quizá en otro nodo) guardó el mismo archivo al mismo tiempo
+            total_records = self.attach_layout_by_hash(session_id, user_id, file_name, content_hash)
+            if total_records is None:
+                raise
+            return total_records
+
+    def _bulk_insert_locations(self, conn, layout_id, records, batch_size=5000):
+        """Insertar ubicaciones: COPY en Postgres, executemany por lotes en el resto"""
+        if not records:
+            return
+
+        if conn.dialect.name == 'postgresql':
+            cursor = conn.connection.cursor()
+            if hasattr(cursor, 'copy_expert'):
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                for record in records:
+                    writer.writerow((layout_id,) + tuple(record))
+                buffer.seek(0)
+                columns = ', '.join(['layout_id'] + LOCATION_COLUMNS)
+                cursor.copy_expert(
+                    f'COPY {self.locations.name} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer
+                )
+                return
+
+        for i in range(0, len(records), batch_size):
+            conn.execute(insert(self.locations), [
+                dict(zip(LOCATION_COLUMNS, record), layout_id=layout_id)
+                for record in records[i:i + batch_size]
+            ])
+
+    def release_session(self, session_id):
+        with self.engine.begin() as conn:
+            self._release(conn, session_id)
+
+    # ================= CARGAS INCREMENTALES =================
+
+    def detach_layout_for_update(self, session_id):
+        layouts = self.layouts
+        with self.engine.begin() as conn:
+            row = conn.execute(
+                select(layouts.c.layout_id, layouts.c.ref_count, layouts.c.total_records)
+                .join(self.sessions, self.sessions.c.layout_id == layouts.c.layout_id)
+                .where(self.sessions.c.session_id == session_id)
+            ).first()
+            if not row:
+                return None
+            layout_id, ref_count, total_records = row
+
+            if ref_count <= 1:
+                conn.execute(update(layouts).where(layouts.c.layout_id == layout_id).values(content_hash=None))
+                return layout_id
+
+            # Layout compartido: copiar ubicaciones y agregados a un layout propio de la sesión
+            new_layout_id = uuid.uuid4().hex
+            now = datetime.now()
+            conn.execute(insert(layouts).values(
+                layout_id=new_layout_id, content_hash=None, total_records=total_records,
+                ref_count=1, created_at=now, last_used_at=now
+            ))
+            t = self.locations
+            conn.execute(insert(t).from_select(
+                ['layout_id'] + LOCATION_COLUMNS,
+                select(literal(new_layout_id), *[t.c[name] for name in LOCATION_COLUMNS])
+                .where(t.c.layout_id == layout_id)
+            ))
+            conn.execute(insert(self.stats).from_select(
+                ['layout_id'] + STATS_COLUMNS,
+                select(literal(new_layout_id), *[self.stats.c[name] for name in STATS_COLUMNS])
+                .where(self.stats.c.layout_id == layout_id)
+            ))
+            conn.execute(
+                update(layouts).where(layouts.c.layout_id == layout_id, layouts.c.ref_count > 0)
+                .values(ref_count=layouts.c.ref_count - 1)
+            )
+            conn.execute(
+                update(self.sessions).where(self.sessions.c.session_id == session_id)
+                .values(layout_id=new_layout_id)
+            )
+            return new_layout_id
+
+    def find_locations(self, layout_id, location_codes):
+        t = self.locations
+        rows = []
+        with self.engine.connect() as conn:
+            for i in range(0, len(location_codes), 500):
+                rows.extend(dict(row) for row in conn.execute(
+                    select(*[t.c[name] for name in LOCATION_COLUMNS])
+                    .where(t.c.layout_id == layout_id, t.c.location_code.in_(list(location_codes[i:i + 500])))
+                ).mappings())
+        return rows
+
+    def upsert_locations(self, session_id, layout_id, file_hash, records):
+        t = self.locations
+        code_idx = LOCATION_COLUMNS.index('location_code')
+        material_idx = LOCATION_COLUMNS.index('material_code')
+
+        with self.engine.begin() as conn:
+            conn.execute(
+                delete(t).where(
+                    t.c.layout_id == layout_id,
+                    t.c.location_code == bindparam('code'),
+                    t.c.material_code == bindparam('material'),
+                ),
+                [{'code': record[code_idx], 'material': record[material_idx]} for record in records]
+            )
+            self._bulk_insert_locations(conn, layout_id, records)
+
+            total_records = conn.execute(
+                select(func.count()).select_from(t).where(t.c.layout_id == layout_id)
+            ).scalar()
+            conn.execute(
+                update(self.layouts).where(self.layouts.c.layout_id == layout_id)
+                .values(total_records=total_records, last_used_at=datetime.now())
+            )
+            conn.execute(
+                update(self.sessions).where(self.sessions.c.session_id == session_id)
+                .values(total_records=total_records, file_hash=file_hash)
+            )
+            return total_records
+
+    def count_materials(self, layout_id):
+        t = self.locations
+        with self.engine.connect() as conn:
+            return conn.execute(
+                select(func.count(t.c.material_code.distinct())).where(t.c.layout_id == layout_id)
+            ).scalar()
+
+    def save_layout_stats(self, layout_id, stats_rows):
+        if not stats_rows:
+            return
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.stats).where(
+                self.stats.c.layout_id == layout_id,
+                self.stats.c.zone.in_([row['zone'] for row in stats_rows])
+            ))
+            conn.execute(insert(self.stats), [dict(row, layout_id=layout_id) for row in stats_rows])
+
+    # ================= LECTURAS =================
+
+    def get_layout_stats(self, layout_id, zone=STATS_ALL_ZONES):
+        columns = [self.stats.c[name] for name in STATS_COLUMNS]
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(*columns).where(self.stats.c.layout_id == layout_id, self.stats.c.zone == zone)
+            ).mappings().first()
+        return dict(row) if row else None
+
+    def list_layout_stats(self, layout_id):
+        columns = [self.stats.c[name] for name in STATS_COLUMNS]
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(*columns).where(self.stats.c.layout_id == layout_id).order_by(self.stats.c.zone)
+            ).mappings().all()
+        return [dict(row) for row in rows]
+
+    def iter_locations(self, layout_id, limit=None, ordered=True, zones=None):
+        t = self.locations
+        query = select(*[t.c[name] for name in LOCATION_COLUMNS]).where(t.c.layout_id == layout_id)
+        if zones is not None:
+            query = query.where(t.c.zone.in_(zones))
+        if ordered:
+            query = query.order_by(t.c.zone, t.c.row_num, t.c.col_num)
+        if limit is not None:
+            query = query.limit(limit)
+
+        # stream_results usa un cursor del lado del servidor en Postgres
+        with self.engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=2000).execute(query)
+            for row in result.mappings():
+                yield dict(row)
+
+    def search_locations(self, layout_id, query, limit=50):
+        t = self.locations
+        search_term = f'%{query}%'
+        statement = (
+            select(t.c.location_code, t.c.zone, t.c.row_num, t.c.col_num, t.c.material_code,
+                   t.c.material_desc, t.c.quantity, t.c.capacity, t.c.ocupation_percent, t.c.status)
+            .where(t.c.layout_id == layout_id, or_(
+                t.c.location_code.like(search_term),
+                t.c.zone.like(search_term),
+                t.c.material_code.like(search_term),
+                t.c.material_desc.like(search_term),
+            ))
+            .order_by(t.c.location_code)
+            .limit(limit)
+        )
+        with self.engine.connect() as conn:
+            return [dict(row) for row in conn.execute(statement).mappings()]
+
+    # ================= MANTENIMIENTO (janitor) =================
+
+    def expire_sessions(self, limit):
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(self.sessions.c.session_id, self.sessions.c.layout_id)
+                .where(self.sessions.c.expires_at < datetime.now())
+                .limit(limit)
+            ).all()
+            for session_id, layout_id in rows:
+                conn.execute(delete(self.sessions).where(self.sessions.c.session_id == session_id))
+                if layout_id:
+                    conn.execute(
+                        update(self.layouts)
+                        .where(self.layouts.c.layout_id == layout_id, self.layouts.c.ref_count > 0)
+                        .values(ref_count=self.layouts.c.ref_count - 1)
+                    )
+        return len(rows)
+
+    def mark_unreferenced_layouts(self):
+        with self.engine.begin() as conn:
+            conn.execute(
+                update(self.layouts).where(self.layouts.c.ref_count == 0)
+                .values(ref_count=-1, content_hash=None)
+            )
+            return list(conn.execute(
+                select(self.layouts.c.layout_id).where(self.layouts.c.ref_count < 0)
+            ).scalars())
+
+    def delete_layout_rows(self, layout_id, limit):
+        t = self.locations
+        condition = t.c.layout_id.is_(None) if layout_id is None else t.c.layout_id == layout_id
+        with self.engine.begin() as conn:
+            ids = select(t.c.id).where(condition).limit(limit).scalar_subquery()
+            return conn.execute(delete(t).where(t.c.id.in_(ids))).rowcount
+
+    def drop_layout(self, layout_id):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.stats).where(self.stats.c.layout_id == layout_id))
+            conn.execute(delete(self.layouts).where(self.layouts.c.layout_id == layout_id))
+
+    def sweep_orphan_metadata(self):
+        existing = select(self.layouts.c.layout_id)
+        with self.engine.begin() as conn:
+            swept = conn.execute(delete(self.sessions).where(
+                (self.sessions.c.layout_id.is_(None)) | (self.sessions.c.layout_id.not_in(existing))
+            )).rowcount
+            swept += conn.execute(delete(self.stats).where(self.stats.c.layout_id.not_in(existing))).rowcount
+        return swept
+
+    def orphan_location_layouts(self, limit):
+        t = self.locations
+        with self.engine.connect() as conn:
+            return list(conn.execute(
+                select(t.c.layout_id).distinct()
+                .where((t.c.layout_id.is_(None)) | (t.c.layout_id.not_in(select(self.layouts.c.layout_id))))
+                .limit(limit)
+            ).scalars())
+
+
+def create_storage(app, db_path: str) -> WarehouseStorage:
+    """Crear el almacenamiento según WAREHOUSE2D_STORAGE ('sqlite' local o 'database')"""
+    backend = app.config.get('WAREHOUSE2D_STORAGE', 'sqlite')
+
+    if backend == 'database':
+        from models import db
+        with app.app_context():
+            engine = db.engine
+        logger.info(f"Mapa 2D usando la base principal ({engine.dialect.name})")
+        return SQLAlchemyWarehouseStorage(engine)
+
+    return SQLiteWarehouseStorage(db_path)